@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PrayerRequestForm, BaptismRequestForm, DedicationForm, MembershipTransferForm, Events, BenevolenceForm, ContactForm, Announcements
+from .models import PrayerRequestForm, BaptismRequestForm, DedicationForm, MembershipTransferForm, Events, BenevolenceForm, ContactForm, Announcements, EmailOutbox, DigestWatermark, SubmissionCounter
 
 class AdminModel(admin.ModelAdmin):
     pass
@@ -13,4 +13,7 @@ admin.site.register(MembershipTransferForm)
 admin.site.register(Events)
 admin.site.register(BenevolenceForm)
 admin.site.register(ContactForm)
-admin.site.register(Announcements)
\ No newline at end of file
+admin.site.register(Announcements)
+admin.site.register(EmailOutbox)
+admin.site.register(DigestWatermark)
+admin.site.register(SubmissionCounter)
\ No newline at end of file
@@ -0,0 +1,156 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
+from django.utils import timezone
+from .models import SubmissionCounter
+from .submissions import SUBMISSION_TYPES, submission_type
+
+
+# ------------------------------------------------------
+# Maintaining
+# ------------------------------------------------------
+def bump(form_type, status, delta):
+    """
+    Add `delta` to one counter with a single UPDATE (count = count + delta),
+    creating the row the first time a status is seen. Call inside the
+    transaction that made the change.
+    """
+    counter = SubmissionCounter.objects.filter(form_type=form_type, status=status)
+    if not counter.update(count=F("count") + delta, updated_at=timezone.now()):
+        SubmissionCounter.objects.bulk_create(
+            [SubmissionCounter(form_type=form_type, status=status)], ignore_conflicts=True
+        )
+        counter.update(count=F("count") + delta, updated_at=timezone.now())
+
+
+def move(form_type, old_status, new_status, n=1):
+    """
+    Move `n` submissions from one status counter to another: a single
+    UPDATE when both counters exist, two bumps the first time.
+    """
+    counters = SubmissionCounter.objects.filter(form_type=form_type, status__in=[old_status, new_status])
+    delta = Case(When(status=old_status, then=Value(-n)), default=Value(n))
+    moved = counters.update(count=F("count") + delta, updated_at=timezone.now())
+    if moved != 2:
+        # A counter is missing: undo the half that applied and bump both (creating it)
+        if moved:
+            counters.update(count=F("count") - delta)
+        bump(form_type, old_status, -n)
+        bump(form_type, new_status, n)
+
+
+def record_status_change(model, old_status, new_status):
+    if old_status != new_status:
+        move(model._meta.model_name, old_status, new_status)
+
+
+def change_status(instance, new_status):
+    """
+    Set a submission's status and move it between counters in one
+    transaction. The row is locked while we read its current status, so
+    two people changing the same submission at once can't count it twice.
+    """
+    model = type(instance)
+    with transaction.atomic():
+        old_status = model.objects.select_for_update().values_list("status", flat=True).get(pk=instance.pk)
+        if old_status != new_status:
+            model.objects.filter(pk=instance.pk).update(status=new_status)
+            record_status_change(model, old_status, new_status)
+    instance.status = new_status
+    return instance
+
+
+def bulk_change_status(types, status, ids=None, filters=None):
+    """
+    Set `status` on many submissions with one set-based UPDATE per form
+    type, selected by `ids` ({type: [id, ...]}) or `filters`
+    (status / created_after / created_before). Rows already in `status`
+    are left alone. When every changed row must have come from a single
+    status (the filter names it, or the model has only two), the counters
+    move by the row count; otherwise that type is recounted.
+    Returns {type: rows changed}.
+    """
+    filters = filters or {}
+    updated = {}
+    recount = []
+
+    with transaction.atomic():
+        for submission in types:
+            queryset = submission.model.objects.all()
+            if ids is not None:
+                queryset = queryset.filter(pk__in=ids.get(submission.slug, []))
+            if filters.get("created_after"):
+                queryset = queryset.filter(created_at__gte=filters["created_after"])
+            if filters.get("created_before"):
+                queryset = queryset.filter(created_at__lt=filters["created_before"])
+
+            sources = [s for s in submission.statuses if s != status]
+            if filters.get("status"):
+                sources = [s for s in sources if s == filters["status"]]
+
+            updated[submission.slug] = queryset.filter(status__in=sources).update(status=status) if sources else 0
+            if updated[submission.slug]:
+                if len(sources) == 1:
+                    move(submission.key, sources[0], status, updated[submission.slug])
+                else:
+                    recount.append(submission)
+
+        if recount:
+            rebuild_counters(recount)
+
+    return updated
+
+
+# ------------------------------------------------------
+# Reading
+# ------------------------------------------------------
+def submission_counts():
+    """
+    {type: {status: count}} for every form type and status, read straight
+    from the counters table: a few dozen rows, one query, so every worker
+    sees a change as soon as it commits.
+    """
+    counts = {t.slug: {status: 0 for status in t.statuses} for t in SUBMISSION_TYPES.values()}
+    for form_type, status, count in SubmissionCounter.objects.values_list("form_type", "status", "count"):
+        if form_type in SUBMISSION_TYPES:
+            counts[submission_type(form_type).slug][status] = count
+    return counts
+
+
+def unread_counts(counts=None):
+    """{type: submissions still in their initial status}"""
+    counts = counts or submission_counts()
+    return {t.slug: counts[t.slug].get(t.new_status, 0) for t in SUBMISSION_TYPES.values()}
+
+
+# ------------------------------------------------------
+# Repair
+# ------------------------------------------------------
+def rebuild_counters(types=None, dry_run=False):
+    """
+    Recount every form table in `types` (default: all; one grouped query
+    each) and overwrite the counters. Counter rows are locked first, so a
+    submission created meanwhile is neither lost nor counted twice.
+    Returns [(type, status, stored, actual)] for every counter that was wrong.
+    """
+    drift = []
+    with transaction.atomic():
+        for submission in types or SUBMISSION_TYPES.values():
+            stored = dict(
+                SubmissionCounter.objects
+                .select_for_update()
+                .filter(form_type=submission.key)
+                .values_list("status", "count")
+            )
+            actual = dict(
+                submission.model.objects.order_by().values("status").annotate(n=Count("id")).values_list("status", "n")
+            )
+            for status in sorted(set(stored) | set(actual)):
+                count = actual.get(status, 0)
+                if stored.get(status) == count:
+                    continue
+                drift.append((submission.slug, status, stored.get(status, 0), count))
+                if not dry_run:
+                    SubmissionCounter.objects.update_or_create(
+                        form_type=submission.key, status=status, defaults={"count": count}
+                    )
+    return drift
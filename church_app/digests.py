@@ -0,0 +1,116 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import DigestWatermark
+from .outbox import enqueue_email
+from .submissions import digest_roles, digest_types, role_recipients
+
+
+def local_time(value):
+    return timezone.localtime(value).strftime("%d %b %Y %H:%M") if value else ""
+
+
+def locked_watermarks(role, keys):
+    """Watermarks for `role` (created on first use), locked for this run."""
+    DigestWatermark.objects.bulk_create(
+        [DigestWatermark(form_type=key, role=role) for key in keys], ignore_conflicts=True
+    )
+    marks = DigestWatermark.objects.select_for_update().filter(role=role, form_type__in=keys)
+    return {mark.form_type: mark for mark in marks}
+
+
+def new_submissions(submission, mark, interval, now):
+    """
+    Rows after the watermark in (created_at, id) order, one query. A type
+    with no watermark yet starts from the last interval instead of its
+    whole history.
+
+    Ids are handed out before commit, so a higher id can become visible
+    before a lower one. Rows newer than NOTIFICATION_DIGEST_SETTLE seconds
+    are left for the next run, giving slower transactions time to commit
+    before the watermark moves past them.
+    """
+    settle = timedelta(seconds=getattr(settings, "NOTIFICATION_DIGEST_SETTLE", 60))
+    queryset = submission.model.objects.filter(created_at__lte=now - settle)
+    if mark.last_created_at:
+        queryset = queryset.filter(
+            Q(created_at__gt=mark.last_created_at) | Q(created_at=mark.last_created_at, id__gt=mark.last_id)
+        )
+    else:
+        queryset = queryset.filter(created_at__gte=now - interval)
+    return list(submission.rows(queryset.order_by("created_at", "id")))
+
+
+def render_digest(sections, max_items):
+    """Subject and body for [(submission, rows)]."""
+    total = sum(len(rows) for _, rows in sections)
+    summary = ", ".join(f"{len(rows)} {submission.label}" for submission, rows in sections)
+    subject = f"Submissions Digest: {total} new ({summary})"
+
+    parts = [f"Hello,\n\n{total} new submissions since the last digest.\n"]
+    for submission, rows in sections:
+        parts.append(f"=== {submission.label}: {len(rows)} new ===\n")
+        for row in rows[:max_items]:
+            parts.append(
+                f"--- {submission.label} #{row['id']} ({local_time(row.get('created_at'))}) ---\n"
+                f"{submission.details(row)}\n"
+            )
+        if len(rows) > max_items:
+            parts.append(f"... and {len(rows) - max_items} more.\n")
+
+    parts.append(
+        f"View full details here:\n{settings.FRONTEND_BASE_URL}\n\n"
+        f"Regards,\nKahawa Wendani SDA Portal"
+    )
+    return subject, "\n".join(parts)
+
+
+def send_role_digest(role, now=None):
+    """
+    Queue one digest email for `role` covering every digest-mode type that
+    is due (its interval has passed since it was last included). The
+    outbox row and the advanced watermarks commit together, so a
+    submission is never mailed twice or skipped.
+    Returns the number of submissions included.
+    """
+    now = now or timezone.now()
+    recipients = role_recipients(role)
+    types = digest_types(role)
+    if not recipients or not types:
+        return 0
+
+    max_items = getattr(settings, "NOTIFICATION_DIGEST_MAX_ITEMS", 100)
+    with transaction.atomic():
+        marks = locked_watermarks(role, [submission.key for submission, _ in types])
+        sections = []
+        for submission, interval in types:
+            mark = marks[submission.key]
+            if mark.last_sent_at and now - mark.last_sent_at < interval:
+                continue
+            rows = new_submissions(submission, mark, interval, now)
+            if rows:
+                sections.append((submission, rows))
+                mark.last_created_at = rows[-1]["created_at"]
+                mark.last_id = rows[-1]["id"]
+                mark.last_sent_at = now
+
+        if not sections:
+            return 0
+
+        subject, body = render_digest(sections, max_items)
+        enqueue_email(subject=subject, body=body, recipients=recipients, source=f"digest:{role}")
+        DigestWatermark.objects.bulk_update(marks.values(), ["last_created_at", "last_id", "last_sent_at"])
+
+    return sum(len(rows) for _, rows in sections)
+
+
+def send_digests(roles=None, now=None, stdout=None):
+    """Run every digest that is due. Returns {role: submissions included}."""
+    counts = {}
+    for role in roles or digest_roles():
+        counts[role] = send_role_digest(role, now)
+        if stdout and counts[role]:
+            stdout.write(f"Queued {role} digest with {counts[role]} submissions")
+    return counts
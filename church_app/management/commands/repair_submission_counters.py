@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from church_app.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the submission counters (per form type and status) from the form tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without fixing it")
+
+    def handle(self, *args, **options):
+        drift = rebuild_counters(dry_run=options["dry_run"])
+        for form_type, status, stored, actual in drift:
+            self.stdout.write(f"{form_type} {status}: counter {stored}, actual {actual}")
+
+        verb = "Found" if options["dry_run"] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(drift)} counters with drift"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from church_app.models import EmailOutbox
+from church_app.outbox import run_sender
+
+
+class Command(BaseCommand):
+    help = "Send queued notification emails over one persistent SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Emails claimed per batch")
+        parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds to wait when the outbox is empty")
+        parser.add_argument("--stale-after", type=int, default=300, help="Seconds before a SENDING email is retried")
+        parser.add_argument("--once", action="store_true", help="Drain the outbox and exit")
+        parser.add_argument("--retry-dead", action="store_true", help="Put dead-lettered emails back in the queue first")
+
+    def handle(self, *args, **options):
+        if options["retry_dead"]:
+            revived = EmailOutbox.objects.filter(status=EmailOutbox.DEAD).update(
+                status=EmailOutbox.PENDING, attempts=0, next_attempt_at=timezone.now()
+            )
+            self.stdout.write(f"Requeued {revived} dead-lettered emails")
+
+        sent, retried, dead = run_sender(
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+            stale_after=options["stale_after"],
+            once=options["once"],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Done: sent={sent}, retried={retried}, dead={dead}"))
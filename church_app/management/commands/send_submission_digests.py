@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from church_app.digests import send_digests
+
+
+class Command(BaseCommand):
+    help = "Queue notification digests for form types in digest mode (SUBMISSION_NOTIFICATIONS)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--role", action="append", help="Only these recipient roles (repeatable)")
+        parser.add_argument("--loop", action="store_true", help="Keep running instead of exiting after one pass")
+        parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between passes with --loop")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            counts = send_digests(roles=options["role"], stdout=self.stdout)
+            total += sum(counts.values())
+            if not options["loop"]:
+                break
+            time.sleep(options["poll_interval"])
+        self.stdout.write(self.style.SUCCESS(f"Done: {total} submissions queued in digests"))
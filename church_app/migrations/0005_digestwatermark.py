@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_app', '0004_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('form_type', models.CharField(max_length=50)),
+                ('role', models.CharField(max_length=50)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('last_sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('form_type', 'role'), name='digest_watermark_unique')],
+            },
+        ),
+    ]
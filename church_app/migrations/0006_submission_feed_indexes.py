@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_app', '0005_digestwatermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prayerrequestform',
+            index=models.Index(fields=['created_at', 'id'], name='prayer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prayerrequestform',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='prayer_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='baptismrequestform',
+            index=models.Index(fields=['created_at', 'id'], name='baptism_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='baptismrequestform',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='baptism_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dedicationform',
+            index=models.Index(fields=['created_at', 'id'], name='dedication_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dedicationform',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='dedication_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershiptransferform',
+            index=models.Index(fields=['created_at', 'id'], name='membership_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershiptransferform',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='membership_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='benevolenceform',
+            index=models.Index(fields=['created_at', 'id'], name='benevolence_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='benevolenceform',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='benevolence_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactform',
+            index=models.Index(fields=['created_at', 'id'], name='contact_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactform',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='contact_status_created_idx'),
+        ),
+    ]
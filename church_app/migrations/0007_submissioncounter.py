@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+FORM_MODELS = [
+    'prayerrequestform', 'baptismrequestform', 'dedicationform',
+    'membershiptransferform', 'benevolenceform', 'contactform',
+]
+
+
+def seed_counters(apps, schema_editor):
+    """Count the submissions that already exist, so badges start out right."""
+    SubmissionCounter = apps.get_model('church_app', 'SubmissionCounter')
+    counters = []
+    for model_name in FORM_MODELS:
+        model = apps.get_model('church_app', model_name)
+        rows = model.objects.order_by().values('status').annotate(n=Count('id'))
+        counters += [SubmissionCounter(form_type=model_name, status=row['status'], count=row['n']) for row in rows]
+    SubmissionCounter.objects.bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_app', '0006_submission_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('form_type', models.CharField(max_length=50)),
+                ('status', models.CharField(max_length=150)),
+                ('count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('form_type', 'status'), name='submission_counter_unique')],
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
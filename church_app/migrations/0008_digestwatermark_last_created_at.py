@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('church_app', '0007_submissioncounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digestwatermark',
+            name='last_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
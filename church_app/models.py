@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 from .validators import validate_file_extension, valdate_file_size
 
@@ -56,6 +57,10 @@ class PrayerRequestForm(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='prayer_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='prayer_status_created_idx'),
+        ]
 
     def __str__(self):
         return self.full_name or f"Prayer Request #{self.id}"
@@ -80,6 +85,10 @@ class BaptismRequestForm(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='baptism_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='baptism_status_created_idx'),
+        ]
 
     def __str__(self):
         return self.full_name
@@ -112,6 +121,10 @@ class DedicationForm(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='dedication_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='dedication_status_created_idx'),
+        ]
     
     def __str__(self):
         return self.child_full_name
@@ -147,6 +160,10 @@ class MembershipTransferForm(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='membership_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='membership_status_created_idx'),
+        ]
     
     def __str__(self):
         return self.full_name
@@ -247,6 +264,12 @@ class BenevolenceForm(models.Model):
     status = models.CharField(max_length=150, choices=REGISTRATION_STATUS, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='benevolence_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='benevolence_status_created_idx'),
+        ]
+
     def __str__(self):
         return self.head_full_name
 
@@ -278,6 +301,10 @@ class ContactForm(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='contact_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='contact_status_created_idx'),
+        ]
     
     def __str__(self):
         return self.full_name
@@ -302,4 +329,77 @@ class Announcements(models.Model):
         ordering = ['created_at']
     
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+
+class EmailOutbox(models.Model):
+    """
+    Emails waiting to be sent. Rows are written in the same DB transaction
+    as the form that caused them and sent by `manage.py send_outbox_emails`.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField(default=list)
+    source = models.CharField(max_length=100, blank=True)  # e.g. "prayerrequestform:12"
+    status = models.CharField(max_length=20, choices=STATUS, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({self.status})"
+
+
+class DigestWatermark(models.Model):
+    """Last submission included in a notification digest, per form type and recipient role"""
+    form_type = models.CharField(max_length=50)  # model name, e.g. "prayerrequestform"
+    role = models.CharField(max_length=50)
+    # (created_at, id) of the last submission included
+    last_created_at = models.DateTimeField(blank=True, null=True)
+    last_id = models.BigIntegerField(default=0)
+    last_sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['form_type', 'role'], name='digest_watermark_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.form_type} -> {self.role} (#{self.last_id})"
+
+
+class SubmissionCounter(models.Model):
+    """Number of submissions per form type and status, kept up to date as they change"""
+    form_type = models.CharField(max_length=50)  # model name, e.g. "prayerrequestform"
+    status = models.CharField(max_length=150)
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['form_type', 'status'], name='submission_counter_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.form_type} {self.status}: {self.count}"
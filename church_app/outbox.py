@@ -0,0 +1,209 @@
+import smtplib
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import EmailOutbox
+
+
+NUDGE_KEY = "email_outbox:nudge"
+
+
+# ------------------------------------------------------
+# Enqueue
+# ------------------------------------------------------
+def nudge():
+    """Tell a waiting sender there is mail (shared when CACHES is shared)."""
+    cache.set(NUDGE_KEY, 1, 300)
+
+
+def enqueue_email(subject, body, recipients, from_email=None, source=""):
+    """
+    Queue an email for the sender. Call inside the DB transaction that
+    saved whatever the email is about: both rows commit (or roll back)
+    together, and the sender is nudged only once they have committed.
+    """
+    recipients = [r for r in recipients if r]
+    if not recipients:
+        return None
+    email = EmailOutbox.objects.create(
+        subject=subject[:255],
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or "",
+        recipients=recipients,
+        source=source[:100],
+    )
+    transaction.on_commit(nudge)
+    return email
+
+
+# ------------------------------------------------------
+# Sender
+# ------------------------------------------------------
+def retry_delay(attempts):
+    """Exponential backoff: base, 2x base, 4x base ... capped."""
+    base = getattr(settings, "EMAIL_OUTBOX_RETRY_BASE", 60)
+    cap = getattr(settings, "EMAIL_OUTBOX_RETRY_MAX", 3600)
+    return min(base * 2 ** max(attempts - 1, 0), cap)
+
+
+def claim_batch(limit):
+    """
+    Move up to `limit` due emails to SENDING and return them.
+    SKIP LOCKED lets several senders share the outbox.
+    """
+    with transaction.atomic():
+        ids = list(
+            EmailOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=EmailOutbox.PENDING, next_attempt_at__lte=timezone.now())
+            .order_by("next_attempt_at", "id")
+            .values_list("id", flat=True)[:limit]
+        )
+        if not ids:
+            return []
+
+        EmailOutbox.objects.filter(id__in=ids).update(
+            status=EmailOutbox.SENDING,
+            locked_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+
+    return list(EmailOutbox.objects.filter(id__in=ids).order_by("id"))
+
+
+def record_failure(email, error):
+    """Schedule a retry with backoff, or dead-letter after the last attempt."""
+    max_attempts = getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 6)
+    error = f"{error.__class__.__name__}: {error}"
+    if email.attempts >= max_attempts:
+        EmailOutbox.objects.filter(pk=email.pk).update(
+            status=EmailOutbox.DEAD, locked_at=None, last_error=error[:1000]
+        )
+        return EmailOutbox.DEAD
+
+    EmailOutbox.objects.filter(pk=email.pk).update(
+        status=EmailOutbox.PENDING,
+        locked_at=None,
+        next_attempt_at=timezone.now() + timedelta(seconds=retry_delay(email.attempts)),
+        last_error=error[:1000],
+    )
+    return EmailOutbox.PENDING
+
+
+def send_batch(emails, connection):
+    """
+    Send claimed emails over one open SMTP connection. A dropped
+    connection is reopened once per message; anything else fails just
+    that message. Returns (sent, retried, dead).
+    """
+    sent_ids = []
+    retried = dead = 0
+
+    for email in emails:
+        message = EmailMessage(
+            subject=email.subject,
+            body=email.body,
+            from_email=email.from_email or None,
+            to=email.recipients,
+            connection=connection,
+        )
+        try:
+            try:
+                connection.send_messages([message])
+            except smtplib.SMTPServerDisconnected:
+                connection.close()
+                connection.open()
+                connection.send_messages([message])
+        except Exception as e:
+            if record_failure(email, e) == EmailOutbox.DEAD:
+                dead += 1
+            else:
+                retried += 1
+            continue
+        sent_ids.append(email.pk)
+
+    if sent_ids:
+        EmailOutbox.objects.filter(id__in=sent_ids).update(
+            status=EmailOutbox.SENT, sent_at=timezone.now(), locked_at=None, last_error=""
+        )
+    return len(sent_ids), retried, dead
+
+
+def release_stale(older_than):
+    """
+    Emails left in SENDING (the sender was killed) go back to the queue.
+    A notification sent twice is better than one never sent.
+    """
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return EmailOutbox.objects.filter(
+        status=EmailOutbox.SENDING, locked_at__lt=cutoff
+    ).update(status=EmailOutbox.PENDING, locked_at=None)
+
+
+def wait_for_mail(poll_interval):
+    """Sleep up to `poll_interval`, waking early when a commit nudges us."""
+    deadline = time.monotonic() + poll_interval
+    while time.monotonic() < deadline:
+        if cache.get(NUDGE_KEY):
+            cache.delete(NUDGE_KEY)
+            return
+        time.sleep(min(0.2, poll_interval))
+
+
+def run_sender(batch_size=50, poll_interval=5.0, stale_after=300, once=False, stdout=None):
+    """
+    Drain the outbox over one persistent SMTP connection, `batch_size`
+    emails per claim. Returns (sent, retried, dead).
+    """
+    sent = retried = dead = 0
+    connection = None
+
+    try:
+        while True:
+            release_stale(stale_after)
+            batch = claim_batch(batch_size)
+
+            if batch:
+                try:
+                    if connection is None:
+                        connection = get_connection(fail_silently=False)
+                        connection.open()
+                except Exception as e:
+                    # Mail server unreachable: back the whole batch off
+                    connection = None
+                    for email in batch:
+                        if record_failure(email, e) == EmailOutbox.DEAD:
+                            dead += 1
+                        else:
+                            retried += 1
+                    if stdout:
+                        stdout.write(f"Could not connect to the mail server: {e}")
+                    if once:
+                        break
+                    wait_for_mail(poll_interval)
+                    continue
+
+                counts = send_batch(batch, connection)
+                sent, retried, dead = sent + counts[0], retried + counts[1], dead + counts[2]
+                if stdout:
+                    stdout.write(f"Sent {counts[0]} of {len(batch)} (retry={counts[1]}, dead={counts[2]})")
+                continue
+
+            if once:
+                break
+
+            # Idle: don't hold the SMTP session open between bursts
+            if connection is not None:
+                connection.close()
+                connection = None
+            wait_for_mail(poll_interval)
+    finally:
+        if connection is not None:
+            connection.close()
+
+    return sent, retried, dead
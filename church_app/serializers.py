@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .submissions import TYPES_BY_SLUG
 from .models import PrayerRequestForm, BaptismRequestForm, DedicationForm, MembershipTransferForm, Events, BenevolenceForm, ContactForm, Announcements, Dependents
 
 # Serializer classes for forms
@@ -265,4 +266,57 @@ class AnnouncementsSerializer(serializers.ModelSerializer):
         if value.size > max_size:
             raise serializers.ValidationError("File size must not exceed 5 MB.")
 
-        return value
\ No newline at end of file
+        return value
+
+
+# ---------- BULK STATUS UPDATES ----------
+
+BULK_STATUS_MAX_IDS = 5000
+
+
+class BulkStatusFilterSerializer(serializers.Serializer):
+    """Which submissions to change when no ids are given"""
+    type = serializers.ListField(child=serializers.ChoiceField(choices=list(TYPES_BY_SLUG)), required=False)
+    status = serializers.CharField(max_length=150, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+
+class BulkStatusSerializer(serializers.Serializer):
+    """
+    {"status": "read", "ids": {"prayer": [1, 2], "contact": [7]}}
+    or {"status": "read", "filter": {"type": ["prayer"], "status": "unread"}}
+    """
+    status = serializers.CharField(max_length=150)
+    ids = serializers.DictField(
+        child=serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=BULK_STATUS_MAX_IDS),
+        required=False,
+    )
+    filter = BulkStatusFilterSerializer(required=False)
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Send either ids or filter.")
+
+        if 'ids' in attrs:
+            unknown = [slug for slug in attrs['ids'] if slug not in TYPES_BY_SLUG]
+            if unknown:
+                raise serializers.ValidationError({'ids': f"Unknown type: {unknown}. Must be one of: {list(TYPES_BY_SLUG)}"})
+            slugs = [slug for slug, ids in attrs['ids'].items() if ids]
+        elif attrs['filter'].get('type'):
+            slugs = attrs['filter']['type']
+        else:
+            # No type given: every type that has the target status
+            slugs = [slug for slug, t in TYPES_BY_SLUG.items() if attrs['status'] in t.statuses]
+            if not slugs:
+                raise serializers.ValidationError({'status': "No submission type has this status."})
+
+        # The target status has to be one of each selected model's choices
+        invalid = [slug for slug in slugs if attrs['status'] not in TYPES_BY_SLUG[slug].statuses]
+        if invalid:
+            raise serializers.ValidationError({
+                'status': {slug: f"Must be one of: {TYPES_BY_SLUG[slug].statuses}" for slug in invalid}
+            })
+
+        attrs['types'] = [TYPES_BY_SLUG[slug] for slug in slugs]
+        return attrs
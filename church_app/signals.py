@@ -1,29 +1,21 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.mail import send_mail
 from django.conf import settings
 from django.urls import reverse
 
 # Our models
 from .models import PrayerRequestForm, BaptismRequestForm, DedicationForm, MembershipTransferForm, BenevolenceForm, ContactForm
+from .counters import bump
+from .outbox import enqueue_email
+from .submissions import DIGEST, notification_config, recipients_for, submission_type
 
 def format_instance_details(instance):
     """
-    Helper function to loop through model fields and create a readable string.
+    Readable "Label: value" lines for a submission, using the field
+    metadata precomputed once per form type in submissions.py.
     """
-    details = []
-    # Loop through all fields in the model
-    for field in instance._meta.fields:
-        field_name = field.verbose_name.title() # Gets readable name (e.g. "First Name")
-        field_value = getattr(instance, field.name)
-        
-        # specific handling for choice fields to show the Label not the ID
-        if hasattr(instance, f'get_{field.name}_display'):
-            field_value = getattr(instance, f'get_{field.name}_display')()
-            
-        details.append(f"{field_name}: {field_value}")
-    
-    return "\n".join(details)
+    submission = submission_type(instance)
+    return submission.details(submission.instance_row(instance))
 
 @receiver(post_save, sender=PrayerRequestForm)
 @receiver(post_save, sender=BaptismRequestForm)
@@ -33,9 +25,15 @@ def format_instance_details(instance):
 @receiver(post_save, sender=ContactForm)
 def send_submission_notification(sender, instance, created, **kwargs):
     """
-    Sends an email when a new request is created.
+    Queues a notification email when a new request is created.
+    The outbox row commits with the form; `manage.py send_outbox_emails` sends it.
+    Types in digest mode are left for `manage.py send_submission_digests`.
     """
     if created: # Only send on creation, not on updates (like status changes)
+        mode, roles, _ = notification_config(sender._meta.model_name)
+        if mode == DIGEST:
+            return
+
         subject = f"New Submission: {instance._meta.verbose_name.title()}"
         
         # 1. Get all data details
@@ -60,14 +58,34 @@ def send_submission_notification(sender, instance, created, **kwargs):
             f"Regards,\nKahawa Wendani SDA Portal"
         )
 
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[settings.NOTIFICATION_EMAIL],
-                fail_silently=False,
-            )
-        except Exception as e:
-            # Log the error so the user request doesn't crash if email fails
-            print(f"Failed to send email: {e}")
\ No newline at end of file
+        enqueue_email(
+            subject=subject,
+            body=message,
+            recipients=recipients_for(roles),
+            source=f"{model_name}:{instance.pk}",
+        )
+
+
+@receiver(post_save, sender=PrayerRequestForm)
+@receiver(post_save, sender=BaptismRequestForm)
+@receiver(post_save, sender=DedicationForm)
+@receiver(post_save, sender=MembershipTransferForm)
+@receiver(post_save, sender=BenevolenceForm)
+@receiver(post_save, sender=ContactForm)
+def count_new_submission(sender, instance, created, **kwargs):
+    """
+    New submissions add to their status counter in the same transaction.
+    Status changes go through counters.change_status instead.
+    """
+    if created:
+        bump(sender._meta.model_name, instance.status, 1)
+
+
+@receiver(post_delete, sender=PrayerRequestForm)
+@receiver(post_delete, sender=BaptismRequestForm)
+@receiver(post_delete, sender=DedicationForm)
+@receiver(post_delete, sender=MembershipTransferForm)
+@receiver(post_delete, sender=BenevolenceForm)
+@receiver(post_delete, sender=ContactForm)
+def count_deleted_submission(sender, instance, **kwargs):
+    bump(sender._meta.model_name, instance.status, -1)
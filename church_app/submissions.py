@@ -0,0 +1,118 @@
+from datetime import timedelta
+from django.conf import settings
+from .models import PrayerRequestForm, BaptismRequestForm, DedicationForm, MembershipTransferForm, BenevolenceForm, ContactForm
+
+
+IMMEDIATE = "immediate"
+DIGEST = "digest"
+
+
+class SubmissionType:
+    """
+    Everything needed to describe one public form, worked out once:
+    field labels and choice labels, so rendering a submission is a dict
+    lookup per field instead of walking `_meta.fields` per instance.
+    """
+
+    def __init__(self, model, slug, name_field, summary_field):
+        self.model = model
+        self.key = model._meta.model_name  # e.g. "prayerrequestform"
+        self.slug = slug  # short name used by the API, e.g. "prayer"
+        self.label = model._meta.verbose_name.title()
+        # What the inbox shows for each submission
+        self.name_field = name_field
+        self.summary_field = summary_field
+        status = model._meta.get_field("status")
+        self.statuses = [value for value, _ in status.flatchoices]
+        self.new_status = status.default  # "unread" / "pending": not yet handled
+        # (attname, label, {value: display}) in declaration order
+        self.fields = [
+            (field.attname, field.verbose_name.title(), dict(field.flatchoices) if field.choices else None)
+            for field in model._meta.concrete_fields
+        ]
+        self.field_names = [attname for attname, _, _ in self.fields]
+
+    def display(self, row):
+        """[(label, value)] for a `.values()` row, choice fields shown by their label."""
+        return [
+            (label, choices.get(row[attname], row[attname]) if choices else row[attname])
+            for attname, label, choices in self.fields
+        ]
+
+    def details(self, row):
+        return "\n".join(f"{label}: {value}" for label, value in self.display(row))
+
+    def instance_row(self, instance):
+        return {attname: getattr(instance, attname) for attname in self.field_names}
+
+    def rows(self, queryset):
+        """One query: plain dicts with exactly the fields we render."""
+        return queryset.values(*self.field_names)
+
+
+SUBMISSION_TYPES = {
+    t.key: t for t in [
+        SubmissionType(PrayerRequestForm, "prayer", "full_name", "prayer_request"),
+        SubmissionType(BaptismRequestForm, "baptism", "full_name", "additional_information"),
+        SubmissionType(DedicationForm, "dedication", "child_full_name", "additional_information"),
+        SubmissionType(MembershipTransferForm, "membership", "full_name", "from_church_name"),
+        SubmissionType(BenevolenceForm, "benevolence", "head_full_name", "membership_status"),
+        SubmissionType(ContactForm, "contact", "full_name", "subject"),
+    ]
+}
+TYPES_BY_SLUG = {t.slug: t for t in SUBMISSION_TYPES.values()}
+
+
+def submission_type(model_or_key):
+    key = model_or_key if isinstance(model_or_key, str) else model_or_key._meta.model_name
+    return SUBMISSION_TYPES[key]
+
+
+# ------------------------------------------------------
+# Notification settings
+# ------------------------------------------------------
+def notification_config(key):
+    """
+    (mode, roles, interval) for a form type. Types missing from
+    SUBMISSION_NOTIFICATIONS are sent immediately to the office.
+    """
+    config = getattr(settings, "SUBMISSION_NOTIFICATIONS", {}).get(key, {})
+    interval = config.get("interval", getattr(settings, "NOTIFICATION_DIGEST_INTERVAL", 60))
+    return config.get("mode", IMMEDIATE), config.get("roles", ["office"]), timedelta(minutes=interval)
+
+
+def role_recipients(role):
+    """The office is NOTIFICATION_EMAIL; other roles are listed in NOTIFICATION_ROLES."""
+    if role == "office":
+        emails = [settings.NOTIFICATION_EMAIL]
+    else:
+        emails = getattr(settings, "NOTIFICATION_ROLES", {}).get(role, [])
+    return [email for email in emails if email]
+
+
+def recipients_for(roles):
+    recipients = []
+    for role in roles:
+        for email in role_recipients(role):
+            if email not in recipients:
+                recipients.append(email)
+    return recipients
+
+
+def digest_types(role):
+    """Submission types delivered to `role` as a digest."""
+    types = []
+    for key, submission in SUBMISSION_TYPES.items():
+        mode, roles, interval = notification_config(key)
+        if mode == DIGEST and role in roles:
+            types.append((submission, interval))
+    return types
+
+
+def digest_roles():
+    roles = set()
+    for key in SUBMISSION_TYPES:
+        mode, type_roles, _ = notification_config(key)
+        if mode == DIGEST:
+            roles.update(type_roles)
+    return sorted(roles)
@@ -1,3 +1,463 @@
-from django.test import TestCase
+import smtplib
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .counters import rebuild_counters, submission_counts, unread_counts
+from .digests import send_digests
+from .models import (
+    BaptismRequestForm, BenevolenceForm, ContactForm, DedicationForm, DigestWatermark, EmailOutbox,
+    MembershipTransferForm, PrayerRequestForm, SubmissionCounter,
+)
+from .outbox import NUDGE_KEY, enqueue_email, retry_delay, run_sender
+from .signals import format_instance_details
+
+
+CONTACT = {
+    "full_name": "Grace Wanjiku",
+    "email": "grace@example.com",
+    "phone_number": "0712345678",
+    "subject": "Visit",
+    "message": "Please call me",
+}
+
+
+@override_settings(NOTIFICATION_EMAIL="office@example.com", DEFAULT_FROM_EMAIL="portal@example.com")
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        cache.delete(NUDGE_KEY)
+
+    def test_submission_queues_email_without_sending(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(reverse("contact-form-submit"), CONTACT, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        email = EmailOutbox.objects.get()
+        self.assertEqual(email.status, EmailOutbox.PENDING)
+        self.assertEqual(email.recipients, ["office@example.com"])
+        self.assertEqual(email.source, f"contactform:{ContactForm.objects.get().pk}")
+        self.assertIn("Please call me", email.body)
+        self.assertTrue(cache.get(NUDGE_KEY))
+
+    def test_outbox_row_rolls_back_with_the_form(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                ContactForm.objects.create(full_name="X", subject="Y", message="Z")
+                raise RuntimeError
+
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_sender_drains_outbox_over_one_connection(self):
+        for i in range(3):
+            enqueue_email(f"Subject {i}", "Body", ["a@example.com"])
+
+        with mock.patch("church_app.outbox.get_connection", wraps=mail.get_connection) as get_connection:
+            sent, retried, dead = run_sender(batch_size=2, once=True)
+
+        self.assertEqual((sent, retried, dead), (3, 0, 0))
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].from_email, "portal@example.com")
+        self.assertFalse(EmailOutbox.objects.exclude(status=EmailOutbox.SENT).exists())
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_RETRY_BASE=60)
+    def test_failures_back_off_then_dead_letter(self):
+        email = enqueue_email("Subject", "Body", ["a@example.com"])
+        broken = mock.Mock()
+        broken.send_messages.side_effect = smtplib.SMTPRecipientsRefused({})
+
+        with mock.patch("church_app.outbox.get_connection", return_value=broken):
+            self.assertEqual(run_sender(once=True), (0, 1, 0))
+            email.refresh_from_db()
+            self.assertEqual(email.status, EmailOutbox.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertGreater(email.next_attempt_at, timezone.now())
+
+            # Not due yet: nothing is claimed
+            self.assertEqual(run_sender(once=True), (0, 0, 0))
+
+            EmailOutbox.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(run_sender(once=True), (0, 0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, EmailOutbox.DEAD)
+        self.assertTrue(email.last_error.startswith("SMTPRecipientsRefused"))
+
+    def test_unreachable_server_requeues_batch(self):
+        enqueue_email("Subject", "Body", ["a@example.com"])
+        broken = mock.Mock()
+        broken.open.side_effect = OSError("connection refused")
+
+        with mock.patch("church_app.outbox.get_connection", return_value=broken):
+            self.assertEqual(run_sender(once=True), (0, 1, 0))
+
+        email = EmailOutbox.objects.get()
+        self.assertEqual(email.status, EmailOutbox.PENDING)
+        self.assertEqual(email.last_error, "OSError: connection refused")
+
+    @override_settings(EMAIL_OUTBOX_RETRY_BASE=60, EMAIL_OUTBOX_RETRY_MAX=300)
+    def test_retry_delay_doubles_and_caps(self):
+        self.assertEqual([retry_delay(n) for n in (1, 2, 3, 4, 5)], [60, 120, 240, 300, 300])
+
+
+def legacy_details(instance):
+    """What format_instance_details produced before it used precomputed metadata."""
+    details = []
+    for field in instance._meta.fields:
+        value = getattr(instance, field.name)
+        if hasattr(instance, f"get_{field.name}_display"):
+            value = getattr(instance, f"get_{field.name}_display")()
+        details.append(f"{field.verbose_name.title()}: {value}")
+    return "\n".join(details)
+
+
+DIGEST_NOTIFICATIONS = {
+    "prayerrequestform": {"mode": "digest", "roles": ["office", "pastoral"]},
+    "contactform": {"mode": "digest", "roles": ["office"], "interval": 30},
+    "benevolenceform": {"mode": "immediate", "roles": ["office", "pastoral"]},
+}
+
+
+@override_settings(
+    NOTIFICATION_EMAIL="office@example.com",
+    NOTIFICATION_ROLES={"pastoral": ["pastor@example.com"]},
+    SUBMISSION_NOTIFICATIONS=DIGEST_NOTIFICATIONS,
+    NOTIFICATION_DIGEST_INTERVAL=60,
+    NOTIFICATION_DIGEST_SETTLE=0,
+)
+class SubmissionDigestTests(TestCase):
+    def prayer(self, text="Pray for my family"):
+        return PrayerRequestForm.objects.create(prayer_type="family request", prayer_request=text)
+
+    def contact(self, subject="Visit"):
+        return ContactForm.objects.create(full_name="Grace", subject=subject, message="Hello")
+
+    def test_details_match_field_walk(self):
+        prayer = PrayerRequestForm.objects.create(
+            prayer_type="health & healing", prayer_request="Healing", wants_visitation=True,
+            prayer_cell="Garrison", visitation_method="home_visit",
+        )
+        self.assertEqual(format_instance_details(prayer), legacy_details(prayer))
+        self.assertIn("Visitation Method: Visit at Home", format_instance_details(prayer))
+
+    def test_digest_types_queue_nothing_per_submission(self):
+        self.prayer()
+        self.contact()
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_immediate_types_go_to_every_role(self):
+        BenevolenceForm.objects.create(
+            head_full_name="Grace", head_phone_number="0712345678",
+            email="grace@example.com", membership_status="visitor",
+        )
+        email = EmailOutbox.objects.get()
+        self.assertEqual(email.recipients, ["office@example.com", "pastor@example.com"])
+
+    def test_one_email_per_role_one_query_per_model(self):
+        for i in range(5):
+            self.prayer(f"Request {i}")
+        for i in range(3):
+            self.contact(f"Subject {i}")
+
+        with CaptureQueriesContext(connection) as queries:
+            counts = send_digests()
+
+        self.assertEqual(counts, {"office": 8, "pastoral": 5})
+        for table in ("church_app_prayerrequestform", "church_app_contactform"):
+            form_selects = [q for q in queries if q["sql"].startswith("SELECT") and f'FROM "{table}"' in q["sql"]]
+            self.assertEqual(len(form_selects), 2 if table.endswith("prayerrequestform") else 1)
+
+        office = EmailOutbox.objects.get(source="digest:office")
+        self.assertEqual(office.recipients, ["office@example.com"])
+        self.assertIn("8 new", office.subject)
+        self.assertIn("Request 4", office.body)
+        self.assertIn("Subject 2", office.body)
+        pastoral = EmailOutbox.objects.get(source="digest:pastoral")
+        self.assertNotIn("Subject 2", pastoral.body)
+
+    def test_watermark_and_interval(self):
+        first = self.prayer("First")
+        now = timezone.now()
+        send_digests(roles=["office"], now=now)
+        mark = DigestWatermark.objects.get(form_type="prayerrequestform", role="office")
+        self.assertEqual(mark.last_id, first.id)
+
+        second = self.prayer("Second")
+        # Interval not over yet: nothing new is sent
+        self.assertEqual(send_digests(roles=["office"], now=now + timedelta(minutes=10)), {"office": 0})
+
+        self.assertEqual(send_digests(roles=["office"], now=now + timedelta(minutes=61)), {"office": 1})
+        latest = EmailOutbox.objects.filter(source="digest:office").latest("id")
+        self.assertIn("Second", latest.body)
+        self.assertNotIn("First", latest.body)
+        mark.refresh_from_db()
+        self.assertEqual(mark.last_id, second.id)
+
+    @override_settings(NOTIFICATION_DIGEST_SETTLE=60)
+    def test_row_committing_after_a_higher_id_is_not_skipped(self):
+        now = timezone.now()
+        gap = self.prayer("Gap")
+        quick = self.prayer("Quick")
+        gap_id = gap.id
+        gap.delete()
+        PrayerRequestForm.objects.filter(pk=quick.pk).update(created_at=now - timedelta(seconds=20))
+
+        # Quick has committed, but is still settling: the watermark stays put
+        self.assertEqual(send_digests(roles=["office"], now=now), {"office": 0})
+
+        # A slower transaction commits its lower id afterwards
+        PrayerRequestForm.objects.create(id=gap_id, prayer_request="Slow")
+        PrayerRequestForm.objects.filter(pk=gap_id).update(created_at=now - timedelta(seconds=30))
+
+        self.assertEqual(send_digests(roles=["office"], now=now + timedelta(minutes=2)), {"office": 2})
+        body = EmailOutbox.objects.get(source="digest:office").body
+        self.assertIn("Slow", body)
+        self.assertIn("Quick", body)
+
+    def test_first_digest_starts_from_last_interval(self):
+        old = self.prayer("Old")
+        PrayerRequestForm.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=2))
+        self.prayer("Recent")
+
+        send_digests(roles=["office"])
+        body = EmailOutbox.objects.get(source="digest:office").body
+        self.assertIn("Recent", body)
+        self.assertNotIn("Old", body)
+
+    @override_settings(NOTIFICATION_DIGEST_MAX_ITEMS=2)
+    def test_long_digests_are_truncated(self):
+        for i in range(5):
+            self.prayer(f"Request {i}")
+        send_digests(roles=["office"])
+        body = EmailOutbox.objects.get(source="digest:office").body
+        self.assertIn("5 new", body)
+        self.assertIn("... and 3 more.", body)
+        self.assertNotIn("Request 4", body)
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(email="elder@example.com", password="x"))
+        self.base = timezone.now()
+
+    def at(self, obj, minutes):
+        type(obj).objects.filter(pk=obj.pk).update(created_at=self.base - timedelta(minutes=minutes))
+        return obj
+
+    def seed(self):
+        """Seven submissions over four types, with a created_at tie across types."""
+        self.at(PrayerRequestForm.objects.create(prayer_request="p1"), 1)
+        self.at(ContactForm.objects.create(full_name="c1", subject="s1", message="m"), 2)
+        self.at(PrayerRequestForm.objects.create(prayer_request="p2", status="read"), 3)
+        self.at(ContactForm.objects.create(full_name="c2", subject="s2", message="m"), 3)
+        self.at(BaptismRequestForm.objects.create(full_name="b1", date_of_birth="2000-01-01"), 4)
+        self.at(BenevolenceForm.objects.create(
+            head_full_name="h1", head_phone_number="0712345678", email="h@example.com", membership_status="visitor",
+        ), 5)
+        self.at(MembershipTransferForm.objects.create(
+            full_name="m1", email="m@example.com", phone_number="0712345678", date_of_birth="2000-01-01",
+            from_church_name="Kasarani", from_district_name="d", from_conference_name="c", from_address="a",
+            to_church_name="Wendani", to_district_name="d", to_conference_name="c", to_address="a",
+            board_minute_number="1", first_reading_date="2025-01-01", second_reading_date="2025-01-08",
+            business_number="1", status="completed",
+        ), 6)
+
+    def walk(self, **params):
+        seen, url, pages = [], reverse("submission-inbox"), 0
+        while url:
+            response = self.client.get(url, params if pages == 0 else None)
+            self.assertEqual(response.status_code, 200)
+            seen += [(item["type"], item["name"] or item["summary"]) for item in response.data["results"]]
+            url, pages = response.data["next"], pages + 1
+        return seen, pages
+
+    def test_pages_merge_all_types_newest_first(self):
+        self.seed()
+        seen, pages = self.walk(page_size=2)
+        self.assertEqual(seen, [
+            ("prayer", "p1"), ("contact", "c1"), ("contact", "c2"), ("prayer", "p2"),
+            ("baptism", "b1"), ("benevolence", "h1"), ("membership", "m1"),
+        ])
+        self.assertEqual(pages, 4)
+
+    def test_filters_by_type_and_status(self):
+        self.seed()
+        self.assertEqual(self.walk(type="prayer,contact", status="unread")[0], [
+            ("prayer", "p1"), ("contact", "c1"), ("contact", "c2"),
+        ])
+        # Only types that have the status are queried at all
+        self.assertEqual(self.walk(status="pending")[0], [("benevolence", "h1")])
+
+    def test_one_query_per_page(self):
+        self.seed()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("submission-inbox"), {"page_size": 3})
+
+        feed = [q["sql"] for q in queries if q["sql"].startswith("SELECT") and "UNION ALL" in q["sql"]]
+        self.assertEqual(len(feed), 1)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertEqual(set(response.data["results"][0]), {"id", "type", "name", "summary", "status", "created_at"})
+        self.assertEqual(response.data["unread"], {
+            "prayer": 1, "baptism": 1, "dedication": 0, "membership": 0, "benevolence": 1, "contact": 2,
+        })
+
+    def test_rejects_bad_input_and_anonymous(self):
+        url = reverse("submission-inbox")
+        self.assertEqual(self.client.get(url, {"type": "sermon"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"cursor": "nonsense"}).status_code, 400)
+        self.assertEqual(APIClient().get(url).status_code, 401)
+
+
+class SubmissionCounterTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(email="elder@example.com", password="x"))
+
+    def prayers(self, n, **fields):
+        return [PrayerRequestForm.objects.create(prayer_request=f"p{i}", **fields) for i in range(n)]
+
+    def test_created_submissions_are_counted(self):
+        self.prayers(3)
+        self.prayers(1, status="read")
+        ContactForm.objects.create(full_name="c", subject="s", message="m")
+
+        counts = submission_counts()
+        self.assertEqual(counts["prayer"], {"read": 1, "unread": 3})
+        self.assertEqual(counts["contact"], {"contacted": 0, "unread": 1})
+        self.assertEqual(counts["dedication"], {"read": 0, "unread": 0, "completed": 0})
+
+    def test_status_endpoints_move_counts(self):
+        prayer = self.prayers(2)[0]
+        url = reverse("prayers-update-status", args=[prayer.pk])
+
+        self.client.patch(url, {"status": "read"}, format="json")
+        self.client.patch(url, {"status": "read"}, format="json")  # no change: counted once
+        self.assertEqual(submission_counts()["prayer"], {"read": 1, "unread": 1})
+
+        self.client.patch(url, {"status": "archived"}, format="json")
+        self.assertEqual(submission_counts()["prayer"], {"read": 1, "unread": 1})
+
+        benevolence = BenevolenceForm.objects.create(
+            head_full_name="h", head_phone_number="0712345678", email="h@example.com", membership_status="visitor",
+        )
+        url = reverse("benevolence-list")
+        self.client.get(url, {"id": benevolence.pk, "status": "accepted"})  # reading never changes anything
+        self.assertEqual(submission_counts()["benevolence"], {"pending": 1, "accepted": 0, "denied": 0})
+        self.client.patch(url, {"id": benevolence.pk, "status": "accepted"}, format="json")
+        self.assertEqual(submission_counts()["benevolence"], {"pending": 0, "accepted": 1, "denied": 0})
+
+    def test_edits_and_deletes_keep_counts(self):
+        baptism = BaptismRequestForm.objects.create(full_name="b", date_of_birth="2000-01-01")
+        url = reverse("bapstism-detail", args=[baptism.pk])
+
+        self.client.patch(url, {"status": "read"}, format="json")
+        self.assertEqual(submission_counts()["baptism"], {"read": 1, "unread": 0})
+
+        self.client.delete(url)
+        self.assertEqual(submission_counts()["baptism"], {"read": 0, "unread": 0})
+
+    def test_counts_endpoint_reads_the_counters_in_one_query(self):
+        self.prayers(1)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("submission-counts"))
+        self.assertEqual(response.data["unread"]["prayer"], 1)
+
+        self.prayers(1)
+        self.assertEqual(self.client.get(reverse("submission-counts")).data["unread"]["prayer"], 2)
+
+    def test_repair_recomputes_from_tables(self):
+        self.prayers(2)
+        ContactForm.objects.create(full_name="c", subject="s", message="m", status="contacted")
+        SubmissionCounter.objects.filter(form_type="prayerrequestform").update(count=40)
+        SubmissionCounter.objects.filter(form_type="contactform").delete()
+        PrayerRequestForm.objects.update(status="read")  # bypasses the counters
+
+        drift = rebuild_counters(dry_run=True)
+        self.assertEqual(drift, [
+            ("prayer", "read", 0, 2), ("prayer", "unread", 40, 0), ("contact", "contacted", 0, 1),
+        ])
+        self.assertEqual(SubmissionCounter.objects.get(form_type="prayerrequestform").count, 40)
+
+        rebuild_counters()
+        self.assertEqual(submission_counts()["prayer"], {"read": 2, "unread": 0})
+        self.assertEqual(submission_counts()["contact"], {"contacted": 1, "unread": 0})
+        self.assertEqual(rebuild_counters(), [])
+
+
+class BulkStatusTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(email="elder@example.com", password="x"))
+        self.url = reverse("submission-bulk-status")
+
+    def post(self, body):
+        return self.client.post(self.url, body, format="json")
+
+    def test_marking_500_items_is_one_update(self):
+        PrayerRequestForm.objects.bulk_create([PrayerRequestForm(prayer_request=f"p{i}") for i in range(520)])
+        rebuild_counters()
+        ids = list(PrayerRequestForm.objects.order_by("id").values_list("id", flat=True)[:500])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({"status": "read", "ids": {"prayer": ids}})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"updated": {"prayer": 500}, "total": 500})
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "church_app_prayerrequestform"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(submission_counts()["prayer"], {"read": 500, "unread": 20})
+        self.assertEqual(rebuild_counters(dry_run=True), [])
+
+        # Already read: nothing changes, nothing is counted
+        self.assertEqual(self.post({"status": "read", "ids": {"prayer": ids[:10]}}).data["total"], 0)
+
+    def test_filter_across_types(self):
+        PrayerRequestForm.objects.create(prayer_request="p")
+        BaptismRequestForm.objects.create(full_name="b", date_of_birth="2000-01-01")
+        ContactForm.objects.create(full_name="c", subject="s", message="m")
+
+        # Contact requests have no "read" status, so only the others are touched
+        response = self.post({"status": "read", "filter": {"status": "unread"}})
+        self.assertEqual(response.data["updated"], {"prayer": 1, "baptism": 1, "dedication": 0})
+        self.assertEqual(unread_counts(), {
+            "prayer": 0, "baptism": 0, "dedication": 0, "membership": 0, "benevolence": 0, "contact": 1,
+        })
+
+        response = self.post({"status": "contacted", "filter": {"type": ["contact"]}})
+        self.assertEqual(response.data["updated"], {"contact": 1})
+
+    def test_mixed_source_statuses_are_recounted(self):
+        DedicationForm.objects.bulk_create([
+            DedicationForm(
+                child_full_name=f"d{i}", date_birth="2024-01-01", father_full_name="f", father_phone_number="1",
+                mother_full_name="m", mother_phone_number="2", additional_information="-", status=status,
+            )
+            for i, status in enumerate(["unread", "read", "completed", "unread"])
+        ])
+        rebuild_counters()
+        ids = list(DedicationForm.objects.values_list("id", flat=True))
+
+        response = self.post({"status": "completed", "ids": {"dedication": ids}})
+        self.assertEqual(response.data["updated"], {"dedication": 3})
+        self.assertEqual(submission_counts()["dedication"], {"unread": 0, "read": 0, "completed": 4})
+
+    def test_validation(self):
+        self.assertEqual(self.post({"status": "read", "ids": {"membership": [1]}}).status_code, 400)
+        self.assertEqual(self.post({"status": "read", "ids": {"sermon": [1]}}).status_code, 400)
+        self.assertEqual(self.post({"status": "read"}).status_code, 400)
+        self.assertEqual(self.post({"status": "read", "ids": {"prayer": [1]}, "filter": {}}).status_code, 400)
+        self.assertEqual(self.post({"status": "nonsense", "filter": {}}).status_code, 400)
+
+        response = self.post({"status": "read", "ids": {"prayer": [1], "benevolence": [2]}})
+        self.assertEqual(list(response.data["status"]), ["benevolence"])
+        self.assertEqual(APIClient().post(self.url, {}, format="json").status_code, 401)
 
-# Create your tests here.
@@ -25,6 +25,11 @@ urlpatterns = [
     path('benevolence/', views.benevolence_list_view, name='benevolence-list'),
     path('benevolence/submit/', views.benevolence_submit_view, name='benevolence-submit'),
 
+    # Unified inbox across all form types
+    path('inbox/', views.inbox_view, name='submission-inbox'),
+    path('inbox/counts/', views.submission_counts_view, name='submission-counts'),
+    path('inbox/status/', views.bulk_status_view, name='submission-bulk-status'),
+
     # Events Handling endpoints
     # Events endpoints
     path('events/', views.events_submit, name='events-create'),                    # POST
@@ -4,12 +4,17 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.views import APIView
+from django.db import transaction
 from .utils import send_confirmation_email
+from .counters import bulk_change_status, change_status, record_status_change, submission_counts, unread_counts
+from .inbox import decode_cursor, inbox_page
+from .submissions import TYPES_BY_SLUG
+from rest_framework.utils.urls import replace_query_param
 
 from .serializers import (
     PrayerFormSerializer, BaptismFormSerializer, DedicationFromSerializer,
     MembershipSerializer, ContactFormSerializer, EventsSerializer,
-    AnnouncementsSerializer, BenevolenceSerializer
+    AnnouncementsSerializer, BenevolenceSerializer, BulkStatusSerializer
 )
 
 from .models import (
@@ -34,6 +39,19 @@ class PublicSubmitView(ModelViewSet):
             return [AllowAny()]
         return [IsAuthenticated()]
 
+    def perform_create(self, serializer):
+        # The notification outbox row commits together with the form
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_update(self, serializer):
+        # Keep the status counters right when an edit changes the status
+        with transaction.atomic():
+            model = type(serializer.instance)
+            old_status = model.objects.select_for_update().values_list('status', flat=True).get(pk=serializer.instance.pk)
+            instance = serializer.save()
+            record_status_change(model, old_status, instance.status)
+
 
 
 # ---------- PRAYER REQUESTS ----------
@@ -47,7 +65,7 @@ class PrayerRequestViewSet(PublicSubmitView):
 
     def perform_create(self, serializer):
         """When a prayer request is submitted (POST), save the data only."""
-        serializer.save()
+        super().perform_create(serializer)
 
 
     @action(detail=True, methods=['PATCH'], permission_classes=[IsAuthenticated])
@@ -58,8 +76,7 @@ class PrayerRequestViewSet(PublicSubmitView):
         if new_status not in dict(PrayerRequestForm.ACTION):
             return Response({"detail" : "Invalid Status"}, status=400)
         
-        prayer.status = new_status
-        prayer.save()
+        change_status(prayer, new_status)
         return Response(self.get_serializer(prayer).data)
 
 
@@ -78,8 +95,7 @@ class BaptismRequestViewSet(PublicSubmitView):
         if new_status not in dict(BaptismRequestForm.ACTION):
             return Response({"detail" : "Invalid Status"})
         
-        baptism.status = new_status
-        baptism.save()
+        change_status(baptism, new_status)
         return Response(self.get_serializer(baptism).data)
 
 
@@ -98,8 +114,7 @@ class DedicationViewSet(PublicSubmitView):
         if new_status not in dict(DedicationForm.ACTION):
             return Response({"detail" : "Invalid Status"})
         
-        dedication.status = new_status
-        dedication.save()
+        change_status(dedication, new_status)
         return Response(self.get_serializer(dedication).data)
 
 
@@ -113,7 +128,8 @@ def membership_submit_view(request):
     """Anyone can submit a memeberhsip transfer request"""
     serializer = MembershipSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -136,7 +152,8 @@ def contact_form_submit(request):
     """Submitting Contact Form"""
     serializer = ContactFormSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -161,25 +178,23 @@ def benevolence_submit_view(request):
     if request.method == 'POST':
         serializer = BenevolenceSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
-@api_view(['GET'])
+@api_view(['GET', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def benevolence_list_view(request):
     """
-    GET:
-    - Authenticated users can:
-      • View all benevolence forms
-      • Update the status of a specific form using query params (?id=<id>&status=<new_status>)
+    - GET: authenticated users view all benevolence forms
+    - PATCH {"id": <id>, "status": <new_status>}: update the status of one form
+      (many at once: inbox/status/)
     """
-    form_id = request.query_params.get('id')
-    new_status = request.query_params.get('status')
-
-    # If admin/staff wants to change status
-    if form_id and new_status:
+    if request.method == 'PATCH':
+        form_id = request.data.get('id')
+        new_status = request.data.get('status')
         valid_statuses = [choice[0] for choice in BenevolenceForm.REGISTRATION_STATUS]
 
         if new_status not in valid_statuses:
@@ -190,24 +205,95 @@ def benevolence_list_view(request):
 
         try:
             form = BenevolenceForm.objects.get(pk=form_id)
-        except BenevolenceForm.DoesNotExist:
+        except (BenevolenceForm.DoesNotExist, ValueError, TypeError):
             return Response(
                 {"detail": "Form not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        form.status = new_status
-        form.save()
+        change_status(form, new_status)
 
         serializer = BenevolenceSerializer(form)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-    # Otherwise, just list all
     forms = BenevolenceForm.objects.all().order_by('-created_at')
     serializer = BenevolenceSerializer(forms, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+# ---------- UNIFIED INBOX ENDPOINT ----------
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def inbox_view(request):
+    """
+    Every form submission in one feed, newest first, keyset-paginated.
+    GET ?type=prayer,contact&status=unread&page_size=50&cursor=<next>
+    Also returns the unread count for every type, from the maintained counters.
+    """
+    slugs = [s for s in request.query_params.get('type', '').split(',') if s]
+    unknown = [s for s in slugs if s not in TYPES_BY_SLUG]
+    if unknown:
+        return Response(
+            {"detail": f"Unknown type: {unknown}. Must be one of: {list(TYPES_BY_SLUG)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    cursor = request.query_params.get('cursor')
+    try:
+        page_size = min(max(int(request.query_params.get('page_size', 50)), 1), 200)
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    items, next_cursor = inbox_page(
+        slugs=slugs,
+        status=request.query_params.get('status') or None,
+        cursor=cursor,
+        page_size=page_size,
+    )
+    next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) if next_cursor else None
+    return Response({
+        "next": next_url,
+        "unread": unread_counts(),
+        "results": items,
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def submission_counts_view(request):
+    """
+    Dashboard badges: submissions per type and status, plus unread per type.
+    Served from the maintained counters, never by counting tables.
+    """
+    counts = submission_counts()
+    return Response({
+        "unread": unread_counts(counts),
+        "counts": counts,
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_status_view(request):
+    """
+    Change the status of many submissions at once, one UPDATE per form type.
+    POST {"status": "read", "ids": {"prayer": [1, 2], "contact": [7]}}
+      or {"status": "read", "filter": {"type": ["prayer"], "status": "unread"}}
+    Returns the number of submissions changed per type.
+    """
+    serializer = BulkStatusSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    data = serializer.validated_data
+    updated = bulk_change_status(
+        data['types'], data['status'], ids=data.get('ids'), filters=data.get('filter'),
+    )
+    return Response({"updated": updated, "total": sum(updated.values())}, status=status.HTTP_200_OK)
+
+
 # ---------- EVENTS HANDLING ENDPOINTS ----------
 
 
@@ -0,0 +1,325 @@
+import csv
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.utils import timezone
+from .models import BankStatementImport, BankStatementLine, MpesaTransaction
+from .search import normalize_phone
+from .transitions import FAILED, OPEN_STATUSES, SUCCESS, apply_results, reference_lookup
+
+
+# Accepted (lower-cased) header names for each staging column
+COLUMN_ALIASES = {
+    "receipt": ["receipt", "receipt no", "receipt number", "mpesa receipt", "transaction id"],
+    "reference": ["reference", "message reference", "account reference", "bill reference"],
+    "narration": ["narration", "details", "description"],
+    "amount": ["amount", "credit", "paid in", "credit amount"],
+    "phone": ["phone", "phone number", "msisdn", "mobile number"],
+    "date": ["date", "transaction date", "completion time", "value date"],
+}
+
+DATE_FORMATS = [
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d-%m-%Y %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S", "%d/%m/%Y", "%Y-%m-%d",
+]
+
+
+# ------------------------------------------------------
+# Parsing
+# ------------------------------------------------------
+def map_columns(header):
+    """{staging column: CSV header} for the headers this file has."""
+    lowered = {h.strip().lower(): h for h in header if h}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lowered:
+                columns[column] = lowered[alias]
+                break
+    return columns
+
+
+def parse_amount(value):
+    try:
+        return Decimal((value or "").replace(",", "").strip()) if value and value.strip() else None
+    except InvalidOperation:
+        return None
+
+
+def parse_date(value):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = None
+        for fmt in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+    if parsed is None:
+        return None
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def staging_line(statement, line_number, row, columns):
+    get = lambda column: (row.get(columns[column]) or "").strip() if column in columns else ""
+
+    receipt, reference = get("receipt"), get("reference")
+    # Co-op narrations look like "STK~<receipt>~<reference>"
+    parts = get("narration").split("~")
+    if len(parts) >= 2:
+        receipt = receipt or parts[1].strip()
+    if len(parts) >= 3:
+        reference = reference or parts[2].strip()
+
+    return BankStatementLine(
+        statement=statement,
+        line_number=line_number,
+        receipt=receipt.upper()[:50],
+        reference=reference[:100],
+        amount=parse_amount(get("amount")),
+        phone_normalized=normalize_phone(get("phone"))[:15],
+        transacted_at=parse_date(get("date")),
+    )
+
+
+def load_statement(file, file_name, chunk_size=5000):
+    """
+    Stream a CSV settlement file into the staging table, `chunk_size`
+    rows per bulk INSERT. Only one chunk is ever held in memory.
+    """
+    reader = csv.DictReader(file)
+    columns = map_columns(reader.fieldnames or [])
+    if "receipt" not in columns and "reference" not in columns and "narration" not in columns:
+        raise ValueError(f"No receipt / reference / narration column in {reader.fieldnames}")
+
+    statement = BankStatementImport.objects.create(file_name=file_name)
+    chunk = []
+    count = 0
+    for line_number, row in enumerate(reader, start=2):
+        chunk.append(staging_line(statement, line_number, row, columns))
+        if len(chunk) >= chunk_size:
+            BankStatementLine.objects.bulk_create(chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        BankStatementLine.objects.bulk_create(chunk)
+        count += len(chunk)
+
+    BankStatementImport.objects.filter(pk=statement.pk).update(line_count=count)
+    statement.line_count = count
+    return statement
+
+
+# ------------------------------------------------------
+# Matching (set-based: one proposal query per pass)
+# ------------------------------------------------------
+def unmatched_lines(statement):
+    return BankStatementLine.objects.filter(statement=statement, matched_transaction__isnull=True)
+
+
+def claimed_by_a_line():
+    """Transactions (OuterRef "pk") some line of any import already points at."""
+    return Exists(BankStatementLine.objects.filter(matched_transaction=OuterRef("pk")))
+
+
+def match_on(lines, candidates, method, batch_size=1000):
+    """
+    Point each line at the first transaction in `candidates` (an OuterRef
+    queryset) that no line of this or an earlier import has claimed. The
+    database proposes a candidate per line in one query; when several lines
+    propose the same transaction, the first line gets it.
+    Returns (matched, [ids of the lines that lost]).
+    """
+    proposals = (
+        lines
+        .annotate(candidate=Subquery(candidates.exclude(claimed_by_a_line()).order_by("id").values("id")[:1]))
+        .filter(candidate__isnull=False)
+        .order_by("id")
+        .values_list("id", "candidate")
+    )
+    taken = set()
+    winners = []
+    losers = []
+    for line_id, tx_id in proposals.iterator(chunk_size=batch_size):
+        if tx_id in taken:
+            losers.append(line_id)
+            continue
+        taken.add(tx_id)
+        winners.append(BankStatementLine(id=line_id, matched_transaction_id=tx_id, match_method=method))
+    BankStatementLine.objects.bulk_update(winners, ["matched_transaction", "match_method"], batch_size=batch_size)
+    return len(winners), losers
+
+
+def match_statement(statement, window_minutes=30):
+    """
+    Match staging lines to transactions:
+    1. M-Pesa receipt (indexed),
+    2. our checkout reference or the bank's message reference (indexed),
+    3. fallback: same amount and phone, created within `window_minutes`
+       of the bank's time.
+    A transaction already claimed by any line, in this import or an
+    earlier one, is never matched again (a unique constraint backs this).
+    Fallback lines that lose a transaction to another line are ambiguous.
+    Returns {method: lines matched}.
+    """
+    matched = {}
+    lines = unmatched_lines(statement).exclude(receipt="")
+    matched[BankStatementLine.RECEIPT], _ = match_on(
+        lines,
+        MpesaTransaction.objects.filter(mpesa_receipt_number=OuterRef("receipt")),
+        BankStatementLine.RECEIPT,
+    )
+
+    lines = unmatched_lines(statement).exclude(reference="")
+    matched[BankStatementLine.REFERENCE], _ = match_on(
+        lines,
+        MpesaTransaction.objects.filter(reference_lookup(OuterRef("reference"))),
+        BankStatementLine.REFERENCE,
+    )
+
+    window = timedelta(minutes=window_minutes)
+    lines = (
+        unmatched_lines(statement)
+        .exclude(phone_normalized="")
+        .filter(amount__isnull=False, transacted_at__isnull=False)
+    )
+    matched[BankStatementLine.AMOUNT_PHONE_TIME], ambiguous = match_on(
+        lines,
+        MpesaTransaction.objects.filter(
+            total_amount=OuterRef("amount"),
+            phone_normalized=OuterRef("phone_normalized"),
+            created_at__gte=OuterRef("transacted_at") - window,
+            created_at__lte=OuterRef("transacted_at") + window,
+        ),
+        BankStatementLine.AMOUNT_PHONE_TIME,
+    )
+    BankStatementLine.objects.filter(id__in=ambiguous).update(discrepancy=BankStatementLine.AMBIGUOUS)
+    return matched
+
+
+def flag_discrepancies(statement):
+    """Label every line the bank and our ledger disagree on."""
+    lines = BankStatementLine.objects.filter(statement=statement)
+    unmatched = lines.filter(matched_transaction__isnull=True, discrepancy="")
+    # Receipt / reference points at a transaction another line already settled
+    unmatched.exclude(receipt="").filter(Exists(
+        MpesaTransaction.objects.filter(claimed_by_a_line(), mpesa_receipt_number=OuterRef("receipt"))
+    )).update(discrepancy=BankStatementLine.DUPLICATE)
+    unmatched.exclude(reference="").filter(Exists(
+        MpesaTransaction.objects.filter(claimed_by_a_line(), reference_lookup(OuterRef("reference")))
+    )).update(discrepancy=BankStatementLine.DUPLICATE)
+    unmatched.update(discrepancy=BankStatementLine.UNMATCHED)
+
+    lines.filter(matched_transaction__isnull=False, amount__isnull=False).exclude(
+        amount=F("matched_transaction__total_amount")
+    ).update(discrepancy=BankStatementLine.AMOUNT_MISMATCH)
+    lines.filter(matched_transaction__status=FAILED, discrepancy="").update(
+        discrepancy=BankStatementLine.FAILED_BUT_PAID
+    )
+
+
+def settle_matched(statement, batch_size=1000):
+    """
+    The bank settled these, so still-open matched transactions become
+    SUCCESS (with the bank's receipt and time) in bulk.
+    Lines with a discrepancy are left for a person to review.
+    Returns the number of transactions changed.
+    """
+    rows = (
+        BankStatementLine.objects
+        .filter(statement=statement, discrepancy="", matched_transaction__status__in=OPEN_STATUSES)
+        .order_by("id")
+        .values_list("matched_transaction_id", "receipt", "transacted_at")
+    )
+    changed = 0
+    batch = []
+    for tx_id, receipt, transacted_at in rows.iterator(chunk_size=batch_size):
+        batch.append((tx_id, SUCCESS, receipt or None, transacted_at))
+        if len(batch) >= batch_size:
+            changed += apply_results(batch, source="bank_import")
+            batch = []
+    if batch:
+        changed += apply_results(batch, source="bank_import")
+    return changed
+
+
+def missing_from_bank(statement):
+    """Our SUCCESS transactions inside the statement's time span that no line of any import matched."""
+    span = BankStatementLine.objects.filter(statement=statement, transacted_at__isnull=False)
+    first = span.order_by("transacted_at").values_list("transacted_at", flat=True).first()
+    last = span.order_by("-transacted_at").values_list("transacted_at", flat=True).first()
+    if first is None:
+        return MpesaTransaction.objects.none()
+
+    # Settled by this statement or an overlapping earlier one
+    return (
+        MpesaTransaction.objects
+        .filter(status=SUCCESS, created_at__gte=first, created_at__lte=last)
+        .exclude(claimed_by_a_line())
+    )
+
+
+# ------------------------------------------------------
+# Import
+# ------------------------------------------------------
+def import_statement(file, file_name, window_minutes=30, apply=True, chunk_size=5000):
+    """Load, match, flag and (optionally) settle. Returns a summary dict."""
+    statement = load_statement(file, file_name, chunk_size)
+
+    with transaction.atomic():
+        matched = match_statement(statement, window_minutes)
+        flag_discrepancies(statement)
+
+    settled = settle_matched(statement) if apply else 0
+
+    lines = BankStatementLine.objects.filter(statement=statement)
+    discrepancies = dict(
+        lines.exclude(discrepancy="").values("discrepancy").annotate(n=Count("id")).values_list("discrepancy", "n")
+    )
+    matched_count = lines.filter(matched_transaction__isnull=False).count()
+    BankStatementImport.objects.filter(pk=statement.pk).update(
+        matched_count=matched_count,
+        discrepancy_count=sum(discrepancies.values()),
+    )
+
+    return {
+        "statement_id": statement.pk,
+        "lines": statement.line_count,
+        "matched": matched,
+        "matched_total": matched_count,
+        "discrepancies": discrepancies,
+        "missing_from_bank": missing_from_bank(statement).count(),
+        "settled": settled,
+    }
+
+
+def discrepancy_rows(statement):
+    """Report rows (header first) for every flagged line and every transaction missing from the bank."""
+    yield ["kind", "line", "receipt", "reference", "amount", "phone", "bank_time",
+           "transaction_id", "checkout_request_id", "our_status", "our_amount"]
+
+    lines = (
+        BankStatementLine.objects
+        .filter(statement=statement)
+        .exclude(discrepancy="")
+        .order_by("line_number")
+        .values_list(
+            "discrepancy", "line_number", "receipt", "reference", "amount", "phone_normalized", "transacted_at",
+            "matched_transaction_id", "matched_transaction__checkout_request_id",
+            "matched_transaction__status", "matched_transaction__total_amount",
+        )
+    )
+    for row in lines.iterator(chunk_size=2000):
+        yield list(row)
+
+    missing = missing_from_bank(statement).order_by("id").values_list(
+        "id", "checkout_request_id", "status", "total_amount", "mpesa_receipt_number", "phone_normalized", "created_at"
+    )
+    for tx_id, reference, status, amount, receipt, phone, created_at in missing.iterator(chunk_size=2000):
+        yield ["missing_from_bank", "", receipt, reference, "", phone, created_at, tx_id, reference, status, amount]
@@ -0,0 +1,145 @@
+import threading
+import time
+import requests
+from django.core.cache import cache
+
+
+class BankUnavailable(requests.RequestException):
+    """Call refused locally without reaching Co-op Bank."""
+
+
+class CircuitOpenError(BankUnavailable):
+    pass
+
+
+class BulkheadFullError(BankUnavailable):
+    pass
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker whose state lives in the default Django cache. CACHES
+    is a shared backend (database table or Redis), so every worker process
+    sees the same state: when one worker opens the circuit, all of them
+    stop calling the bank. The failure count is a get-and-set on the
+    database cache, so racing failures may be undercounted by one or two.
+
+    - closed: calls go through; `failure_threshold` consecutive failures open it.
+    - open: calls fail at once with CircuitOpenError for `reset_timeout` seconds.
+    - half-open: one caller (chosen with cache.add) is let through as a probe.
+      Success closes the circuit, failure re-opens it for another `reset_timeout`.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, probe_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+
+        prefix = f"coopbank:breaker:{name}:"
+        self.failures_key = prefix + "failures"
+        self.opened_key = prefix + "opened_at"
+        self.probe_key = prefix + "probe"
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"rejected": 0, "failures": 0, "opened": 0, "probes": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def state(self):
+        opened_at = cache.get(self.opened_key)
+        if opened_at is None:
+            return CLOSED
+        if time.time() < opened_at + self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError, or return True if this call is the
+        half-open probe (False for a normal call).
+        """
+        state = self.state()
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and cache.add(self.probe_key, 1, self.probe_timeout):
+            self._count("probes")
+            return True
+        self._count("rejected")
+        raise CircuitOpenError(f"Co-op Bank circuit is open ({self.name})")
+
+    def record_success(self, probe=False):
+        if probe:
+            cache.delete_many([self.opened_key, self.probe_key, self.failures_key])
+        elif cache.get(self.failures_key):
+            cache.delete(self.failures_key)
+
+    def record_failure(self, probe=False):
+        self._count("failures")
+        if probe:
+            self._open()
+            return
+
+        cache.add(self.failures_key, 0, self.reset_timeout * 10)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            failures = 1
+        if failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        cache.set(self.opened_key, time.time(), None)
+        cache.delete_many([self.probe_key, self.failures_key])
+        self._count("opened")
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["state"] = self.state()
+        return stats
+
+
+class Bulkhead:
+    """
+    Caps how many threads of this process can be inside a bank call.
+    A caller that cannot get a slot within `wait` seconds gets
+    BulkheadFullError instead of queueing behind a slow bank.
+
+    Per process, unlike the circuit breaker: with N workers up to
+    N x `size` bank calls can be in flight in total.
+    """
+
+    def __init__(self, size=4, wait=0.5):
+        self.size = size
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(size)
+        self._stats_lock = threading.Lock()
+        self._in_use = 0
+        self._rejected = 0
+
+    def __enter__(self):
+        if not self._slots.acquire(timeout=self.wait):
+            with self._stats_lock:
+                self._rejected += 1
+            raise BulkheadFullError("Too many Co-op Bank calls in flight")
+        with self._stats_lock:
+            self._in_use += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._stats_lock:
+            self._in_use -= 1
+        self._slots.release()
+        return False
+
+    def stats(self):
+        with self._stats_lock:
+            return {"size": self.size, "in_use": self._in_use, "rejected": self._rejected}
@@ -0,0 +1,129 @@
+import time
+import logging
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import MpesaCallback, MpesaTransaction
+from .transitions import (
+    apply_result, parse_result_metadata, reference_lookup, status_from_callback_code
+)
+
+
+logger = logging.getLogger(__name__)
+
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+NOT_FOUND = "not_found"
+# Failed on every attempt: taken out of the inbox, kept for a person to look at
+ERROR = "error"
+# Failed this time, tried again in a later batch
+RETRY = "retry"
+
+
+def record_callback(data):
+    """Single INSERT - all the callback view does before acknowledging."""
+    return MpesaCallback.objects.create(
+        message_reference=data.get("MessageReference"),
+        payload=data.dict() if hasattr(data, "dict") else data,
+    )
+
+
+def apply_callback(callback):
+    """
+    Apply one callback to its transaction. Safe to run any number of
+    times: only a still-open transaction is ever changed.
+    """
+    data = callback.payload
+    status = status_from_callback_code(data.get("MessageCode"))
+    receipt, transaction_date = parse_result_metadata(data)
+    lookup = reference_lookup(callback.message_reference)
+
+    if apply_result(lookup, status, receipt, transaction_date, source="callback"):
+        return APPLIED
+    if MpesaTransaction.objects.filter(lookup).exists():
+        return DUPLICATE
+    return NOT_FOUND
+
+
+def process_callback(callback):
+    """Apply a single stored callback right away and mark it processed."""
+    outcome = apply_callback(callback)
+    MpesaCallback.objects.filter(pk=callback.pk, processed_at__isnull=True).update(
+        outcome=outcome, processed_at=timezone.now()
+    )
+    return outcome
+
+
+def record_failure(callback, exc):
+    """
+    Count a failed attempt. After COOPBANK_CALLBACK_MAX_ATTEMPTS the
+    callback is closed with the ERROR outcome so it stops coming back.
+    """
+    callback.attempts += 1
+    callback.last_error = f"{type(exc).__name__}: {exc}"
+    if callback.attempts >= getattr(settings, "COOPBANK_CALLBACK_MAX_ATTEMPTS", 5):
+        callback.outcome = ERROR
+        callback.processed_at = timezone.now()
+    logger.exception(
+        "Callback %s (%s) failed, attempt %s", callback.pk, callback.message_reference, callback.attempts
+    )
+    return callback.outcome or RETRY
+
+
+def process_callbacks(batch_size=100):
+    """
+    Apply the oldest unprocessed callbacks in one DB transaction, each in
+    its own savepoint: a callback that fails is rolled back on its own and
+    counted, the rest of the batch still commits.
+    SKIP LOCKED lets several processors run side by side.
+    Returns {outcome: count} for the batch.
+    """
+    counts = {}
+    with transaction.atomic():
+        batch = list(
+            MpesaCallback.objects
+            .select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by("id")[:batch_size]
+        )
+        now = timezone.now()
+        for callback in batch:
+            try:
+                with transaction.atomic():
+                    outcome = apply_callback(callback)
+            except Exception as exc:
+                outcome = record_failure(callback, exc)
+            else:
+                callback.outcome = outcome
+                callback.processed_at = now
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+        MpesaCallback.objects.bulk_update(batch, ["outcome", "processed_at", "attempts", "last_error"])
+
+    return counts
+
+
+def run_callback_processor(batch_size=100, poll_interval=1.0, once=False, stdout=None):
+    totals = {}
+    while True:
+        try:
+            counts = process_callbacks(batch_size)
+        except Exception:
+            # e.g. the database went away: keep the processor alive and try again
+            logger.exception("Callback batch failed")
+            close_old_connections()
+            counts = {}
+
+        for outcome, n in counts.items():
+            totals[outcome] = totals.get(outcome, 0) + n
+
+        if counts:
+            if stdout:
+                stdout.write(f"Processed {sum(counts.values())} callbacks: {counts}")
+            # Only retries left: wait before trying them again
+            if set(counts) != {RETRY}:
+                continue
+
+        if once:
+            return totals
+        time.sleep(poll_interval)
@@ -1,13 +1,21 @@
 import base64
-import requests
 import datetime
 from django.conf import settings
+from .tokens import build_token_cache
+from .transport import client
+
+
+DEFAULT_STATUS_URL = "https://openapi.co-opbank.co.ke/Enquiry/STK/1.0.0/"
 
 
 # ------------------------------------------------------
 # Generate Co-op Bank OAuth Token
 # ------------------------------------------------------
-def generate_token():
+def fetch_token():
+    """
+    Request a new token from Co-op Bank.
+    Returns (access_token, expires_in_seconds).
+    """
     headers = {
         "Authorization": settings.COOPBANK_AUTH_HEADER,
         "Content-Type": "application/x-www-form-urlencoded",
@@ -15,9 +23,38 @@ def generate_token():
 
     data = "grant_type=client_credentials"
 
-    response = requests.post(settings.COOPBANK_TOKEN_URL, headers=headers, data=data)
+    response = client.post("token", settings.COOPBANK_TOKEN_URL, idempotent=True, headers=headers, data=data)
     response.raise_for_status()
-    return response.json().get("access_token")
+    data = response.json()
+    return data.get("access_token"), int(data.get("expires_in") or 0)
+
+
+token_cache = build_token_cache(fetch_token)
+
+
+def generate_token():
+    """Return a valid token, refreshing it only when it is about to expire."""
+    return token_cache.get_token()
+
+
+def bank_post(endpoint, url, payload, idempotent=False):
+    """
+    Authorised JSON POST through the pooled client.
+    A 401 means our cached token was revoked early: drop it and retry once.
+    """
+    for attempt in range(2):
+        headers = {
+            "Authorization": f"Bearer {generate_token()}",
+            "Content-Type": "application/json",
+        }
+        response = client.post(endpoint, url, idempotent=idempotent, json=payload, headers=headers)
+        if response.status_code == 401 and attempt == 0:
+            token_cache.invalidate()
+            continue
+        break
+
+    response.raise_for_status()
+    return response.json()
 
 
 # ------------------------------------------------------
@@ -32,13 +69,6 @@ def stk_push_request(phone, amount, reference, other_details, description):
     description: narration (e.g., MULTI or TITHE)
     """
 
-    token = generate_token()
-
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-
     payload = {
         "MessageReference": reference,
         "CallBackUrl": settings.COOPBANK_CALLBACK_URL,
@@ -52,28 +82,18 @@ def stk_push_request(phone, amount, reference, other_details, description):
         "OtherDetails": other_details,
     }
 
-    response = requests.post(settings.COOPBANK_STK_URL, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return bank_post("stk_push", settings.COOPBANK_STK_URL, payload)
 
 
 # ------------------------------------------------------
-# Send STK Push
+# Check STK Push Status
 # ------------------------------------------------------
 def stk_status_request(message_reference: str):
     """
     Check STK push transaction status using Co-op Bank API.
     """
-    token = generate_token()
-
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-
     payload = {"MessageReference": message_reference}
 
-    url = "https://openapi.co-opbank.co.ke/Enquiry/STK/1.0.0/"
-    response = requests.post(url, json=payload, headers=headers, timeout=15)
-    response.raise_for_status()
-    return response.json()
+    url = settings.COOPBANK_STATUS_URL or DEFAULT_STATUS_URL
+    return bank_post("stk_status", url, payload, idempotent=True)
+
@@ -0,0 +1,156 @@
+import time
+import requests
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction, close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from .breaker import OPEN, BankUnavailable
+from .coopbank import stk_push_request
+from .models import MpesaTransaction, StkPushDispatch
+from .transitions import FAILED, apply_result
+from .transport import client, reserve_bank_slots
+
+
+# ------------------------------------------------------
+# Enqueue
+# ------------------------------------------------------
+def enqueue_stk_push(mpesa_transaction, phone, amount, reference, other_details, description):
+    """
+    Queue an STK push for the dispatcher.
+    Call inside the same DB transaction that saved `mpesa_transaction`.
+    """
+    return StkPushDispatch.objects.create(
+        transaction=mpesa_transaction,
+        payload={
+            "phone": phone,
+            "amount": amount,
+            "reference": reference,
+            "other_details": other_details,
+            "description": description,
+        },
+    )
+
+
+# ------------------------------------------------------
+# Dispatcher
+# ------------------------------------------------------
+def claim_batch(limit):
+    """
+    Move up to `limit` queued pushes to SENDING and return them.
+    SKIP LOCKED lets several dispatcher processes share the queue.
+    """
+    with transaction.atomic():
+        ids = list(
+            StkPushDispatch.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=StkPushDispatch.QUEUED)
+            .order_by("id")
+            .values_list("id", flat=True)[:limit]
+        )
+        if not ids:
+            return []
+
+        StkPushDispatch.objects.filter(id__in=ids).update(
+            status=StkPushDispatch.SENDING,
+            locked_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+
+    return list(StkPushDispatch.objects.filter(id__in=ids).order_by("id"))
+
+
+def send_dispatch(dispatch):
+    """
+    Send one push and record the bank's reference, or FAILED.
+    Returns True / False, or None if the push was requeued unsent.
+
+    A read timeout means the push reached the bank but no answer came back,
+    so the bank may have accepted it: the transaction stays PENDING and is
+    settled by its callback or a status enquiry, never marked FAILED here.
+    """
+    close_old_connections()
+    try:
+        response = stk_push_request(**dispatch.payload)
+    except BankUnavailable:
+        # Never left this process: put it back for when the bank recovers
+        StkPushDispatch.objects.filter(pk=dispatch.pk).update(
+            status=StkPushDispatch.QUEUED, locked_at=None, attempts=F("attempts") - 1
+        )
+        return None
+    except requests.ReadTimeout as e:
+        StkPushDispatch.objects.filter(pk=dispatch.pk).update(
+            status=StkPushDispatch.SENT, last_error=f"No response, left for a status enquiry: {e}"[:1000]
+        )
+        return True
+    except Exception as e:
+        StkPushDispatch.objects.filter(pk=dispatch.pk).update(
+            status=StkPushDispatch.FAILED, last_error=str(e)[:1000]
+        )
+        apply_result(Q(pk=dispatch.transaction_id), FAILED, source="dispatch")
+        return False
+    finally:
+        close_old_connections()
+
+    MpesaTransaction.objects.filter(pk=dispatch.transaction_id).update(
+        coop_message_reference=response.get("MessageReference")
+    )
+    StkPushDispatch.objects.filter(pk=dispatch.pk).update(status=StkPushDispatch.SENT, last_error="")
+    return True
+
+
+def release_stale(older_than):
+    """
+    A push left in SENDING (e.g. the dispatcher was killed) may or may not
+    have reached the bank, so it is not re-sent: the transaction stays
+    PENDING and is settled by the callback or a status enquiry.
+    """
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return StkPushDispatch.objects.filter(
+        status=StkPushDispatch.SENDING, locked_at__lt=cutoff
+    ).update(status=StkPushDispatch.FAILED, last_error="Dispatcher interrupted while sending")
+
+
+def run_dispatcher(workers=8, batch_size=50, poll_interval=1.0, stale_after=300, once=False, stdout=None):
+    """
+    Claim queued pushes in batches and send them concurrently.
+    Throughput is `workers` pushes in flight, independent of web workers.
+    """
+    sent = failed = 0
+    reserve_bank_slots(workers)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            release_stale(stale_after)
+
+            # Bank is down: leave the queue alone until the breaker lets a probe through
+            if client.breaker is not None and client.breaker.state() == OPEN:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            batch = claim_batch(batch_size)
+
+            if batch:
+                requeued = 0
+                for ok in pool.map(send_dispatch, batch):
+                    if ok:
+                        sent += 1
+                    elif ok is None:
+                        requeued += 1
+                    else:
+                        failed += 1
+                if stdout:
+                    stdout.write(f"Dispatched {len(batch)} (sent={sent}, failed={failed}, requeued={requeued})")
+                if requeued:
+                    if once:
+                        break
+                    time.sleep(poll_interval)
+                continue
+
+            if once:
+                break
+            time.sleep(poll_interval)
+
+    return sent, failed
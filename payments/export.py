@@ -0,0 +1,123 @@
+import csv
+import tempfile
+from datetime import datetime
+from itertools import islice
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .models import MpesaPurpose
+
+
+BASE_COLUMNS = [
+    ("id", "ID"),
+    ("name", "Name"),
+    ("phone_number", "Phone"),
+    ("email", "Email"),
+    ("status", "Status"),
+    ("mpesa_receipt_number", "Receipt"),
+    ("checkout_request_id", "Reference"),
+    ("transaction_date", "Transaction Date"),
+    ("total_amount", "Total"),
+]
+
+
+def purpose_columns():
+    """One amount column per purpose, named after PURPOSE_CHOICES."""
+    return [(f"purpose_{i}", code, label) for i, (code, label) in enumerate(MpesaPurpose.PURPOSE_CHOICES)]
+
+
+def other_details(ids):
+    """{transaction id: every "other" purpose description, joined with '; '}"""
+    details = {}
+    lines = (
+        MpesaPurpose.objects
+        .filter(transaction_id__in=ids)
+        .exclude(other_purpose_details__isnull=True)
+        .exclude(other_purpose_details="")
+        .order_by("transaction_id", "id")
+        .values_list("transaction_id", "other_purpose_details")
+    )
+    for tx_id, text in lines:
+        details.setdefault(tx_id, []).append(text)
+    return {tx_id: "; ".join(texts) for tx_id, texts in details.items()}
+
+
+def export_cell(value):
+    """Blank for NULL; datetimes in the local timezone, like the rest of the site."""
+    if value is None:
+        return ""
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value)
+    return value
+
+
+def export_rows(queryset, chunk_size=2000):
+    """
+    Yield the header and then one flat row per transaction.
+
+    Purposes are pivoted into columns by the database (conditional SUMs),
+    and rows are pulled with .iterator() - a server-side cursor on
+    Postgres - so memory stays flat however large the export is.
+    "Other" descriptions are fetched with one query per chunk.
+    """
+    pivots = purpose_columns()
+    annotations = {
+        alias: Sum("purposes__amount", filter=Q(purposes__purpose=code))
+        for alias, code, _ in pivots
+    }
+
+    fields = [name for name, _ in BASE_COLUMNS] + [alias for alias, _, _ in pivots]
+
+    yield [label for _, label in BASE_COLUMNS] + [label for _, _, label in pivots] + ["Other Details"]
+
+    rows = queryset.order_by("id").annotate(**annotations).values_list(*fields).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        details = other_details([row[0] for row in chunk])
+        for row in chunk:
+            yield [export_cell(value) for value in row] + [details.get(row[0], "")]
+
+
+# Spreadsheet apps run cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def safe_cell(value):
+    """
+    Donor-typed text (name, email, other details) is written with a leading
+    quote when it could be read as a formula. Numbers are left alone.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class Echo:
+    """File-like object that hands each written line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow([safe_cell(value) for value in row])
+
+
+def write_xlsx(rows):
+    """
+    Write rows to a temporary .xlsx file and return it (rewound).
+    openpyxl's write-only mode keeps memory flat. Raises ImportError
+    if openpyxl is missing (the view answers 400).
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Transactions")
+    for row in rows:
+        # Excel has no timezones: write the local wall-clock time
+        sheet.append([value.replace(tzinfo=None) if isinstance(value, datetime) else safe_cell(value) for value in row])
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,53 @@
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .purposes import purpose_filter
+from .search import search_filter
+
+
+def parse_day(value):
+    """'2025-01-31' -> date (None if missing or invalid, e.g. '2025-02-30')."""
+    try:
+        return parse_date(value) if value else None
+    except ValueError:
+        return None
+
+
+def day_start(value):
+    """'2025-01-31' -> aware datetime at 00:00 that day (None if invalid)."""
+    day = parse_day(value)
+    if not day:
+        return None
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_transactions(queryset, params):
+    """
+    Treasurer filters shared by the transaction list and export:
+    status, purpose, search, start_date, end_date.
+    """
+    status_q = params.get("status")
+    purpose = params.get("purpose")
+    search = params.get("search")
+    start = day_start(params.get("start_date"))
+    end = day_start(params.get("end_date"))
+
+    # Statuses are stored upper-case; exact match keeps the index usable
+    if status_q and status_q != "all":
+        queryset = queryset.filter(status=status_q.upper())
+
+    # Denormalised purpose mask: no join, no duplicate rows
+    if purpose and purpose != "all":
+        queryset = queryset.filter(purpose_filter(purpose))
+
+    # Indexed search on normalised columns (payments/search.py)
+    if search:
+        queryset = queryset.filter(search_filter(search))
+
+    # Half-open range on the raw column (no per-row date cast)
+    if start:
+        queryset = queryset.filter(transaction_date__gte=start)
+    if end:
+        queryset = queryset.filter(transaction_date__lt=end + timedelta(days=1))
+
+    return queryset
@@ -0,0 +1,98 @@
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import IdempotencyKey
+from .search import normalize_phone
+
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 200
+
+
+# ------------------------------------------------------
+# Keys
+# ------------------------------------------------------
+def request_hash(validated_data):
+    """sha256 of what makes two initiations "the same payment"."""
+    purposes = sorted(
+        (p["purpose"], f"{p['amount']:.2f}", p.get("other_purpose_details") or "")
+        for p in validated_data["purposes"]
+    )
+    body = json.dumps([normalize_phone(validated_data["phone_number"]), purposes])
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def derived_key(fingerprint):
+    """
+    Key for requests sent without an Idempotency-Key: the same for every
+    identical payment from the same phone. It only counts as taken for
+    IDEMPOTENCY_WINDOW seconds after it was claimed (see key_ttl), so the
+    window slides with the first request instead of being a fixed bucket
+    that a double-tap could straddle.
+    """
+    return f"auto:{fingerprint}"
+
+
+def key_ttl(key):
+    """Seconds a claimed key is honoured."""
+    if key.startswith("auto:"):
+        return settings.IDEMPOTENCY_WINDOW
+    return settings.IDEMPOTENCY_KEY_TTL
+
+
+def key_for_request(request, fingerprint):
+    """The client's key when given, else the derived one. None if the header is invalid."""
+    client_key = request.headers.get(HEADER, "").strip()
+    if not client_key:
+        return derived_key(fingerprint)
+    if len(client_key) > MAX_KEY_LENGTH:
+        return None
+    return f"key:{client_key}"
+
+
+# ------------------------------------------------------
+# Claim / complete
+# ------------------------------------------------------
+def claim(key, fingerprint):
+    """
+    Insert the key, relying on its unique index to pick one winner.
+    Returns (record, created); losers get the existing row.
+    An expired row (older than key_ttl) is replaced.
+    """
+    ttl = timedelta(seconds=key_ttl(key))
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(key=key, request_hash=fingerprint), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(key=key).first()
+            if record is None:
+                continue  # released in between
+            if record.created_at >= timezone.now() - ttl:
+                return record, False
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+
+    return IdempotencyKey.objects.get(key=key), False
+
+
+def complete(record, response, mpesa_transaction=None):
+    """Store the response so duplicates can replay it."""
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        response_status=response.status_code,
+        response_body=response.data,
+        transaction=mpesa_transaction,
+    )
+
+
+def release(record):
+    """Forget the key so the client may retry (the request did not go through)."""
+    IdempotencyKey.objects.filter(pk=record.pk).delete()
+
+
+def purge_expired():
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
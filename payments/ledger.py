@@ -0,0 +1,275 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import LedgerAccount, LedgerEntry, MpesaPurpose, MpesaTransaction
+
+
+CLEARING_CODE = "MPESA"
+CLEARING_NAME = "M-Pesa clearing"
+PURPOSE_NAMES = dict(MpesaPurpose.PURPOSE_CHOICES)
+
+
+def fund_code(purpose, other_details=None):
+    """Development groups each get their own fund; other purposes share one per purpose."""
+    if purpose == "DEVGR" and other_details:
+        return f"DEVGR:{other_details.strip()}"
+    return purpose
+
+
+def fund_name(code):
+    purpose, _, group = code.partition(":")
+    name = PURPOSE_NAMES.get(purpose, purpose)
+    return f"{name} - {group}" if group else name
+
+
+def signed(account, debit, credit):
+    """Change to a balance: funds grow with credits, assets with debits."""
+    return debit - credit if account.kind == LedgerAccount.ASSET else credit - debit
+
+
+# ------------------------------------------------------
+# Posting
+# ------------------------------------------------------
+def ensure_accounts(codes):
+    """Create any of `codes` that don't have an account yet."""
+    existing = set(LedgerAccount.objects.filter(code__in=codes).values_list("code", flat=True))
+    missing = [
+        LedgerAccount(
+            code=code,
+            name=CLEARING_NAME if code == CLEARING_CODE else fund_name(code),
+            kind=LedgerAccount.ASSET if code == CLEARING_CODE else LedgerAccount.FUND,
+        )
+        for code in sorted(set(codes) - existing)
+    ]
+    if missing:
+        LedgerAccount.objects.bulk_create(missing, ignore_conflicts=True)
+
+
+def locked_accounts(codes):
+    """
+    Create missing accounts, then lock them all in code order, clearing
+    last (postings take it last too), so two postings touching the same
+    accounts can never deadlock.
+    """
+    ensure_accounts(codes)
+    clearing_last = Case(When(code=CLEARING_CODE, then=Value(1)), default=Value(0))
+    accounts = LedgerAccount.objects.select_for_update().filter(code__in=codes).order_by(clearing_last, "code")
+    return {account.code: account for account in accounts}
+
+
+def post_clearing(debits, posted_at):
+    """
+    Debit M-Pesa clearing with one atomic UPDATE (balance = balance + total)
+    at the end of a posting, then write its entries. Every settlement path
+    goes through this one row, so it is not locked while the funds are
+    posted; our UPDATE's own row lock orders concurrent postings.
+    `debits` is [(transaction_id, amount, journal_at)].
+    """
+    total = sum((amount for _, amount, _ in debits), Decimal("0"))
+    clearing = LedgerAccount.objects.filter(code=CLEARING_CODE)
+    clearing.update(
+        balance=F("balance") + total, entry_count=F("entry_count") + len(debits), updated_at=posted_at
+    )
+    account = clearing.get()
+
+    running = account.balance - total
+    entries = []
+    for tx_id, amount, journal_at in debits:
+        running += amount
+        entries.append(LedgerEntry(
+            account=account,
+            transaction_id=tx_id,
+            debit=amount,
+            credit=Decimal("0"),
+            balance_after=running,
+            posted_at=journal_at,
+        ))
+    LedgerEntry.objects.bulk_create(entries)
+
+
+def post_transactions(transaction_ids, posted_at=None, at_settlement=False):
+    """
+    Post one balanced journal per successful transaction: debit M-Pesa
+    clearing with the total, credit each purpose line to its fund.
+    Transactions already posted are skipped. Fund balances are updated
+    under row locks in the same DB transaction as the entries; clearing
+    is updated last, in one UPDATE (post_clearing).
+
+    Journals are dated `posted_at` (default now), or with `at_settlement`
+    when each transaction settled (its M-Pesa transaction date, else its
+    creation time) - for backfills, followed by restate_balances().
+    Returns the number of transactions posted.
+    """
+    if not transaction_ids:
+        return 0
+
+    with transaction.atomic():
+        already = LedgerEntry.objects.filter(transaction=OuterRef("pk"))
+        settled = dict(
+            MpesaTransaction.objects
+            .filter(pk__in=list(transaction_ids))
+            .exclude(Exists(already))
+            .order_by("id")
+            .annotate(settled_at=Coalesce("transaction_date", "created_at"))
+            .values_list("id", "settled_at")
+        )
+        ids = list(settled)
+        if not ids:
+            return 0
+
+        lines = list(
+            MpesaPurpose.objects
+            .filter(transaction_id__in=ids)
+            .order_by("transaction_id", "id")
+            .values_list("transaction_id", "purpose", "other_purpose_details", "amount")
+        )
+        codes = {fund_code(purpose, details) for _, purpose, details, _ in lines}
+        ensure_accounts([CLEARING_CODE])
+        accounts = locked_accounts(codes)
+        posted_at = posted_at or timezone.now()
+
+        entries = []
+        debits = []
+        journals = {}
+        for tx_id, purpose, details, amount in lines:
+            journals.setdefault(tx_id, []).append((accounts[fund_code(purpose, details)], amount))
+
+        for tx_id, credits in journals.items():
+            journal_at = settled[tx_id] if at_settlement else posted_at
+            debits.append((tx_id, sum((amount for _, amount in credits), Decimal("0")), journal_at))
+            for fund, amount in credits:
+                fund.balance += signed(fund, Decimal("0"), amount)
+                fund.entry_count += 1
+                entries.append(LedgerEntry(
+                    account=fund,
+                    transaction_id=tx_id,
+                    debit=Decimal("0"),
+                    credit=amount,
+                    balance_after=fund.balance,
+                    posted_at=journal_at,
+                ))
+
+        LedgerEntry.objects.bulk_create(entries)
+        for account in accounts.values():
+            account.updated_at = posted_at
+        LedgerAccount.objects.bulk_update(accounts.values(), ["balance", "entry_count", "updated_at"])
+        post_clearing(debits, posted_at)
+
+    return len(journals)
+
+
+def restate_balances(codes=None):
+    """
+    Recompute each entry's balance_after as the running total in
+    (posted_at, id) order. Needed after backdated journals were posted
+    behind newer ones; debits, credits and dates are never touched.
+    Returns the number of entries corrected.
+    """
+    corrected = 0
+    with transaction.atomic():
+        codes = codes or list(LedgerAccount.objects.values_list("code", flat=True))
+        for account in locked_accounts(codes).values():
+            running = Decimal("0")
+            changed = []
+            entries = LedgerEntry.objects.filter(account=account).order_by("posted_at", "id")
+            for entry in entries.only("id", "debit", "credit", "balance_after").iterator(chunk_size=5000):
+                running += signed(account, entry.debit, entry.credit)
+                if entry.balance_after != running:
+                    entry.balance_after = running
+                    changed.append(entry)
+            LedgerEntry.objects.bulk_update(changed, ["balance_after"], batch_size=1000)
+            corrected += len(changed)
+    return corrected
+
+
+# ------------------------------------------------------
+# Reading balances
+# ------------------------------------------------------
+def balances():
+    """Current balance of every account - one small table read."""
+    return list(LedgerAccount.objects.order_by("kind", "code").values("code", "name", "kind", "balance"))
+
+
+def balance_as_of(account, moment):
+    """Balance right after the last entry at or before `moment` (one index probe)."""
+    value = (
+        LedgerEntry.objects
+        .filter(account=account, posted_at__lte=moment)
+        .order_by("-posted_at", "-id")
+        .values_list("balance_after", flat=True)
+        .first()
+    )
+    return value if value is not None else Decimal("0")
+
+
+def balances_as_of(moment):
+    return [
+        {"code": a.code, "name": a.name, "kind": a.kind, "balance": balance_as_of(a, moment)}
+        for a in LedgerAccount.objects.order_by("kind", "code")
+    ]
+
+
+# ------------------------------------------------------
+# Verification
+# ------------------------------------------------------
+def verify_ledger(stdout=None):
+    """
+    Recompute everything from the entries and report drift:
+    - stored balance / entry count vs. the sum of entries,
+    - each entry's balance_after vs. the running total,
+    - journals whose debits and credits differ,
+    - SUCCESS transactions without a journal (and journals for non-SUCCESS ones).
+    Returns a list of problem strings (empty when the ledger is sound).
+    """
+    from .transitions import SUCCESS
+
+    problems = []
+
+    for account in LedgerAccount.objects.order_by("code"):
+        running = Decimal("0")
+        count = 0
+        entries = (
+            LedgerEntry.objects
+            .filter(account=account)
+            .order_by("posted_at", "id")
+            .values_list("id", "debit", "credit", "balance_after")
+        )
+        for entry_id, debit, credit, balance_after in entries.iterator(chunk_size=5000):
+            running += signed(account, debit, credit)
+            count += 1
+            if running != balance_after:
+                problems.append(f"{account.code}: entry {entry_id} balance_after {balance_after}, expected {running}")
+                running = balance_after  # report each break once
+
+        recomputed = (
+            LedgerEntry.objects.filter(account=account).aggregate(d=Sum("debit"), c=Sum("credit"))
+        )
+        total = signed(account, recomputed["d"] or Decimal("0"), recomputed["c"] or Decimal("0"))
+        if total != account.balance:
+            problems.append(f"{account.code}: stored balance {account.balance}, entries sum to {total}")
+        if count != account.entry_count:
+            problems.append(f"{account.code}: stored entry_count {account.entry_count}, found {count}")
+        if stdout:
+            stdout.write(f"Checked {account.code} ({count} entries)")
+
+    unbalanced = (
+        LedgerEntry.objects
+        .values("transaction_id")
+        .annotate(d=Sum("debit"), c=Sum("credit"))
+        .exclude(d=F("c"))
+        .values_list("transaction_id", "d", "c")
+    )
+    for tx_id, debit, credit in unbalanced:
+        problems.append(f"transaction {tx_id}: debits {debit} != credits {credit}")
+
+    posted = LedgerEntry.objects.filter(transaction=OuterRef("pk"))
+    unposted = MpesaTransaction.objects.filter(status=SUCCESS).exclude(Exists(posted))
+    for tx_id in unposted.values_list("id", flat=True)[:100]:
+        problems.append(f"transaction {tx_id}: SUCCESS but not posted")
+    stray = MpesaTransaction.objects.exclude(status=SUCCESS).filter(Exists(posted))
+    for tx_id in stray.values_list("id", flat=True)[:100]:
+        problems.append(f"transaction {tx_id}: posted but not SUCCESS")
+
+    return problems
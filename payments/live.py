@@ -0,0 +1,150 @@
+import time
+import asyncio
+import threading
+import contextvars
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from .models import MpesaTransaction
+
+
+TERMINAL = ("SUCCESS", "FAILED")
+STATUS_FIELDS = ("checkout_request_id", "status", "mpesa_receipt_number", "transaction_date")
+
+
+def status_payload(row):
+    return {
+        "checkout_request_id": row["checkout_request_id"],
+        "status": row["status"],
+        "mpesa_receipt_number": row["mpesa_receipt_number"],
+        "transaction_date": row["transaction_date"].isoformat() if row["transaction_date"] else None,
+    }
+
+
+def current_status(checkout_request_id):
+    row = MpesaTransaction.objects.filter(checkout_request_id=checkout_request_id).values(*STATUS_FIELDS).first()
+    return status_payload(row) if row else None
+
+
+def final_statuses(references):
+    """{reference: payload} for the references that are now SUCCESS/FAILED."""
+    found = {}
+    for i in range(0, len(references), 500):
+        rows = MpesaTransaction.objects.filter(
+            checkout_request_id__in=references[i:i + 500], status__in=TERMINAL
+        ).values(*STATUS_FIELDS)
+        for row in rows:
+            found[row["checkout_request_id"]] = status_payload(row)
+    return found
+
+
+def poll_final_statuses(references):
+    """
+    final_statuses() for the hub's poller. It runs on a thread-pool thread
+    that no request owns, so nothing else would ever close the connection
+    it opens there.
+    """
+    try:
+        return final_statuses(references)
+    finally:
+        connections.close_all()
+
+
+def wait_for_final_status(checkout_request_id, timeout, interval=None):
+    """
+    Blocking wait for WSGI: re-read the row every `interval` seconds for at
+    most `timeout` seconds. Returns the latest payload, final or not.
+    """
+    interval = interval or getattr(settings, "LIVE_STATUS_POLL_INTERVAL", 1.0)
+    deadline = time.monotonic() + timeout
+    while True:
+        payload = current_status(checkout_request_id)
+        if payload is None or payload["status"] in TERMINAL or time.monotonic() >= deadline:
+            return payload
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+
+
+class LoopState:
+    """The waiters and the poller of one event loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.waiters = {}
+        self.task = None
+        self.wakeup = asyncio.Event()
+
+
+class StatusHub:
+    """
+    Fan-out of final payment statuses to waiting donors.
+
+    However many donors are waiting, each event loop runs one poller
+    coroutine that checks all of its references with a single query per
+    tick. A status change applied in this process (callback,
+    reconciliation) wakes the pollers at once; changes made by other
+    processes are picked up on the next tick.
+
+    State is kept per loop, so a second loop (a server reload, a thread
+    running its own loop) never drops the waiters of another.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.loops = {}
+        self._lock = threading.Lock()
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for old in [l for l in self.loops if l.is_closed()]:
+                del self.loops[old]
+            state = self.loops.get(loop)
+            if state is None:
+                state = self.loops[loop] = LoopState(loop)
+        if state.task is None or state.task.done():
+            # Fresh context: the poller outlives the request that started it
+            state.task = loop.create_task(self._run(state), context=contextvars.Context())
+        return state
+
+    async def _run(self, state):
+        while state.waiters:
+            found = await sync_to_async(poll_final_statuses, thread_sensitive=False)(list(state.waiters))
+            for reference, payload in found.items():
+                for future in state.waiters.pop(reference, ()):
+                    if not future.done():
+                        future.set_result(payload)
+
+            state.wakeup.clear()
+            try:
+                await asyncio.wait_for(state.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait(self, checkout_request_id, timeout):
+        """Final status payload, or None if nothing changed within `timeout`."""
+        state = self._state()
+        future = state.loop.create_future()
+        state.waiters.setdefault(checkout_request_id, set()).add(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiting = state.waiters.get(checkout_request_id)
+            if waiting is not None:
+                waiting.discard(future)
+                if not waiting:
+                    state.waiters.pop(checkout_request_id, None)
+
+    def wake(self):
+        """Thread-safe: ask every loop's poller to check now."""
+        with self._lock:
+            states = list(self.loops.values())
+        for state in states:
+            try:
+                state.loop.call_soon_threadsafe(state.wakeup.set)
+            except RuntimeError:
+                pass  # loop closed since; dropped on the next _state()
+
+
+status_hub = StatusHub(interval=getattr(settings, "LIVE_STATUS_POLL_INTERVAL", 1.0))
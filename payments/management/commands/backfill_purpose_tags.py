@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from payments.models import MpesaPurpose, MpesaTransaction
+from payments.purposes import purpose_fields
+
+
+class Command(BaseCommand):
+    help = "Backfill the denormalised purpose mask and tag on existing transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(
+                MpesaTransaction.objects
+                .filter(id__gt=last_id)
+                .order_by("id")
+                .only("id")[:options["batch_size"]]
+            )
+            if not batch:
+                break
+
+            codes = {}
+            lines = (
+                MpesaPurpose.objects
+                .filter(transaction_id__in=[tx.id for tx in batch])
+                .order_by("id")
+                .values_list("transaction_id", "purpose")
+            )
+            for tx_id, purpose in lines:
+                codes.setdefault(tx_id, []).append(purpose)
+
+            for tx in batch:
+                fields = purpose_fields(codes.get(tx.id, []))
+                tx.purpose_mask = fields["purpose_mask"]
+                tx.purpose_tag = fields["purpose_tag"]
+            MpesaTransaction.objects.bulk_update(batch, ["purpose_mask", "purpose_tag"])
+            updated += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Updated {updated}")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {updated} transactions"))
@@ -0,0 +1,94 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from payments.metrics import latency_summary
+from payments.models import GivingRollup, MpesaPurpose, MpesaTransaction
+from payments.rollups import record_new_transaction
+from payments.serializers import MpesaTransactionSerializer
+
+
+# Rows written by the benchmark use this status, so their rollups are easy to remove
+BENCH_STATUS = "BENCH"
+PURPOSES = ["Tithe", "Offering", "Local Church", "Evangelism", "Station Dev"]
+
+
+def fake_payload(i):
+    return {
+        "name": f"Bench Donor {i}",
+        "phone_number": f"07{random.randint(10000000, 99999999)}",
+        "email": f"donor{i}@example.com",
+        "purposes": [
+            {"purpose": p, "amount": str(random.randint(50, 5000))}
+            for p in random.sample(PURPOSES, random.randint(1, 3))
+        ],
+    }
+
+
+def legacy_create(validated_data):
+    """The old write path: parent, one INSERT per purpose, then a re-save with the total."""
+    purposes_data = validated_data.pop("purposes")
+    parent = MpesaTransaction.objects.create(**validated_data)
+    total = 0
+    for p in purposes_data:
+        MpesaPurpose.objects.create(transaction=parent, **p)
+        total += p["amount"]
+    parent.total_amount = total
+    parent.save()
+    record_new_transaction(parent, purposes_data)
+    return parent
+
+
+def initiate(mode, i):
+    close_old_connections()
+    try:
+        serializer = MpesaTransactionSerializer(data=fake_payload(i))
+        serializer.is_valid(raise_exception=True)
+        started = time.perf_counter()
+        if mode == "legacy":
+            legacy_create({**serializer.validated_data, "checkout_request_id": f"BENCH-{mode}-{i}", "status": BENCH_STATUS})
+        else:
+            serializer.save(checkout_request_id=f"BENCH-{mode}-{i}", status=BENCH_STATUS)
+        return time.perf_counter() - started
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark payment initiation writes (parent + purposes) under concurrency, "
+        "comparing the legacy per-row path with the single-transaction bulk path. "
+        "Benchmark rows are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=2000, help="Initiations per mode")
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent initiations")
+        parser.add_argument("--modes", default="legacy,bulk", help="Comma separated: legacy,bulk")
+
+    def handle(self, *args, **options):
+        count, workers = options["count"], options["workers"]
+        report = []
+
+        try:
+            for mode in options["modes"].split(","):
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    timings = list(pool.map(lambda i: initiate(mode, i), range(count)))
+                elapsed = time.perf_counter() - started
+
+                report.append({
+                    "mode": mode,
+                    "initiations": count,
+                    "workers": workers,
+                    "inserts_per_sec": round(count / elapsed, 1),
+                    "latency": latency_summary(timings),
+                })
+                self.stdout.write(f"Benchmarked {mode}")
+        finally:
+            MpesaTransaction.objects.filter(status=BENCH_STATUS).delete()
+            GivingRollup.objects.filter(status=BENCH_STATUS).delete()
+
+        self.stdout.write(json.dumps(report, indent=2))
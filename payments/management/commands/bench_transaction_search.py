@@ -0,0 +1,103 @@
+import json
+import random
+import string
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from payments.metrics import latency_summary
+from payments.models import MpesaTransaction
+from payments.search import ensure_search_indexes, search_filter, search_transactions
+
+
+FIRST_NAMES = ["John", "Mary", "Peter", "Grace", "David", "Faith", "James", "Esther", "Samuel", "Ruth"]
+LAST_NAMES = ["Otieno", "Wanjiku", "Kamau", "Achieng", "Mwangi", "Njeri", "Kiprop", "Wambui", "Omondi", "Chebet"]
+
+
+def fake_transaction(i):
+    name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)} {i}"
+    tx = MpesaTransaction(
+        name=name,
+        phone_number="07" + "".join(random.choices(string.digits, k=8)),
+        email=f"{name.split()[0].lower()}{i}@example.com",
+        status="SUCCESS",
+        mpesa_receipt_number="".join(random.choices(string.ascii_uppercase + string.digits, k=10)),
+        checkout_request_id=f"BENCH-{i}",
+        total_amount=random.randint(50, 20000),
+    )
+    tx.refresh_search_fields()
+    return tx
+
+
+def legacy_filter(term):
+    return (
+        Q(name__icontains=term)
+        | Q(phone_number__icontains=term)
+        | Q(email__icontains=term)
+        | Q(mpesa_receipt_number__icontains=term)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark transaction search at several ledger sizes. "
+        "Synthetic rows are inserted inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000", help="Comma separated ledger sizes")
+        parser.add_argument("--repeat", type=int, default=20, help="Runs per query")
+
+    def time_query(self, build, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(build())
+            timings.append(time.perf_counter() - started)
+        return latency_summary(timings)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(s) for s in options["sizes"].split(","))
+        repeat = options["repeat"]
+        report = []
+
+        with transaction.atomic():
+            ensure_search_indexes()
+            inserted = 0
+
+            for size in sizes:
+                while inserted < size:
+                    chunk = min(5000, size - inserted)
+                    MpesaTransaction.objects.bulk_create(
+                        [fake_transaction(inserted + n) for n in range(chunk)]
+                    )
+                    inserted += chunk
+
+                if connection.vendor == "postgresql":
+                    with connection.cursor() as cursor:
+                        cursor.execute("ANALYZE payments_mpesatransaction")
+
+                sample = MpesaTransaction.objects.filter(checkout_request_id=f"BENCH-{size // 2}").first()
+                terms = {
+                    "name": sample.name.split()[1],
+                    "phone_prefix": sample.phone_number[:6],
+                    "receipt_prefix": sample.mpesa_receipt_number[:6],
+                }
+                base = MpesaTransaction.objects.order_by("-id")
+
+                for kind, term in terms.items():
+                    report.append({
+                        "rows": size,
+                        "query": kind,
+                        "term": term,
+                        "legacy_icontains": self.time_query(lambda: base.filter(legacy_filter(term))[:100], repeat),
+                        "indexed_filter": self.time_query(lambda: base.filter(search_filter(term))[:100], repeat),
+                        "ranked_search": self.time_query(
+                            lambda: search_transactions(MpesaTransaction.objects.all(), term, 50), repeat
+                        ),
+                    })
+                self.stdout.write(f"Benchmarked {size} rows")
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps(report, indent=2))
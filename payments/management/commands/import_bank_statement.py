@@ -0,0 +1,46 @@
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from payments.bank_import import discrepancy_rows, import_statement
+from payments.models import BankStatementImport
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a bank settlement CSV, match its lines to M-Pesa transactions "
+        "(receipt, reference, then amount+phone+time) and settle still-open matches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Settlement CSV file")
+        parser.add_argument("--window", type=int, default=30, help="Minutes either side for amount+phone matching")
+        parser.add_argument("--no-apply", action="store_true", help="Match and report only; do not change statuses")
+        parser.add_argument("--report", help="Write the discrepancy report to this CSV file")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Lines per bulk INSERT")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], newline="", encoding="utf-8-sig") as f:
+                summary = import_statement(
+                    f,
+                    options["path"],
+                    window_minutes=options["window"],
+                    apply=not options["no_apply"],
+                    chunk_size=options["chunk_size"],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(json.dumps(summary, indent=2, default=str))
+
+        if options["report"]:
+            statement = BankStatementImport.objects.get(pk=summary["statement_id"])
+            with open(options["report"], "w", newline="") as out:
+                writer = csv.writer(out)
+                for row in discrepancy_rows(statement):
+                    writer.writerow(row)
+            self.stdout.write(f"Discrepancy report written to {options['report']}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['lines']} lines, matched {summary['matched_total']}, settled {summary['settled']}"
+        ))
@@ -0,0 +1,171 @@
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management.base import BaseCommand
+from payments.metrics import latency_summary
+
+
+PURPOSES = ["Tithe", "Offering", "Local Church", "Evangelism", "Camp Offering"]
+FINAL = ("SUCCESS", "FAILED")
+
+
+class Flow:
+    """One donor: initiate -> (bank callback) -> poll status until final."""
+
+    def __init__(self, index):
+        self.index = index
+        self.reference = None
+        self.initiate_status = None
+        self.final_status = None
+        self.receipt = None
+        self.initiate_latency = None
+        self.end_to_end = None
+        self.status_latencies = []
+
+
+def fake_payment(i):
+    purposes = random.sample(PURPOSES, random.randint(1, 2))
+    return {
+        "name": f"Load Donor {i}",
+        "phone_number": f"07{random.randint(10000000, 99999999)}",
+        "email": f"load{i}@example.com",
+        "purposes": [{"purpose": p, "amount": str(random.randint(10, 5000))} for p in purposes],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive initiate-payment -> callback -> status-check against a running app "
+        "(pointed at run_coopbank_simulator) and report throughput, latency "
+        "percentiles and consistency violations"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/api/v1/mpesa")
+        parser.add_argument("--simulator-url", default="http://127.0.0.1:8099")
+        parser.add_argument("--donors", type=int, default=200, help="Payment flows to run")
+        parser.add_argument("--concurrency", type=int, default=20, help="Flows in flight at once")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between status checks")
+        parser.add_argument("--timeout", type=float, default=60.0, help="Seconds a flow may take to reach a final status")
+        parser.add_argument("--settle", type=float, default=5.0, help="Seconds to wait before reading the simulator's state")
+
+    def run_flow(self, index, options):
+        flow = Flow(index)
+        local = self.local
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        session = local.session
+        base = options["base_url"].rstrip("/")
+
+        started = time.perf_counter()
+        try:
+            response = session.post(
+                f"{base}/initiate-payment/", json=fake_payment(index),
+                headers={"Idempotency-Key": str(uuid.uuid4())}, timeout=30,
+            )
+        except requests.RequestException as e:
+            flow.initiate_status = e.__class__.__name__
+            return flow
+        flow.initiate_latency = time.perf_counter() - started
+        flow.initiate_status = response.status_code
+        if response.status_code not in (201, 202):
+            return flow
+        flow.reference = response.json().get("checkout_request_id")
+
+        deadline = started + options["timeout"]
+        while time.perf_counter() < deadline:
+            time.sleep(options["poll_interval"])
+            check_started = time.perf_counter()
+            try:
+                response = session.get(f"{base}/status-check/", params={"checkout_request_id": flow.reference}, timeout=30)
+            except requests.RequestException:
+                continue
+            flow.status_latencies.append(time.perf_counter() - check_started)
+            if response.status_code != 200:
+                continue
+
+            data = response.json()
+            if data.get("status") in FINAL:
+                flow.final_status = data["status"]
+                flow.receipt = data.get("mpesa_receipt_number")
+                flow.end_to_end = time.perf_counter() - started
+                break
+
+        return flow
+
+    def handle(self, *args, **options):
+        self.local = threading.local()
+        donors, concurrency = options["donors"], options["concurrency"]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            flows = list(pool.map(lambda i: self.run_flow(i, options), range(donors)))
+        elapsed = time.perf_counter() - started
+
+        time.sleep(options["settle"])
+        bank = requests.get(f"{options['simulator_url'].rstrip('/')}/_state", timeout=30).json()
+
+        report = {
+            "donors": donors,
+            "concurrency": concurrency,
+            "elapsed_s": round(elapsed, 2),
+            "completed_per_s": round(sum(1 for f in flows if f.final_status) / elapsed, 2) if elapsed else 0,
+            "initiate_statuses": self.tally(str(f.initiate_status) for f in flows),
+            "final_statuses": self.tally(f.final_status or "not_final" for f in flows if f.reference),
+            "latency": {
+                "initiate": latency_summary([f.initiate_latency for f in flows if f.initiate_latency is not None]),
+                "status_check": latency_summary([t for f in flows for t in f.status_latencies]),
+                "end_to_end": latency_summary([f.end_to_end for f in flows if f.end_to_end is not None]),
+            },
+            "bank_counters": bank["counters"],
+            "violations": self.violations(flows, bank["pushes"]),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+        if report["violations"]["total"]:
+            self.stdout.write(self.style.ERROR(f"{report['violations']['total']} consistency violations"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No consistency violations"))
+
+    def tally(self, values):
+        counts = {}
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def violations(self, flows, pushes):
+        """
+        Compare what donors were shown with what the bank decided:
+        - status_mismatch: final status differs from the bank's outcome
+        - receipt_mismatch: SUCCESS with a different (or no) M-Pesa receipt
+        - duplicate_push: the bank received more than one push for a reference
+        - stuck: never reached SUCCESS/FAILED within --timeout
+        - unknown_to_bank: accepted by the app but never pushed (and not failed)
+        """
+        found = {k: [] for k in ("status_mismatch", "receipt_mismatch", "duplicate_push", "stuck", "unknown_to_bank")}
+
+        for flow in flows:
+            if not flow.reference:
+                continue
+            push = pushes.get(flow.reference)
+
+            if push is None:
+                if flow.final_status != "FAILED":
+                    found["unknown_to_bank"].append(flow.reference)
+                continue
+            if push["pushes"] > 1:
+                found["duplicate_push"].append(flow.reference)
+            if flow.final_status is None:
+                found["stuck"].append(flow.reference)
+            elif flow.final_status != push["outcome"]:
+                found["status_mismatch"].append(flow.reference)
+            elif flow.final_status == "SUCCESS" and flow.receipt != push["receipt"]:
+                found["receipt_mismatch"].append(flow.reference)
+
+        summary = {name: {"count": len(refs), "sample": refs[:5]} for name, refs in found.items()}
+        summary["total"] = sum(len(refs) for refs in found.values())
+        return summary
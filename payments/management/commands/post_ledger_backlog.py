@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from payments.ledger import post_transactions, restate_balances
+from payments.models import LedgerEntry, MpesaTransaction
+from payments.transitions import SUCCESS
+
+
+class Command(BaseCommand):
+    help = (
+        "Post ledger journals for SUCCESS transactions that have none "
+        "(transactions settled before the ledger existed), oldest first, "
+        "dated when each transaction settled"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        posted_entries = LedgerEntry.objects.filter(transaction=OuterRef("pk"))
+        backlog = (
+            MpesaTransaction.objects
+            .filter(status=SUCCESS)
+            .exclude(Exists(posted_entries))
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+        posted = 0
+        last_id = 0
+        while True:
+            ids = list(backlog.filter(id__gt=last_id)[:options["batch_size"]])
+            if not ids:
+                break
+            posted += post_transactions(ids, at_settlement=True)
+            last_id = ids[-1]
+            self.stdout.write(f"Posted {posted}")
+
+        # Backdated journals land behind newer ones: redo the running balances
+        corrected = restate_balances() if posted else 0
+        self.stdout.write(self.style.SUCCESS(f"Done: posted {posted} transactions, restated {corrected} balances"))
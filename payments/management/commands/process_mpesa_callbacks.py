@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from payments.callbacks import run_callback_processor
+
+
+class Command(BaseCommand):
+    help = "Apply callbacks stored in the M-Pesa callback inbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the inbox is empty")
+        parser.add_argument("--once", action="store_true", help="Drain the inbox and exit")
+
+    def handle(self, *args, **options):
+        totals = run_callback_processor(
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Done: {totals}"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from payments.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete payment idempotency keys older than IDEMPOTENCY_KEY_TTL"
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} idempotency keys"))
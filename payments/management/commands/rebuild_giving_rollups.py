@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from payments.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the day/week/month giving rollups from the transaction ledger"
+
+    def handle(self, *args, **options):
+        rows = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup rows"))
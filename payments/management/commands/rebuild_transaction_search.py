@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from payments.models import MpesaTransaction
+from payments.search import ensure_search_indexes
+
+
+class Command(BaseCommand):
+    help = "Backfill the normalised search columns and (on Postgres) the search indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        ensure_search_indexes()
+
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(
+                MpesaTransaction.objects
+                .filter(id__gt=last_id)
+                .order_by("id")
+                .only("id", "name", "email", "phone_number")[:options["batch_size"]]
+            )
+            if not batch:
+                break
+            for tx in batch:
+                tx.refresh_search_fields()
+            MpesaTransaction.objects.bulk_update(batch, ["search_text", "phone_normalized"])
+            updated += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Updated {updated}")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {updated} transactions"))
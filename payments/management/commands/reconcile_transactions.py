@@ -0,0 +1,31 @@
+import json
+from django.core.management.base import BaseCommand
+from payments.reconcile import reconcile_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Settle stale PENDING/PROCESSING transactions by querying Co-op Bank. "
+        "Safe to schedule (e.g. every 10 minutes from cron): a run that starts while "
+        "another is still going exits without querying."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-age", type=int, default=10, help="Only transactions older than this many minutes")
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=8, help="Status enquiries in flight at once")
+        parser.add_argument("--rate", type=float, default=5.0, help="Max status enquiries per second (one run at a time, so this is the total)")
+        parser.add_argument("--limit", type=int, help="Stop after this many transactions")
+        parser.add_argument("--dry-run", action="store_true", help="Query the bank but do not update anything")
+
+    def handle(self, *args, **options):
+        report = reconcile_pending(
+            min_age_minutes=options["min_age"],
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            rate=options["rate"],
+            limit=options["limit"],
+            dry_run=options["dry_run"],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(json.dumps(report, indent=2)))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from payments.simulator import CoopBankSimulator, SimulatorConfig
+
+
+class Command(BaseCommand):
+    help = "Serve a local Co-op Bank STK simulator (token, push, status, callbacks) for load tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8099)
+        parser.add_argument("--latency", type=float, default=0.1, help="Mean response time (seconds)")
+        parser.add_argument("--jitter", type=float, default=0.05, help="+/- seconds around --latency")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered 503")
+        parser.add_argument("--success-rate", type=float, default=0.9, help="Share of pushes the donor approves")
+        parser.add_argument("--callback-delay", type=float, default=2.0, help="Seconds before the callback is sent")
+        parser.add_argument("--drop-callback-rate", type=float, default=0.0, help="Share of callbacks never sent")
+        parser.add_argument("--callback-url", help="Send callbacks here instead of the push's CallBackUrl")
+
+    def handle(self, *args, **options):
+        config = SimulatorConfig(
+            latency=options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            success_rate=options["success_rate"],
+            callback_delay=options["callback_delay"],
+            callback_url=options["callback_url"],
+            drop_callback_rate=options["drop_callback_rate"],
+        )
+        simulator = CoopBankSimulator(config, host=options["host"], port=options["port"])
+        base = f"http://{options['host']}:{options['port']}"
+
+        self.stdout.write(self.style.SUCCESS(f"Co-op Bank simulator listening on {base}"))
+        self.stdout.write(f"  COOPBANK_TOKEN_URL={base}/token")
+        self.stdout.write(f"  COOPBANK_STK_URL={base}/stk")
+        self.stdout.write(f"  COOPBANK_STATUS_URL={base}/status")
+
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.shutdown()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from payments.dispatch import run_dispatcher
+
+
+class Command(BaseCommand):
+    help = "Send queued STK pushes (COOPBANK_ASYNC_DISPATCH mode) concurrently"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8, help="Pushes in flight at once")
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--stale-after", type=int, default=300, help="Seconds before a SENDING push is given up")
+        parser.add_argument("--once", action="store_true", help="Drain the queue and exit")
+
+    def handle(self, *args, **options):
+        sent, failed = run_dispatcher(
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+            stale_after=options["stale_after"],
+            once=options["once"],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Done: sent={sent}, failed={failed}"))
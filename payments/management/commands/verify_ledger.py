@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from payments.ledger import verify_ledger
+
+
+class Command(BaseCommand):
+    help = "Recompute fund balances from ledger entries and report any drift"
+
+    def handle(self, *args, **options):
+        problems = verify_ledger(stdout=self.stdout)
+        for problem in problems:
+            self.stdout.write(self.style.ERROR(problem))
+        if problems:
+            raise CommandError(f"Ledger drift: {len(problems)} problems")
+        self.stdout.write(self.style.SUCCESS("Ledger balanced: balances match their entries"))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 class MpesaTransaction(models.Model):
@@ -10,16 +11,73 @@ class MpesaTransaction(models.Model):
     checkout_request_id = models.CharField(max_length=100, unique=True, blank=True, null=True)
 
     # Co-op Bank reference (from the response)
-    coop_message_reference = models.CharField(max_length=100, blank=True, null=True)
+    coop_message_reference = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     status = models.CharField(max_length=20, default='PENDING')
-    mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
+    mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True, db_index=True)
     transaction_date = models.DateTimeField(blank=True, null=True)
 
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    # Purposes of the lines, denormalised at write time (see payments/purposes.py)
+    purpose_mask = models.PositiveIntegerField(default=0, db_index=True)
+    purpose_tag = models.CharField(max_length=60, blank=True, default='')
+
+    # Bumped by every status transition (optimistic concurrency, see payments/transitions.py)
+    version = models.PositiveIntegerField(default=0)
+
+    # Normalised copies for search (see payments/search.py)
+    # name (150) + email (254): a TextField, so it is never too long on Postgres
+    search_text = models.TextField(blank=True, default='')
+    phone_normalized = models.CharField(max_length=15, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Keyset walks over open transactions (reconciliation)
+            models.Index(fields=['status', 'id'], name='mpesa_tx_status_id_idx'),
+            # Treasurer date-range filters
+            models.Index(fields=['transaction_date', 'id'], name='mpesa_tx_date_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.status}"
 
+    def refresh_search_fields(self):
+        from .search import normalize_phone, normalize_text
+        self.phone_normalized = normalize_phone(self.phone_number)
+        # The phone is in search_text too, so partial numbers use its trigram index
+        self.search_text = normalize_text(self.name, self.email, self.phone_normalized)
+
+    def save(self, *args, **kwargs):
+        self.refresh_search_fields()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"search_text", "phone_normalized"}
+        super().save(*args, **kwargs)
+
+
+class MpesaTransactionStatusLog(models.Model):
+    """Append-only history of status transitions"""
+    transaction = models.ForeignKey(
+        MpesaTransaction,
+        related_name='status_log',
+        on_delete=models.CASCADE
+    )
+    from_status = models.CharField(max_length=20)
+    to_status = models.CharField(max_length=20)
+    # Version the transaction moved to
+    version = models.PositiveIntegerField()
+    # What applied it: callback, status_check, reconcile, dispatch, initiate, bank_import
+    source = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['transaction', 'id'], name='mpesa_status_log_tx_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id}: {self.from_status} -> {self.to_status}"
 
 class MpesaPurpose(models.Model):
     PURPOSE_CHOICES = [
@@ -50,3 +108,298 @@ class MpesaPurpose(models.Model):
 
     def __str__(self):
         return f"{self.purpose} - {self.amount}"
+
+
+class CoopAccessToken(models.Model):
+    """Shared Co-op Bank OAuth token (used when COOPBANK_TOKEN_STORE = "db")"""
+    name = models.CharField(max_length=50, unique=True)
+    access_token = models.TextField(blank=True)
+    expires_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.expires_at}"
+
+
+class StkPushDispatch(models.Model):
+    """Queued STK push, sent by the `run_stk_dispatcher` worker"""
+    QUEUED = 'QUEUED'
+    SENDING = 'SENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    transaction = models.OneToOneField(
+        MpesaTransaction,
+        related_name='dispatch',
+        on_delete=models.CASCADE
+    )
+    # Exact arguments for stk_push_request
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='stk_dispatch_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction.checkout_request_id} - {self.status}"
+
+
+class MpesaCallback(models.Model):
+    """
+    Append-only inbox of raw Co-op Bank callbacks.
+    The callback view only inserts here; `process_mpesa_callbacks` applies them.
+    """
+    message_reference = models.CharField(max_length=100, db_index=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    processed_at = models.DateTimeField(blank=True, null=True)
+    outcome = models.CharField(max_length=20, blank=True)
+    # Failed attempts to apply it, and the last error
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Small index covering only the unprocessed backlog
+            models.Index(
+                fields=['id'],
+                name='mpesa_callback_pending_idx',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.message_reference} - {self.outcome or 'pending'}"
+
+
+class GivingRollup(models.Model):
+    """
+    Running totals per (period bucket, purpose, status), kept up to date
+    by payments/rollups.py so dashboards never scan the ledger.
+    """
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+    PERIOD_CHOICES = [
+        (DAY, 'Day'),
+        (WEEK, 'Week'),
+        (MONTH, 'Month'),
+    ]
+
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    # First day of the day / week (Monday) / month
+    bucket = models.DateField()
+    purpose = models.CharField(max_length=50, choices=MpesaPurpose.PURPOSE_CHOICES)
+    status = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'bucket', 'purpose', 'status'],
+                name='giving_rollup_unique_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket} {self.purpose} {self.status}: {self.amount}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    One row per payment initiation, keyed by the client's Idempotency-Key
+    header (or a key derived from the request). Retries replay the stored
+    response instead of sending another STK push.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    # sha256 of the normalised request, so a key reused for a different payment is refused
+    request_hash = models.CharField(max_length=64)
+    transaction = models.ForeignKey(
+        MpesaTransaction,
+        related_name='idempotency_keys',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    # Empty until the original request has finished
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} - {self.response_status or 'in progress'}"
+
+
+class GivingStatement(models.Model):
+    """
+    Last generated annual statement per donor (normalised phone).
+    `fingerprint` is a hash of the totals it was rendered from, so
+    `generate_giving_statements` only re-renders donors whose giving changed.
+    """
+    year = models.PositiveSmallIntegerField()
+    phone_normalized = models.CharField(max_length=15)
+    donor_name = models.CharField(max_length=150, blank=True)
+    email = models.EmailField(blank=True, null=True)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fingerprint = models.CharField(max_length=64)
+    file = models.FileField(upload_to='statements/', blank=True)
+    generated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['year', 'phone_normalized'],
+                name='giving_statement_unique_donor_year',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.year} {self.phone_normalized}: {self.total_amount}"
+
+
+class BankStatementImport(models.Model):
+    """One imported bank settlement file (see payments/bank_import.py)"""
+    file_name = models.CharField(max_length=255)
+    imported_at = models.DateTimeField(default=timezone.now)
+    line_count = models.PositiveIntegerField(default=0)
+    matched_count = models.PositiveIntegerField(default=0)
+    discrepancy_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.imported_at:%Y-%m-%d})"
+
+
+class BankStatementLine(models.Model):
+    """Staging row for one settlement line, matched to a transaction in bulk"""
+    RECEIPT = 'receipt'
+    REFERENCE = 'reference'
+    AMOUNT_PHONE_TIME = 'amount_phone_time'
+    MATCH_CHOICES = [
+        (RECEIPT, 'M-Pesa receipt'),
+        (REFERENCE, 'Payment reference'),
+        (AMOUNT_PHONE_TIME, 'Amount, phone and time'),
+    ]
+
+    UNMATCHED = 'unmatched'
+    AMBIGUOUS = 'ambiguous'
+    DUPLICATE = 'duplicate'
+    AMOUNT_MISMATCH = 'amount_mismatch'
+    FAILED_BUT_PAID = 'failed_but_paid'
+    DISCREPANCY_CHOICES = [
+        (UNMATCHED, 'No matching transaction'),
+        (AMBIGUOUS, 'Several lines matched one transaction'),
+        (DUPLICATE, 'Transaction already matched by another line'),
+        (AMOUNT_MISMATCH, 'Amount differs from the transaction'),
+        (FAILED_BUT_PAID, 'Transaction is FAILED but the bank settled it'),
+    ]
+
+    statement = models.ForeignKey(BankStatementImport, related_name='lines', on_delete=models.CASCADE)
+    line_number = models.PositiveIntegerField()
+    receipt = models.CharField(max_length=50, blank=True)
+    reference = models.CharField(max_length=100, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    phone_normalized = models.CharField(max_length=15, blank=True)
+    transacted_at = models.DateTimeField(blank=True, null=True)
+
+    matched_transaction = models.ForeignKey(
+        MpesaTransaction,
+        related_name='bank_lines',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    match_method = models.CharField(max_length=20, choices=MATCH_CHOICES, blank=True)
+    discrepancy = models.CharField(max_length=20, choices=DISCREPANCY_CHOICES, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['statement', 'receipt'], name='bank_line_receipt_idx'),
+            models.Index(fields=['statement', 'reference'], name='bank_line_reference_idx'),
+            models.Index(fields=['statement', 'matched_transaction'], name='bank_line_match_idx'),
+        ]
+        constraints = [
+            # A transaction is settled by one bank line, across every import
+            models.UniqueConstraint(
+                fields=['matched_transaction'],
+                condition=models.Q(matched_transaction__isnull=False),
+                name='bank_line_one_per_transaction',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.statement_id}:{self.line_number} {self.receipt or self.reference}"
+
+
+class LedgerAccount(models.Model):
+    """
+    A fund (Tithe, Camp Offering, DEVGR:<group>...) or the M-Pesa clearing
+    asset account. `balance` is maintained with every posting, so reading
+    it never sums entries.
+    """
+    FUND = 'fund'
+    ASSET = 'asset'
+    KIND_CHOICES = [
+        (FUND, 'Fund'),
+        (ASSET, 'Asset'),
+    ]
+
+    code = models.CharField(max_length=150, unique=True)
+    name = models.CharField(max_length=150)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=FUND)
+    # Funds have credit balances, assets debit balances - both stored positive
+    balance = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    entry_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.code}: {self.balance}"
+
+
+class LedgerEntry(models.Model):
+    """
+    Immutable double-entry line. Each successful transaction posts one
+    journal: a debit to M-Pesa clearing for the total and a credit to each
+    purpose's fund. Corrections are new entries, never edits.
+    """
+    account = models.ForeignKey(LedgerAccount, related_name='entries', on_delete=models.PROTECT)
+    transaction = models.ForeignKey(
+        MpesaTransaction,
+        related_name='ledger_entries',
+        on_delete=models.PROTECT
+    )
+    debit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    credit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Account balance right after this entry (for "balance as of" lookups)
+    balance_after = models.DecimalField(max_digits=16, decimal_places=2)
+    posted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'posted_at', 'id'], name='ledger_entry_account_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Ledger entries are immutable")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are immutable")
+
+    def __str__(self):
+        return f"{self.account_id} Dr {self.debit} Cr {self.credit} -> {self.balance_after}"
@@ -0,0 +1,51 @@
+from django.db import connection
+from rest_framework.pagination import CursorPagination
+
+
+def estimate_count(queryset):
+    """
+    Cheap row count. On Postgres this reads the planner's estimate
+    (EXPLAIN) instead of running COUNT(*) over the whole ledger.
+    """
+    queryset = queryset.order_by()
+    if connection.vendor != "postgresql":
+        return queryset.count()
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class TransactionCursorPagination(CursorPagination):
+    """
+    Keyset pagination on -id: every page is an index seek (id < cursor),
+    so page 1 and page 10,000 cost the same and no COUNT(*) runs.
+
+    ?count=approx adds a planner estimate, ?count=exact a real COUNT(*).
+    """
+    ordering = "-id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        mode = request.query_params.get("count")
+        if mode == "exact":
+            self.count = queryset.order_by().count()
+        elif mode == "approx":
+            self.count = estimate_count(queryset)
+        else:
+            self.count = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data["count"] = self.count
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema["properties"]["count"] = {"type": "integer", "nullable": True}
+        return schema
@@ -0,0 +1,42 @@
+from django.db.models import F, Q
+from django.db.models.lookups import GreaterThan
+from .models import MpesaPurpose
+
+
+# One bit per purpose choice; MpesaTransaction.purpose_mask is the OR of its lines.
+# Append new choices at the end so existing masks keep their meaning.
+PURPOSE_BITS = {code: 1 << i for i, (code, _) in enumerate(MpesaPurpose.PURPOSE_CHOICES)}
+
+_BY_LOWER = {code.lower(): code for code in PURPOSE_BITS}
+
+
+def purpose_mask(codes):
+    mask = 0
+    for code in codes:
+        mask |= PURPOSE_BITS.get(code, 0)
+    return mask
+
+
+def purpose_tag(codes):
+    """'#TITHE' for a single line, '#MULTI' for several (as shown to donors)."""
+    codes = list(codes)
+    if not codes:
+        return ""
+    return "#MULTI" if len(codes) > 1 else f"#{codes[0].upper()}"
+
+
+def purpose_fields(codes):
+    """Denormalised purpose columns for a transaction with these purpose lines."""
+    codes = list(codes)
+    return {"purpose_mask": purpose_mask(codes), "purpose_tag": purpose_tag(codes)}
+
+
+def purpose_filter(purpose):
+    """
+    Q for transactions with a `purpose` line (case-insensitive), read from
+    the mask column alone: purpose_mask & bit > 0, no join.
+    """
+    code = _BY_LOWER.get((purpose or "").lower())
+    if code is None:
+        return Q(pk__in=[])
+    return Q(GreaterThan(F("purpose_mask").bitand(PURPOSE_BITS[code]), 0))
@@ -0,0 +1,147 @@
+import time
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+from .coopbank import stk_status_request
+from .metrics import latency_summary
+from .models import MpesaTransaction
+from .transport import reserve_bank_slots
+from .transitions import (
+    OPEN_STATUSES, apply_results, parse_result_metadata, status_from_enquiry_code
+)
+
+
+# Held in the shared cache while a reconciliation runs, renewed every batch
+RUN_LEASE_KEY = "payments:reconcile:running"
+RUN_LEASE_TIMEOUT = 600
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1/rate seconds apart across all threads,
+    so a large backlog is drained at a steady pace instead of a burst.
+
+    The pace is per process. reconcile_pending holds a lease in the shared
+    cache, so only one reconciliation runs at a time and `rate` is the
+    total; other bank calls (donor status polls) are not counted.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def iter_stale_batches(min_age, batch_size, limit=None):
+    """
+    Yield open transactions older than `min_age` in id order.
+    Keyset (id > last_id) instead of OFFSET keeps every batch an index seek.
+    """
+    cutoff = timezone.now() - min_age
+    last_id = 0
+    seen = 0
+
+    while limit is None or seen < limit:
+        size = batch_size if limit is None else min(batch_size, limit - seen)
+        batch = list(
+            MpesaTransaction.objects
+            .filter(
+                status__in=OPEN_STATUSES,
+                created_at__lt=cutoff,
+                checkout_request_id__isnull=False,
+                id__gt=last_id,
+            )
+            .order_by("id")
+            .values("id", "checkout_request_id")[:size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]["id"]
+        seen += len(batch)
+
+
+def query_status(row, limiter):
+    """Returns (result tuple or None, latency seconds)."""
+    limiter.wait()
+    started = time.monotonic()
+    try:
+        data = stk_status_request(row["checkout_request_id"])
+    except Exception:
+        return None, time.monotonic() - started
+    finally:
+        close_old_connections()
+
+    latency = time.monotonic() - started
+    status = status_from_enquiry_code(data.get("MessageCode"))
+    receipt, transaction_date = parse_result_metadata(data)
+    return (row["id"], status, receipt, transaction_date), latency
+
+
+def reconcile_pending(min_age_minutes=10, batch_size=200, workers=8, rate=5.0,
+                      limit=None, dry_run=False, stdout=None):
+    """
+    Ask Co-op Bank for the status of every stale PENDING/PROCESSING
+    transaction and apply the answers in bulk.
+
+    `workers` bounds the calls in flight and `rate` caps calls per second,
+    so tens of thousands of stuck rows after an outage are worked off
+    without stampeding the bank. If another reconciliation already holds
+    the lease (an overlapping cron run, another server), returns at once
+    with `skipped`.
+    """
+    if not cache.add(RUN_LEASE_KEY, 1, RUN_LEASE_TIMEOUT):
+        return {"skipped": "another reconciliation is running"}
+    try:
+        return _reconcile(min_age_minutes, batch_size, workers, rate, limit, dry_run, stdout)
+    finally:
+        cache.delete(RUN_LEASE_KEY)
+
+
+def _reconcile(min_age_minutes, batch_size, workers, rate, limit, dry_run, stdout):
+    limiter = RateLimiter(rate)
+    reserve_bank_slots(workers)
+    outcomes = {"SUCCESS": 0, "FAILED": 0, "PROCESSING": 0, "error": 0}
+    latencies = []
+    checked = changed = 0
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in iter_stale_batches(timedelta(minutes=min_age_minutes), batch_size, limit):
+            results = []
+            for result, latency in pool.map(lambda row: query_status(row, limiter), batch):
+                latencies.append(latency)
+                if result is None:
+                    outcomes["error"] += 1
+                    continue
+                outcomes[result[1]] += 1
+                results.append(result)
+
+            checked += len(batch)
+            if results and not dry_run:
+                changed += apply_results(results, source="reconcile")
+
+            cache.touch(RUN_LEASE_KEY, RUN_LEASE_TIMEOUT)
+            if stdout:
+                stdout.write(f"Checked {checked} (changed {changed})")
+
+    elapsed = time.monotonic() - started
+    return {
+        "checked": checked,
+        "changed": changed,
+        "outcomes": outcomes,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(checked / elapsed, 2) if elapsed else 0,
+        "latency": latency_summary(latencies),
+    }
@@ -0,0 +1,132 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+from .models import GivingRollup, MpesaPurpose
+
+
+PERIOD_TRUNCS = {
+    GivingRollup.DAY: TruncDay,
+    GivingRollup.WEEK: TruncWeek,
+    GivingRollup.MONTH: TruncMonth,
+}
+
+
+def buckets_for(created_at):
+    """(period, bucket date) pairs a transaction created at `created_at` counts towards."""
+    day = timezone.localdate(created_at)
+    return [
+        (GivingRollup.DAY, day),
+        (GivingRollup.WEEK, day - timedelta(days=day.weekday())),
+        (GivingRollup.MONTH, day.replace(day=1)),
+    ]
+
+
+def add_to_rollups(deltas):
+    """
+    Apply {(period, bucket, purpose, status): (amount, count)} with
+    F() increments, creating missing rows. Runs in the caller's transaction.
+    """
+    for (period, bucket, purpose, status), (amount, count) in deltas.items():
+        if not amount and not count:
+            continue
+        key = dict(period=period, bucket=bucket, purpose=purpose, status=status)
+        updated = GivingRollup.objects.filter(**key).update(
+            amount=F("amount") + amount, count=F("count") + count
+        )
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                GivingRollup.objects.create(amount=amount, count=count, **key)
+        except IntegrityError:
+            # Created concurrently - increment it instead
+            GivingRollup.objects.filter(**key).update(
+                amount=F("amount") + amount, count=F("count") + count
+            )
+
+
+def _collect(deltas, created_at, purpose, amount, status, sign):
+    for period, bucket in buckets_for(created_at):
+        key = (period, bucket, purpose, status)
+        total, count = deltas.get(key, (Decimal("0"), 0))
+        deltas[key] = (total + sign * amount, count + sign)
+
+
+def record_new_transaction(mpesa_transaction, purposes):
+    """Count a newly created transaction under its initial status."""
+    deltas = {}
+    for p in purposes:
+        _collect(deltas, mpesa_transaction.created_at, p["purpose"], p["amount"], mpesa_transaction.status, 1)
+    add_to_rollups(deltas)
+
+
+def record_status_changes(moves):
+    """
+    Move transactions between status buckets.
+    `moves` is a list of (transaction_id, old_status, new_status).
+    """
+    moves = [m for m in moves if m[1] != m[2]]
+    if not moves:
+        return
+
+    by_id = {tx_id: (old, new) for tx_id, old, new in moves}
+    lines = MpesaPurpose.objects.filter(transaction_id__in=list(by_id)).values_list(
+        "transaction_id", "purpose", "amount", "transaction__created_at"
+    )
+
+    deltas = {}
+    for tx_id, purpose, amount, created_at in lines:
+        old, new = by_id[tx_id]
+        _collect(deltas, created_at, purpose, amount, old, -1)
+        _collect(deltas, created_at, purpose, amount, new, 1)
+    add_to_rollups(deltas)
+
+
+def lock_rollups():
+    """
+    Hold writers off the rollup table until the caller's transaction ends
+    (Postgres; SQLite already runs one writer at a time). Reads still go on.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {GivingRollup._meta.db_table} IN EXCLUSIVE MODE")
+
+
+def rebuild_rollups():
+    """
+    Recompute every rollup from the ledger (one GROUP BY per period).
+
+    The source is read and the rows swapped in one transaction, with the
+    rollup table locked first: a transaction that commits before the lock
+    is in the recount, and one still open adds its increment after the
+    swap, so none is lost or counted twice.
+    """
+    with transaction.atomic():
+        lock_rollups()
+
+        rows = []
+        for period, trunc in PERIOD_TRUNCS.items():
+            grouped = (
+                MpesaPurpose.objects
+                .annotate(bucket=trunc("transaction__created_at", output_field=DateField()))
+                .values("bucket", "purpose", "transaction__status")
+                .annotate(amount=Sum("amount"), count=Count("id"))
+            )
+            rows.extend(
+                GivingRollup(
+                    period=period,
+                    bucket=g["bucket"],
+                    purpose=g["purpose"],
+                    status=g["transaction__status"],
+                    amount=g["amount"],
+                    count=g["count"],
+                )
+                for g in grouped
+            )
+
+        GivingRollup.objects.all().delete()
+        GivingRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,129 @@
+import logging
+import re
+from functools import lru_cache
+from django.db import connections
+from django.db.models import Q, Value, FloatField, Case, When
+
+
+RECEIPT_RE = re.compile(r"^[A-Za-z0-9]{4,12}$")
+
+# Postgres-only indexes, created by ensure_search_indexes() after migrate.
+# Other databases (SQLite in tests) fall back to plain LIKE scans.
+POSTGRES_SEARCH_INDEXES = [
+    # Prefix (LIKE 'abc%') lookups on receipt and phone
+    "CREATE INDEX IF NOT EXISTS mpesa_tx_receipt_prefix "
+    "ON payments_mpesatransaction (mpesa_receipt_number varchar_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS mpesa_tx_phone_prefix "
+    "ON payments_mpesatransaction (phone_normalized varchar_pattern_ops)",
+]
+# Substring / fuzzy search on name + email + phone. Needs the pg_trgm
+# extension, which is installed once by hand (see README): creating it
+# takes rights the app's database user often doesn't have.
+TRIGRAM_INDEX = (
+    "CREATE INDEX IF NOT EXISTS mpesa_tx_search_trgm "
+    "ON payments_mpesatransaction USING gin (search_text gin_trgm_ops)"
+)
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------
+# Normalisation
+# ------------------------------------------------------
+def normalize_phone(value):
+    """'0712 345 678' / '+254712345678' -> '254712345678'"""
+    digits = re.sub(r"\D", "", value or "")
+    if digits.startswith("0"):
+        digits = "254" + digits[1:]
+    return digits
+
+
+def normalize_text(*values):
+    """Lower-cased, single-spaced text used for substring search."""
+    return " ".join(" ".join(v for v in values if v).lower().split())
+
+
+@lru_cache(maxsize=None)
+def has_trigram(using="default"):
+    """Is pg_trgm installed? Checked once per process."""
+    db = connections[using]
+    if db.vendor != "postgresql":
+        return False
+    with db.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def ensure_search_indexes(sender=None, using="default", **kwargs):
+    """post_migrate hook: add the prefix and (with pg_trgm) trigram indexes on Postgres."""
+    db = connections[using]
+    if db.vendor != "postgresql":
+        return
+    has_trigram.cache_clear()
+    statements = list(POSTGRES_SEARCH_INDEXES)
+    if has_trigram(using):
+        statements.append(TRIGRAM_INDEX)
+    else:
+        logger.warning("pg_trgm is not installed: transaction search runs without its trigram index")
+    with db.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+# ------------------------------------------------------
+# Query building
+# ------------------------------------------------------
+def search_filter(term):
+    """
+    Q object for a treasurer search term:
+    - receipt-like terms match the receipt by prefix,
+    - phone-like terms typed with 0/254/+ match the normalised phone by prefix,
+    - everything matches name/email/phone by substring (trigram-indexed),
+      which also covers partial phone numbers.
+    """
+    term = term.strip()
+    query = Q(search_text__contains=normalize_text(term))
+
+    if RECEIPT_RE.match(term):
+        query |= Q(mpesa_receipt_number__startswith=term.upper())
+
+    digits = re.sub(r"\D", "", term)
+    if len(digits) >= 3 and not re.search(r"[A-Za-z]", term):
+        if term.startswith(("0", "+", "254")):
+            query |= Q(phone_normalized__startswith=normalize_phone(term))
+        else:
+            # "712 345": the digits alone, through the trigram index
+            query |= Q(search_text__contains=digits)
+
+    return query
+
+
+def rank_expression(term):
+    """
+    Relevance score: exact receipt / phone hits first, then trigram
+    similarity where pg_trgm is installed (0 elsewhere).
+    """
+    term = term.strip()
+    whens = []
+    if term:
+        whens.append(When(mpesa_receipt_number=term.upper(), then=Value(2.0)))
+    phone = normalize_phone(term)
+    if phone:
+        # A term without digits normalises to "", which every phone-less row would match
+        whens.append(When(phone_normalized=phone, then=Value(1.5)))
+    exact = Case(*whens, default=Value(0.0), output_field=FloatField())
+    if not has_trigram():
+        return exact
+
+    from django.contrib.postgres.search import TrigramSimilarity
+    return exact + TrigramSimilarity("search_text", normalize_text(term))
+
+
+def search_transactions(queryset, term, limit=50):
+    """Top `limit` transactions for `term`, best match first."""
+    return (
+        queryset
+        .filter(search_filter(term))
+        .annotate(rank=rank_expression(term))
+        .order_by("-rank", "-id")[:limit]
+    )
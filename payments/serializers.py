@@ -1,5 +1,8 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import MpesaTransaction, MpesaPurpose
+from .purposes import purpose_fields
+from .rollups import record_new_transaction
 
 
 class MpesaPurposeSerializer(serializers.ModelSerializer):
@@ -23,17 +26,15 @@ class MpesaTransactionSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         purposes_data = validated_data.pop("purposes")
-
-        # Make parent
-        parent = MpesaTransaction.objects.create(**validated_data)
-
-        total = 0
-        # Create line items
-        for p in purposes_data:
-            MpesaPurpose.objects.create(transaction=parent, **p)
-            total += p["amount"]
-
-        parent.total_amount = total
-        parent.save()
+        validated_data["total_amount"] = sum(p["amount"] for p in purposes_data)
+        validated_data.update(purpose_fields(p["purpose"] for p in purposes_data))
+
+        # One INSERT for the parent (with its final total), one for all line items
+        with transaction.atomic():
+            parent = MpesaTransaction.objects.create(**validated_data)
+            MpesaPurpose.objects.bulk_create(
+                [MpesaPurpose(transaction=parent, **p) for p in purposes_data]
+            )
+            record_new_transaction(parent, purposes_data)
 
         return parent
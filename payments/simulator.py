@@ -0,0 +1,219 @@
+"""
+Local stand-in for the Co-op Bank STK API, for load tests.
+
+Serves the token, STK push and STK status endpoints that coopbank.py
+calls, and posts the result callback back to the app after a delay.
+Point the app at it with:
+
+    COOPBANK_TOKEN_URL=http://127.0.0.1:8099/token
+    COOPBANK_STK_URL=http://127.0.0.1:8099/stk
+    COOPBANK_STATUS_URL=http://127.0.0.1:8099/status
+
+GET /_state returns what the "bank" decided for every push, so a load
+test can check the app's final statuses against it.
+"""
+import datetime
+import json
+import random
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+
+SUCCESS_CODE = "0"
+PROCESSING_CODE = "S_001"
+CANCELLED_CODE = "1032"
+
+
+class SimulatorConfig:
+    def __init__(self, latency=0.1, jitter=0.05, error_rate=0.0, success_rate=0.9,
+                 callback_delay=2.0, callback_url=None, drop_callback_rate=0.0):
+        self.latency = latency                      # mean response time, seconds
+        self.jitter = jitter                        # +/- seconds around `latency`
+        self.error_rate = error_rate                # share of calls answered 503
+        self.success_rate = success_rate            # share of pushes the donor approves
+        self.callback_delay = callback_delay        # seconds until the donor "enters PIN"
+        self.callback_url = callback_url            # overrides the push's CallBackUrl
+        self.drop_callback_rate = drop_callback_rate  # callbacks never sent (reconciliation path)
+
+
+class Push:
+    def __init__(self, reference, amount, callback_url, approved, complete_at):
+        self.reference = reference
+        self.amount = amount
+        self.callback_url = callback_url
+        self.approved = approved
+        self.complete_at = complete_at
+        self.receipt = "".join(random.choices(string.ascii_uppercase + string.digits, k=10)) if approved else None
+        self.pushes = 1
+        self.callback_status = None
+
+    @property
+    def outcome(self):
+        return "SUCCESS" if self.approved else "FAILED"
+
+    def result_body(self):
+        now = datetime.datetime.utcnow().isoformat() + "Z"
+        if time.time() < self.complete_at:
+            return {"MessageReference": self.reference, "MessageCode": PROCESSING_CODE,
+                    "MessageDescription": "Processing", "MessageDateTime": now}
+        body = {
+            "MessageReference": self.reference,
+            "MessageCode": SUCCESS_CODE if self.approved else CANCELLED_CODE,
+            "MessageDescription": "Success" if self.approved else "Request cancelled by user",
+            "MessageDateTime": now,
+        }
+        if self.approved:
+            body["TransactionMetadata"] = {"Items": [
+                {"Name": "Amount", "Value": str(self.amount)},
+                {"Name": "Narration", "Value": f"STK~{self.receipt}~{self.reference}"},
+            ]}
+        return body
+
+    def state(self):
+        return {
+            "outcome": self.outcome,
+            "receipt": self.receipt,
+            "pushes": self.pushes,
+            "callback_status": self.callback_status,
+        }
+
+
+class CoopBankSimulator:
+    def __init__(self, config, host="127.0.0.1", port=8099, callback_workers=16):
+        self.config = config
+        self.lock = threading.Lock()
+        self.pushes = {}
+        self.counters = {"token": 0, "stk": 0, "status": 0, "errors_injected": 0, "callbacks": 0}
+        self.callbacks = ThreadPoolExecutor(max_workers=callback_workers)
+        self.session = requests.Session()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+
+    # ----- Request handling -----
+    def handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/_state":
+                    return self.reply(200, simulator.state())
+                self.reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                route = self.path.rstrip("/").rsplit("/", 1)[-1]
+                handler = {"token": simulator.token, "stk": simulator.stk_push, "status": simulator.stk_status}.get(route)
+                if handler is None:
+                    return self.reply(404, {"error": "not found"})
+
+                simulator.sleep()
+                if simulator.inject_error():
+                    return self.reply(503, {"error": "Service unavailable (simulated)"})
+                self.reply(*handler(raw))
+
+        return Handler
+
+    def sleep(self):
+        delay = self.config.latency + random.uniform(-self.config.jitter, self.config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def inject_error(self):
+        if random.random() < self.config.error_rate:
+            self.count("errors_injected")
+            return True
+        return False
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # ----- Endpoints -----
+    def token(self, raw):
+        self.count("token")
+        token = "".join(random.choices(string.ascii_letters, k=32))
+        return 200, {"access_token": token, "token_type": "Bearer", "expires_in": 3600}
+
+    def stk_push(self, raw):
+        self.count("stk")
+        payload = json.loads(raw or b"{}")
+        reference = payload.get("MessageReference")
+        if not reference:
+            return 400, {"MessageCode": "-1", "MessageDescription": "MessageReference required"}
+
+        with self.lock:
+            push = self.pushes.get(reference)
+            if push is not None:
+                # A second push for the same reference: the app retried a non-idempotent call
+                push.pushes += 1
+                return 200, {"MessageReference": reference, "MessageCode": "0",
+                             "MessageDescription": "Duplicate request accepted"}
+            push = self.pushes[reference] = Push(
+                reference,
+                payload.get("Amount"),
+                self.config.callback_url or payload.get("CallBackUrl"),
+                approved=random.random() < self.config.success_rate,
+                complete_at=time.time() + self.config.callback_delay,
+            )
+
+        if push.callback_url and random.random() >= self.config.drop_callback_rate:
+            self.callbacks.submit(self.send_callback, push)
+        return 200, {"MessageReference": reference, "MessageCode": "0",
+                     "MessageDescription": "Request accepted for processing"}
+
+    def stk_status(self, raw):
+        self.count("status")
+        reference = json.loads(raw or b"{}").get("MessageReference")
+        with self.lock:
+            push = self.pushes.get(reference)
+        if push is None:
+            return 200, {"MessageReference": reference, "MessageCode": "-1",
+                         "MessageDescription": "Unknown MessageReference"}
+        return 200, push.result_body()
+
+    def send_callback(self, push):
+        time.sleep(max(0.0, push.complete_at - time.time()))
+        try:
+            response = self.session.post(push.callback_url, json=push.result_body(), timeout=10)
+            push.callback_status = response.status_code
+        except requests.RequestException as e:
+            push.callback_status = f"error: {e.__class__.__name__}"
+        self.count("callbacks")
+
+    # ----- Lifecycle -----
+    def state(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "pushes": {ref: push.state() for ref, push in self.pushes.items()},
+            }
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve from a background thread (tests)."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.callbacks.shutdown(wait=False)
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max, Sum
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .models import GivingStatement, MpesaPurpose, MpesaTransaction
+from .transitions import SUCCESS
+
+
+PURPOSE_LABELS = dict(MpesaPurpose.PURPOSE_CHOICES)
+FORMATS = ("html", "pdf")
+
+
+def year_range(year):
+    """[start, end) of a calendar year in the local timezone."""
+    tz = timezone.get_current_timezone()
+    return datetime(year, 1, 1, tzinfo=tz), datetime(year + 1, 1, 1, tzinfo=tz)
+
+
+def successful_in(year):
+    start, end = year_range(year)
+    return MpesaTransaction.objects.filter(status=SUCCESS, created_at__gte=start, created_at__lt=end)
+
+
+# ------------------------------------------------------
+# Collecting
+# ------------------------------------------------------
+def iter_donor_batches(year, batch_size, phones=None):
+    """Distinct donor phones with successful giving in `year`, in keyset batches."""
+    donors = successful_in(year).exclude(phone_normalized="")
+    if phones:
+        donors = donors.filter(phone_normalized__in=phones)
+    donors = donors.order_by("phone_normalized").values_list("phone_normalized", flat=True).distinct()
+
+    last = None
+    while True:
+        page = donors.filter(phone_normalized__gt=last) if last is not None else donors
+        batch = list(page[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def batch_statements(year, phones):
+    """
+    Statement data for a batch of donors: per-purpose totals come from one
+    aggregated query, donor details from one more.
+    Returns {phone: statement dict}.
+    """
+    start, end = year_range(year)
+    lines = (
+        MpesaPurpose.objects
+        .filter(
+            transaction__status=SUCCESS,
+            transaction__created_at__gte=start,
+            transaction__created_at__lt=end,
+            transaction__phone_normalized__in=phones,
+        )
+        .values("transaction__phone_normalized", "purpose")
+        .annotate(total=Sum("amount"), count=Count("transaction", distinct=True))
+        .order_by("transaction__phone_normalized", "purpose")
+    )
+
+    donors = (
+        successful_in(year)
+        .filter(phone_normalized__in=phones)
+        .values("phone_normalized")
+        .annotate(gifts=Count("id"), last_id=Max("id"))
+    )
+    donors = {d["phone_normalized"]: d for d in donors}
+    latest = MpesaTransaction.objects.in_bulk([d["last_id"] for d in donors.values()])
+
+    statements = {}
+    for row in lines:
+        phone = row["transaction__phone_normalized"]
+        statement = statements.get(phone)
+        if statement is None:
+            donor = latest[donors[phone]["last_id"]]
+            statement = statements[phone] = {
+                "year": year,
+                "phone": phone,
+                "donor_name": donor.name,
+                "email": donor.email,
+                "gifts": donors[phone]["gifts"],
+                "total": Decimal("0"),
+                "lines": [],
+            }
+        statement["lines"].append({
+            "purpose": row["purpose"],
+            "label": PURPOSE_LABELS.get(row["purpose"], row["purpose"]),
+            "count": row["count"],
+            "total": row["total"],
+        })
+        statement["total"] += row["total"]
+
+    for statement in statements.values():
+        statement["fingerprint"] = fingerprint(statement)
+    return statements
+
+
+def fingerprint(statement):
+    """Changes whenever anything printed on the statement would change."""
+    body = json.dumps([
+        statement["donor_name"],
+        statement["email"],
+        statement["gifts"],
+        [(line["purpose"], str(line["total"]), line["count"]) for line in statement["lines"]],
+    ])
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+# ------------------------------------------------------
+# Rendering (runs in worker processes)
+# ------------------------------------------------------
+def render_statement(args):
+    statement, output_format = args
+    html = render_to_string("payments/giving_statement.html", {**statement, "generated_at": timezone.now()})
+    if output_format == "pdf":
+        from weasyprint import HTML
+        return statement["phone"], HTML(string=html).write_pdf()
+    return statement["phone"], html.encode()
+
+
+def statement_path(year, phone, output_format):
+    return f"statements/{year}/{phone}.{output_format}"
+
+
+def save_statement(statement, content, output_format):
+    path = statement_path(statement["year"], statement["phone"], output_format)
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(content))
+
+
+# ------------------------------------------------------
+# Job
+# ------------------------------------------------------
+def generate_statements(year, batch_size=500, workers=4, output_format="html", force=False,
+                        phones=None, stdout=None):
+    """
+    Render and store annual statements for every donor with successful
+    giving in `year`. Donors whose fingerprint is unchanged since the last
+    run are skipped unless `force`.
+    Returns {"donors": n, "rendered": n, "skipped": n}.
+    """
+    counts = {"donors": 0, "rendered": 0, "skipped": 0}
+
+    # Spawned, not forked: workers only render templates and never inherit
+    # the caller's open DB connection (or the transaction it may be in)
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=spawn, initializer=django.setup) as pool:
+        for phones_batch in iter_donor_batches(year, batch_size, phones):
+            statements = batch_statements(year, phones_batch)
+            counts["donors"] += len(statements)
+
+            if not force:
+                existing = dict(
+                    GivingStatement.objects
+                    .filter(year=year, phone_normalized__in=list(statements))
+                    .values_list("phone_normalized", "fingerprint")
+                )
+                for phone in [p for p, s in statements.items() if existing.get(p) == s["fingerprint"]]:
+                    del statements[phone]
+                    counts["skipped"] += 1
+
+            if not statements:
+                continue
+
+            rows = []
+            jobs = [(s, output_format) for s in statements.values()]
+            for phone, content in pool.map(render_statement, jobs, chunksize=25):
+                statement = statements[phone]
+                rows.append(GivingStatement(
+                    year=year,
+                    phone_normalized=phone,
+                    donor_name=statement["donor_name"],
+                    email=statement["email"],
+                    total_amount=statement["total"],
+                    fingerprint=statement["fingerprint"],
+                    file=save_statement(statement, content, output_format),
+                    generated_at=timezone.now(),
+                ))
+
+            GivingStatement.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["year", "phone_normalized"],
+                update_fields=["donor_name", "email", "total_amount", "fingerprint", "file", "generated_at"],
+            )
+            counts["rendered"] += len(rows)
+
+            if stdout:
+                stdout.write(f"Rendered {counts['rendered']} statements (skipped {counts['skipped']})")
+
+    return counts
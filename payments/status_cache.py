@@ -0,0 +1,141 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .coopbank import stk_status_request
+from .models import MpesaTransaction
+from .transitions import TERMINAL_STATUSES, status_from_enquiry_code
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution:
+    the first caller runs `fn`, the rest wait for its result.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Returns (result, shared) - `shared` is True for callers that waited."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+        return call.result, False
+
+
+class StatusEnquiryCache:
+    """
+    Front for Co-op Bank status enquiries made while donors poll:
+
+    1. a transaction already SUCCESS/FAILED locally is answered from the DB;
+    2. a recent upstream answer is served from the Django cache (short TTL
+       while the push is open, long TTL once the bank says it is final);
+    3. concurrent polls for the same reference share one upstream call:
+       threads of a process through SingleFlight, worker processes through
+       a lease taken with cache.add on the shared cache.
+    """
+    key_prefix = "coopbank:status:"
+    # Longest a worker holds the lease: the enquiry's read timeout plus a retry
+    lease_timeout = 25
+
+    def __init__(self):
+        self.flight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self._stats = {"local_hits": 0, "cache_hits": 0, "coalesced": 0, "upstream_calls": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def local_final_status(self, message_reference):
+        status = (
+            MpesaTransaction.objects
+            .filter(checkout_request_id=message_reference, status__in=TERMINAL_STATUSES)
+            .values_list("status", flat=True)
+            .first()
+        )
+        if status:
+            self._count("local_hits")
+        return status
+
+    def enquire(self, message_reference):
+        """Returns the Co-op Bank status enquiry body for `message_reference`."""
+        key = self.key_prefix + message_reference
+        data = cache.get(key)
+        if data is not None:
+            self._count("cache_hits")
+            return data
+
+        data, shared = self.flight.do(key, lambda: self._fetch(message_reference, key))
+        if shared:
+            self._count("coalesced")
+        return data
+
+    def _fetch(self, message_reference, key):
+        """
+        Ask the bank, unless another worker already is: the worker that gets
+        the lease makes the call, the others wait for its answer to show up
+        in the cache. If the lease holder dies, the lease expires and a
+        waiter takes over.
+        """
+        lease_key = key + ":lease"
+        while not cache.add(lease_key, 1, self.lease_timeout):
+            time.sleep(0.1)
+            data = cache.get(key)
+            if data is not None:
+                self._count("coalesced")
+                return data
+
+        try:
+            # Answered while we were taking the lease
+            data = cache.get(key)
+            if data is not None:
+                self._count("cache_hits")
+                return data
+
+            self._count("upstream_calls")
+            body = stk_status_request(message_reference)
+            final = status_from_enquiry_code(body.get("MessageCode")) in TERMINAL_STATUSES
+            ttl = settings.COOPBANK_STATUS_FINAL_TTL if final else settings.COOPBANK_STATUS_CACHE_TTL
+            cache.set(key, body, ttl)
+            return body
+        finally:
+            cache.delete(lease_key)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        served = stats["local_hits"] + stats["cache_hits"] + stats["coalesced"]
+        total = served + stats["upstream_calls"]
+        stats["upstream_saved_ratio"] = round(served / total, 3) if total else 0.0
+        return stats
+
+
+status_cache = StatusEnquiryCache()
@@ -1,3 +1,1081 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib.util
+import io
+import json
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .bank_import import import_statement
+from .breaker import BankUnavailable, Bulkhead, BulkheadFullError, CircuitBreaker, CircuitOpenError
+from .callbacks import process_callbacks, run_callback_processor
+from .coopbank import stk_push_request, stk_status_request
+from .dispatch import enqueue_stk_push, run_dispatcher
+from .export import stream_csv
+from .filters import day_start, filter_transactions
+from .ledger import balance_as_of, post_transactions, verify_ledger
+from .live import StatusHub
+from .models import (
+    BankStatementImport, BankStatementLine, GivingRollup, GivingStatement, LedgerAccount, MpesaCallback, MpesaPurpose,
+    MpesaTransaction, StkPushDispatch,
+)
+from .purposes import purpose_fields, purpose_mask
+from .reconcile import RUN_LEASE_KEY, iter_stale_batches, reconcile_pending
+from .rollups import rebuild_rollups, record_new_transaction
+from .search import search_filter, search_transactions
+from .serializers import MpesaTransactionSerializer
+from .simulator import CoopBankSimulator, SimulatorConfig
+from .statements import generate_statements
+from .status_cache import StatusEnquiryCache
+from .tokens import CacheTokenStore, TokenCache
+from .transitions import (
+    FAILED, PENDING, PROCESSING, SUCCESS, TERMINAL_STATUSES,
+    apply_result, apply_results, can_transition, parse_result_metadata, status_from_enquiry_code, transition,
+)
+from .transport import CoopBankClient
 
-# Create your tests here.
+
+PAYLOAD = {
+    "name": "Grace Wanjiku",
+    "phone_number": "0712345678",
+    "email": "grace@example.com",
+    "purposes": [
+        {"purpose": "Tithe", "amount": "1000.00"},
+        {"purpose": "Offering", "amount": "250.00"},
+        {"purpose": "Other", "amount": "100.00", "other_purpose_details": "Choir"},
+    ],
+}
+
+
+def statements(queries, verb, table):
+    prefix = f'{verb} INTO "{table}"' if verb == "INSERT" else f'{verb} "{table}"'
+    return [q["sql"] for q in queries if q["sql"].startswith(prefix)]
+
+
+class InitiationWriteQueriesTests(TestCase):
+    """One initiation = one parent INSERT + one purposes INSERT, no re-saves."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("initiate_payment_api")
+
+    def assertSingleInsertPath(self, queries):
+        self.assertEqual(len(statements(queries, "INSERT", "payments_mpesatransaction")), 1)
+        self.assertEqual(len(statements(queries, "INSERT", "payments_mpesapurpose")), 1)
+
+    def test_serializer_create(self):
+        serializer = MpesaTransactionSerializer(data=PAYLOAD)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        with CaptureQueriesContext(connection) as ctx:
+            tx = serializer.save(checkout_request_id="Tithe-abc1234", status="PENDING")
+
+        self.assertSingleInsertPath(ctx.captured_queries)
+        self.assertEqual(statements(ctx.captured_queries, "UPDATE", "payments_mpesatransaction"), [])
+
+        tx.refresh_from_db()
+        self.assertEqual(tx.total_amount, Decimal("1350.00"))
+        self.assertEqual(tx.checkout_request_id, "Tithe-abc1234")
+        self.assertEqual(tx.phone_normalized, "254712345678")
+        self.assertEqual(tx.purposes.count(), 3)
+
+    @override_settings(COOPBANK_ASYNC_DISPATCH=True)
+    def test_initiate_async_dispatch(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, PAYLOAD, format="json")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertSingleInsertPath(ctx.captured_queries)
+        self.assertEqual(len(statements(ctx.captured_queries, "INSERT", "payments_stkpushdispatch")), 1)
+        self.assertEqual(statements(ctx.captured_queries, "UPDATE", "payments_mpesatransaction"), [])
+
+    @override_settings(COOPBANK_ASYNC_DISPATCH=False)
+    @mock.patch("payments.views.stk_push_request", return_value={"MessageReference": "COOP-1"})
+    def test_initiate_sync_push(self, stk_push):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, PAYLOAD, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertSingleInsertPath(ctx.captured_queries)
+        # Only the bank's reference is written back, as a single-column UPDATE
+        updates = statements(ctx.captured_queries, "UPDATE", "payments_mpesatransaction")
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"status"', updates[0])
+
+        tx = MpesaTransaction.objects.get(checkout_request_id=response.data["checkout_request_id"])
+        self.assertEqual(tx.coop_message_reference, "COOP-1")
+        self.assertEqual(stk_push.call_args.kwargs["amount"], 1350)
+        self.assertEqual(stk_push.call_args.kwargs["phone"], "254712345678")
+
+    def test_invalid_purpose_writes_nothing(self):
+        payload = dict(PAYLOAD, purposes=[{"purpose": "Tithe", "amount": "10"}, {"purpose": "Nope", "amount": "5"}])
+        response = self.client.post(self.url, payload, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MpesaTransaction.objects.exists())
+
+
+@override_settings(COOPBANK_ASYNC_DISPATCH=False)
+@mock.patch("payments.views.stk_push_request", return_value={"MessageReference": "COOP-1"})
+class InitiationIdempotencyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("initiate_payment_api")
+
+    def post(self, payload=PAYLOAD, **headers):
+        return self.client.post(self.url, payload, format="json", headers=headers)
+
+    def test_retry_with_key_replays_without_bank_call(self, stk_push):
+        first = self.post(**{"Idempotency-Key": "tap-1"})
+        second = self.post(**{"Idempotency-Key": "tap-1"})
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data["checkout_request_id"], first.data["checkout_request_id"])
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(stk_push.call_count, 1)
+        self.assertEqual(MpesaTransaction.objects.count(), 1)
+
+    def test_double_tap_without_key_is_merged(self, stk_push):
+        first = self.post()
+        second = self.post(dict(PAYLOAD, phone_number="+254712345678"))
+
+        self.assertEqual(second.data["checkout_request_id"], first.data["checkout_request_id"])
+        self.assertEqual(stk_push.call_count, 1)
+
+    @override_settings(IDEMPOTENCY_WINDOW=120)
+    def test_window_slides_from_the_first_request(self, stk_push):
+        from .models import IdempotencyKey
+
+        # A second tap 119s after the first is merged, wherever the clock boundaries fall
+        first = self.post()
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=119))
+        second = self.post()
+        self.assertEqual(second.data["checkout_request_id"], first.data["checkout_request_id"])
+        self.assertEqual(stk_push.call_count, 1)
+
+        # Outside the window the same payment is a new one
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=121))
+        third = self.post()
+        self.assertNotEqual(third.data["checkout_request_id"], first.data["checkout_request_id"])
+        self.assertEqual(stk_push.call_count, 2)
+
+    def test_different_payment_without_key_is_not_merged(self, stk_push):
+        self.post()
+        self.post(dict(PAYLOAD, purposes=[{"purpose": "Tithe", "amount": "999"}]))
+
+        self.assertEqual(stk_push.call_count, 2)
+        self.assertEqual(MpesaTransaction.objects.count(), 2)
+
+    def test_key_reused_for_other_payment_is_refused(self, stk_push):
+        self.post(**{"Idempotency-Key": "tap-2"})
+        response = self.post(dict(PAYLOAD, purposes=[{"purpose": "Tithe", "amount": "5"}]), **{"Idempotency-Key": "tap-2"})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(stk_push.call_count, 1)
+
+    def test_in_progress_key_returns_conflict(self, stk_push):
+        from .idempotency import claim, request_hash
+
+        serializer = MpesaTransactionSerializer(data=PAYLOAD)
+        serializer.is_valid()
+        claim("key:tap-3", request_hash(serializer.validated_data))
+
+        response = self.post(**{"Idempotency-Key": "tap-3"})
+        self.assertEqual(response.status_code, 409)
+        stk_push.assert_not_called()
+
+    def test_bank_failure_releases_key(self, stk_push):
+        stk_push.side_effect = RuntimeError("bank down")
+        self.assertEqual(self.post(**{"Idempotency-Key": "tap-4"}).status_code, 500)
+
+        stk_push.side_effect = None
+        self.assertEqual(self.post(**{"Idempotency-Key": "tap-4"}).status_code, 201)
+        self.assertEqual(stk_push.call_count, 2)
+
+
+# The workers' shared cache, reachable from the test's threads
+class InlinePool:
+    """ThreadPoolExecutor stand-in that runs jobs in the calling thread."""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def map(self, fn, items):
+        return [fn(item) for item in items]
+
+
+@mock.patch("payments.dispatch.ThreadPoolExecutor", InlinePool)
+class DispatcherTests(TransactionTestCase):
+    def queue(self, reference):
+        tx = make_pending(reference)
+        enqueue_stk_push(tx, "254712345678", 100, reference, [], "TITHE")
+        return tx
+
+    def bank(self, phone, amount, reference, other_details, description):
+        if reference == "D-down":
+            raise BankUnavailable("circuit open")
+        if reference == "D-slow":
+            raise requests.ReadTimeout("read timed out")
+        if reference == "D-bad":
+            raise requests.HTTPError("400 Bad Request")
+        return {"MessageReference": f"COOP-{reference}"}
+
+    def test_once_sends_requeues_and_recovers(self):
+        for reference in ("D-ok", "D-down", "D-slow", "D-bad"):
+            self.queue(reference)
+        stale = self.queue("D-stale")
+        StkPushDispatch.objects.filter(transaction=stale).update(
+            status=StkPushDispatch.SENDING, locked_at=timezone.now() - timedelta(minutes=10)
+        )
+
+        with mock.patch("payments.dispatch.stk_push_request", side_effect=self.bank):
+            self.assertEqual(run_dispatcher(workers=2, once=True), (2, 1))
+
+        dispatches = {
+            d.transaction.checkout_request_id: (d.status, d.attempts)
+            for d in StkPushDispatch.objects.select_related("transaction")
+        }
+        self.assertEqual(dispatches, {
+            "D-ok": (StkPushDispatch.SENT, 1),
+            "D-down": (StkPushDispatch.QUEUED, 0),  # never left the process
+            "D-slow": (StkPushDispatch.SENT, 1),
+            "D-bad": (StkPushDispatch.FAILED, 1),
+            "D-stale": (StkPushDispatch.FAILED, 0),
+        })
+        statuses = dict(MpesaTransaction.objects.values_list("checkout_request_id", "status"))
+        # Only the push the bank refused is FAILED; the timed-out and stale
+        # ones wait for their callback or a status enquiry
+        self.assertEqual(statuses, {"D-ok": PENDING, "D-down": PENDING, "D-slow": PENDING, "D-bad": FAILED, "D-stale": PENDING})
+        self.assertEqual(MpesaTransaction.objects.get(checkout_request_id="D-ok").coop_message_reference, "COOP-D-ok")
+        self.assertIn("status enquiry", StkPushDispatch.objects.get(transaction__checkout_request_id="D-slow").last_error)
+
+        # The requeued push goes out on the next pass
+        with mock.patch("payments.dispatch.stk_push_request", return_value={"MessageReference": "COOP-2"}):
+            self.assertEqual(run_dispatcher(once=True), (1, 0))
+        self.assertFalse(StkPushDispatch.objects.filter(status=StkPushDispatch.QUEUED).exists())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TokenRefreshTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_one_refresh_while_the_old_token_is_still_stored(self):
+        # Expires inside the refresh margin: stale, but still readable
+        CacheTokenStore().write("old-token", time.time() + 30)
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            time.sleep(0.3)
+            return "new-token", 3600
+
+        # One TokenCache per simulated worker, so only the store's lock is shared
+        workers = [TokenCache(CacheTokenStore(), fetch, refresh_margin=60) for _ in range(4)]
+        tokens = []
+        threads = [threading.Thread(target=lambda w=w: tokens.append(w.get_token())) for w in workers for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(tokens, ["new-token"] * 12)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    COOPBANK_STATUS_CACHE_TTL=5, COOPBANK_STATUS_FINAL_TTL=3600,
+)
+class StatusEnquiryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_open_answers_expire_quickly_final_ones_are_kept(self):
+        enquiries = StatusEnquiryCache()
+        with mock.patch("payments.status_cache.stk_status_request", side_effect=[
+            {"MessageCode": "S_001"}, {"MessageCode": "0"},
+        ]) as bank, mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            enquiries.enquire("SE-1")
+            enquiries.enquire("SE-1")  # cached
+            self.assertEqual(cache_set.call_args.args[2], 5)
+
+            cache.delete("coopbank:status:SE-1")
+            enquiries.enquire("SE-1")
+            self.assertEqual(cache_set.call_args.args[2], 3600)
+        self.assertEqual(bank.call_count, 2)
+        self.assertEqual(enquiries.stats()["cache_hits"], 1)
+
+    def test_concurrent_polls_on_several_workers_share_one_call(self):
+        def ask_bank(reference):
+            time.sleep(0.3)
+            return {"MessageCode": "S_001", "MessageReference": reference}
+
+        workers = [StatusEnquiryCache() for _ in range(3)]
+        answers = []
+        threads = [
+            threading.Thread(target=lambda w=w: answers.append(w.enquire("SE-2")))
+            for w in workers for _ in range(3)
+        ]
+        with mock.patch("payments.status_cache.stk_status_request", side_effect=ask_bank) as bank:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(bank.call_count, 1)
+        self.assertEqual(answers, [{"MessageCode": "S_001", "MessageReference": "SE-2"}] * 9)
+        self.assertEqual(sum(w.stats()["upstream_calls"] for w in workers), 1)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+        self.client = CoopBankClient(retries=0, breaker=self.breaker, bulkhead=Bulkhead(size=2))
+
+    def fail(self, times):
+        with mock.patch.object(self.client.session, "post", side_effect=requests.ConnectionError("down")):
+            for _ in range(times):
+                with self.assertRaises(requests.ConnectionError):
+                    self.client.post("stk_status", "https://bank.test/")
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self):
+        self.fail(3)
+        self.assertEqual(self.breaker.state(), "open")
+
+        with mock.patch.object(self.client.session, "post") as send:
+            with self.assertRaises(CircuitOpenError):
+                self.client.post("stk_status", "https://bank.test/")
+            send.assert_not_called()
+        self.assertEqual(self.breaker.stats()["rejected"], 1)
+
+    def test_state_is_shared_between_workers(self):
+        # Another worker: its own breaker object over the same cache
+        other = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+        self.fail(3)
+        self.assertEqual(other.state(), "open")
+        with self.assertRaises(CircuitOpenError):
+            other.before_call()
+
+    def test_success_resets_failure_count(self):
+        self.fail(2)
+        with mock.patch.object(self.client.session, "post", return_value=mock.Mock(status_code=200)):
+            self.client.post("stk_status", "https://bank.test/")
+        self.fail(2)
+        self.assertEqual(self.breaker.state(), "closed")
+
+    def test_half_open_probe_closes_or_reopens(self):
+        self.fail(3)
+        with mock.patch("payments.breaker.time.time", return_value=time.time() + 31):
+            self.assertEqual(self.breaker.state(), "half_open")
+            self.assertTrue(self.breaker.before_call())
+            # Only one probe at a time
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.before_call()
+            self.breaker.record_failure(probe=True)
+        self.assertEqual(self.breaker.state(), "open")
+
+        # Re-opened at +31s, so the next probe is due at +61s
+        with mock.patch("payments.breaker.time.time", return_value=time.time() + 62):
+            probe = self.breaker.before_call()
+            self.breaker.record_success(probe)
+            self.assertEqual(self.breaker.state(), "closed")
+
+    def test_bulkhead_rejects_when_full(self):
+        bulkhead = Bulkhead(size=1, wait=0)
+        with bulkhead:
+            with self.assertRaises(BulkheadFullError):
+                with bulkhead:
+                    pass
+        self.assertEqual(bulkhead.stats(), {"size": 1, "in_use": 0, "rejected": 1})
+
+
+class CoopBankSimulatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.simulator = CoopBankSimulator(
+            SimulatorConfig(latency=0, jitter=0, success_rate=1.0, callback_delay=0), port=0
+        )
+        self.simulator.start()
+        self.addCleanup(self.simulator.shutdown)
+        base = "http://%s:%s" % self.simulator.server.server_address
+        self.urls = override_settings(
+            COOPBANK_TOKEN_URL=f"{base}/token",
+            COOPBANK_STK_URL=f"{base}/stk",
+            COOPBANK_STATUS_URL=f"{base}/status",
+            COOPBANK_CALLBACK_URL=None,
+        )
+        self.urls.enable()
+        self.addCleanup(self.urls.disable)
+
+    def test_push_then_status_round_trip(self):
+        response = stk_push_request("254712345678", 100, "Tithe-sim0001", [], "Tithe")
+        self.assertEqual(response["MessageReference"], "Tithe-sim0001")
+
+        body = stk_status_request("Tithe-sim0001")
+        self.assertEqual(status_from_enquiry_code(body["MessageCode"]), "SUCCESS")
+        receipt, _ = parse_result_metadata(body)
+        self.assertEqual(receipt, self.simulator.state()["pushes"]["Tithe-sim0001"]["receipt"])
+
+
+def make_pending(reference):
+    tx = MpesaTransaction.objects.create(
+        name="Stress Donor", phone_number="0712345678", checkout_request_id=reference, total_amount=100
+    )
+    purposes = [{"purpose": "Tithe", "amount": Decimal("100")}]
+    MpesaPurpose.objects.create(transaction=tx, **purposes[0])
+    record_new_transaction(tx, purposes)
+    return tx
+
+
+class StatusTransitionTests(TestCase):
+    def test_processing_never_overwrites_final(self):
+        tx = make_pending("T-1")
+        self.assertEqual(apply_result(Q(pk=tx.pk), SUCCESS, "RCPT1", source="callback"), 1)
+        self.assertEqual(apply_result(Q(pk=tx.pk), PROCESSING, source="status_check"), 0)
+        self.assertEqual(apply_result(Q(pk=tx.pk), FAILED, source="status_check"), 0)
+
+        tx.refresh_from_db()
+        self.assertEqual((tx.status, tx.version, tx.mpesa_receipt_number), (SUCCESS, 1, "RCPT1"))
+        self.assertEqual(
+            list(tx.status_log.values_list("from_status", "to_status", "version", "source")),
+            [(PENDING, SUCCESS, 1, "callback")],
+        )
+
+    def test_stale_version_rereads_before_moving(self):
+        tx = make_pending("T-2")
+        apply_result(Q(pk=tx.pk), PROCESSING)
+        # Caller still holds the pre-PROCESSING read
+        self.assertEqual(transition(tx.pk, SUCCESS, current=(PENDING, 0)), (PROCESSING, 2))
+        self.assertIsNone(transition(tx.pk, FAILED, current=(PROCESSING, 1)))
+
+    def test_update_touches_only_changed_columns(self):
+        tx = make_pending("T-3")
+        with CaptureQueriesContext(connection) as ctx:
+            apply_result(Q(pk=tx.pk), SUCCESS, "RCPT3")
+        update = statements(ctx.captured_queries, "UPDATE", "payments_mpesatransaction")[0]
+        set_clause = update.split(" SET ")[1].split(" WHERE ")[0]
+        self.assertEqual(
+            sorted(c.split(" = ")[0] for c in set_clause.split(", ")),
+            ['"mpesa_receipt_number"', '"status"', '"version"'],
+        )
+
+
+class ReconciliationTests(TestCase):
+    def stale(self, reference, minutes=30, status=PENDING):
+        tx = make_pending(reference)
+        MpesaTransaction.objects.filter(pk=tx.pk).update(
+            created_at=timezone.now() - timedelta(minutes=minutes), status=status
+        )
+        return tx
+
+    def test_stale_batches_page_by_id(self):
+        stale = [self.stale(f"R-{i}").pk for i in range(5)]
+        self.stale("R-done", status=SUCCESS)
+        self.stale("R-fresh", minutes=1)
+        no_ref = self.stale("R-none")
+        MpesaTransaction.objects.filter(pk=no_ref.pk).update(checkout_request_id=None)
+
+        batches = iter_stale_batches(timedelta(minutes=10), 2)
+        first = next(batches)
+        # A row settled between batches is simply not seen again; nothing shifts
+        MpesaTransaction.objects.filter(pk=stale[0]).update(status=SUCCESS)
+        rest = list(batches)
+
+        self.assertEqual([len(b) for b in [first] + rest], [2, 2, 1])
+        self.assertEqual([row["id"] for b in [first] + rest for row in b], stale)
+
+        limited = list(iter_stale_batches(timedelta(minutes=10), 2, limit=3))
+        self.assertEqual([len(b) for b in limited], [2, 1])
+
+    def test_apply_results_moves_only_open_transactions(self):
+        open_tx = self.stale("R-open")
+        processing = self.stale("R-proc", status=PROCESSING)
+        done = make_pending("R-final")
+        apply_result(Q(pk=done.pk), FAILED)
+        results = [
+            (open_tx.pk, SUCCESS, "RCPT-R1", None),
+            (processing.pk, FAILED, None, None),
+            (done.pk, SUCCESS, "RCPT-R3", None),
+        ]
+
+        self.assertEqual(apply_results(results, source="reconcile"), 2)
+        self.assertEqual(apply_results(results, source="reconcile"), 0)
+        statuses = dict(MpesaTransaction.objects.values_list("checkout_request_id", "status"))
+        self.assertEqual(statuses, {"R-open": SUCCESS, "R-proc": FAILED, "R-final": FAILED})
+        self.assertEqual(MpesaTransaction.objects.get(pk=open_tx.pk).mpesa_receipt_number, "RCPT-R1")
+        self.assertEqual(
+            list(MpesaTransaction.objects.get(pk=processing.pk).status_log.values_list("to_status", "source")),
+            [(FAILED, "reconcile")],
+        )
+
+    @mock.patch("payments.reconcile.stk_status_request", return_value={"MessageCode": "0"})
+    def test_overlapping_run_is_skipped(self, enquiry):
+        self.stale("R-lease")
+        cache.add(RUN_LEASE_KEY, 1)
+        try:
+            self.assertIn("skipped", reconcile_pending(workers=1, rate=1000))
+            enquiry.assert_not_called()
+        finally:
+            cache.delete(RUN_LEASE_KEY)
+
+        report = reconcile_pending(workers=1, rate=1000)
+        self.assertEqual((report["checked"], report["changed"]), (1, 1))
+        self.assertIsNone(cache.get(RUN_LEASE_KEY))
+
+
+@override_settings(COOPBANK_CALLBACK_MAX_ATTEMPTS=2)
+class CallbackProcessorTests(TestCase):
+    def callback(self, reference, when="2025-01-05T10:00:00Z"):
+        return MpesaCallback.objects.create(
+            message_reference=reference, payload={"MessageCode": "0", "MessageDateTime": when}
+        )
+
+    def test_bad_callback_does_not_block_the_batch(self):
+        make_pending("CB-1")
+        make_pending("CB-2")
+        self.callback("CB-1")
+        bad = self.callback("CB-2", when="2025-13-45T10:00:00Z")  # parse_datetime raises ValueError
+        self.callback("CB-3")
+
+        with self.assertLogs("payments.callbacks", "ERROR"):
+            self.assertEqual(process_callbacks(), {"applied": 1, "retry": 1, "not_found": 1})
+        self.assertEqual(MpesaTransaction.objects.get(checkout_request_id="CB-1").status, SUCCESS)
+
+        bad.refresh_from_db()
+        self.assertEqual((bad.attempts, bad.outcome, bad.processed_at), (1, "", None))
+        self.assertIn("ValueError", bad.last_error)
+
+        # Second failure reaches the limit: closed as an error, the inbox is clear
+        with self.assertLogs("payments.callbacks", "ERROR"):
+            self.assertEqual(process_callbacks(), {"error": 1})
+        bad.refresh_from_db()
+        self.assertEqual((bad.attempts, bad.outcome), (2, "error"))
+        self.assertIsNotNone(bad.processed_at)
+        self.assertEqual(process_callbacks(), {})
+        self.assertEqual(MpesaTransaction.objects.get(checkout_request_id="CB-2").status, PENDING)
+
+    @mock.patch("payments.callbacks.time.sleep")
+    def test_processor_loop_survives_a_failing_batch(self, sleep):
+        batches = [RuntimeError("db gone"), {"applied": 2}, KeyboardInterrupt()]
+        with mock.patch("payments.callbacks.process_callbacks", side_effect=batches) as process:
+            with self.assertLogs("payments.callbacks", "ERROR"), self.assertRaises(KeyboardInterrupt):
+                run_callback_processor(poll_interval=0)
+        self.assertEqual(process.call_count, 3)
+        sleep.assert_called_once_with(0)
+
+
+@override_settings(LIVE_STATUS_WSGI_WAIT=0)
+class LiveStatusTests(TestCase):
+    def setUp(self):
+        self.url = reverse("status-stream")
+
+    def test_wsgi_long_poll_answers_within_the_bound(self):
+        make_pending("LS-1")
+        response = self.client.get(self.url, {"checkout_request_id": "LS-1", "mode": "poll"})
+        self.assertEqual(json.loads(b"".join(response.streaming_content))["status"], PENDING)
+
+        apply_result(Q(checkout_request_id="LS-1"), SUCCESS, "RCPT9")
+        response = self.client.get(self.url, {"checkout_request_id": "LS-1", "mode": "poll"})
+        self.assertEqual(json.loads(b"".join(response.streaming_content))["mpesa_receipt_number"], "RCPT9")
+
+    def test_wsgi_event_stream_closes_for_the_browser_to_reconnect(self):
+        make_pending("LS-2")
+        response = self.client.get(self.url, {"checkout_request_id": "LS-2"})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertTrue(body.startswith("retry: "))
+        self.assertEqual(body.count("event: status"), 1)
+
+    def test_hub_keeps_each_loops_waiters(self):
+        hub = StatusHub(interval=0.05)
+        finals = {}
+        results = {}
+
+        def wait(reference):
+            results[reference] = asyncio.run(hub.wait(reference, 3))
+
+        with mock.patch("payments.live.poll_final_statuses", side_effect=lambda refs: {r: finals[r] for r in refs if r in finals}):
+            first = threading.Thread(target=wait, args=["A"])
+            first.start()
+            while not hub.loops:
+                time.sleep(0.01)
+            # A second event loop starts waiting while the first is still waiting
+            second = threading.Thread(target=wait, args=["B"])
+            second.start()
+            while len(hub.loops) < 2:
+                time.sleep(0.01)
+
+            finals.update(A={"status": SUCCESS}, B={"status": FAILED})
+            hub.wake()
+            first.join()
+            second.join()
+
+        self.assertEqual(results, {"A": {"status": SUCCESS}, "B": {"status": FAILED}})
+
+
+class StatusTransitionStressTests(TransactionTestCase):
+    """Parallel callbacks, polls and reconciliation results racing on the same transactions."""
+    transactions = 15
+    actors_per_transaction = 8
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("in-memory SQLite does not take concurrent writers")
+
+    def actor(self, barrier, tx_id, kind, errors):
+        try:
+            barrier.wait()
+            if kind == "callback_success":
+                apply_result(Q(pk=tx_id), SUCCESS, f"R{tx_id}", source="callback")
+            elif kind == "callback_failed":
+                apply_result(Q(pk=tx_id), FAILED, source="callback")
+            elif kind == "poll":
+                for _ in range(3):
+                    apply_result(Q(pk=tx_id), PROCESSING, source="status_check")
+            else:
+                apply_results([(tx_id, SUCCESS, f"R{tx_id}", None)], source="reconcile")
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_parallel_results_keep_one_final_status(self):
+        ids = [make_pending(f"S-{i}").pk for i in range(self.transactions)]
+        kinds = ["callback_success", "callback_failed", "poll", "reconcile"]
+        jobs = [(tx_id, kinds[n % len(kinds)]) for tx_id in ids for n in range(self.actors_per_transaction)]
+        barrier = threading.Barrier(len(jobs))
+        errors = []
+
+        threads = [threading.Thread(target=self.actor, args=(barrier, tx_id, kind, errors)) for tx_id, kind in jobs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+        for tx in MpesaTransaction.objects.filter(pk__in=ids):
+            log = list(tx.status_log.order_by("version").values_list("from_status", "to_status", "version"))
+            # Every status final, reached exactly once, through legal steps only
+            self.assertIn(tx.status, TERMINAL_STATUSES)
+            self.assertEqual([v for _, _, v in log], list(range(1, tx.version + 1)))
+            self.assertTrue(all(can_transition(old, new) for old, new, _ in log))
+            self.assertEqual(sum(new in TERMINAL_STATUSES for _, new, _ in log), 1)
+            self.assertEqual(log[-1][1], tx.status)
+            for (_, new, _), (old, _, _) in zip(log, log[1:]):
+                self.assertEqual(new, old)
+
+        # Rollups moved exactly once per transition
+        day_rollups = dict(
+            GivingRollup.objects.filter(period=GivingRollup.DAY).values_list("status").annotate(n=Sum("count"))
+        )
+        actual = dict(MpesaTransaction.objects.filter(pk__in=ids).values_list("status").annotate(n=Count("id")))
+        self.assertEqual({k: v for k, v in day_rollups.items() if v}, actual)
+        # Each SUCCESS posted exactly once
+        self.assertEqual(verify_ledger(), [])
+
+
+class TransactionSearchTests(TestCase):
+    def setUp(self):
+        self.no_phone = MpesaTransaction.objects.create(name="Grace Wanjiku", phone_number="")
+        self.with_phone = MpesaTransaction.objects.create(name="Grace Mutua", phone_number="0712 345 678")
+
+    def ranks(self, term):
+        return {tx.pk: tx.rank for tx in search_transactions(MpesaTransaction.objects.all(), term)}
+
+    def test_name_search_does_not_boost_rows_without_a_phone(self):
+        self.assertEqual(self.ranks("grace"), {self.no_phone.pk: 0.0, self.with_phone.pk: 0.0})
+
+    def test_exact_phone_is_boosted(self):
+        self.assertEqual(self.ranks("+254712345678"), {self.with_phone.pk: 1.5})
+
+    def test_long_name_and_email_are_kept_whole(self):
+        tx = MpesaTransaction.objects.create(name="N" * 150, email="e" * 240 + "@example.com", phone_number="0700000000")
+        tx.refresh_from_db()
+        self.assertEqual(len(tx.search_text), 150 + 1 + 252 + 1 + len("254700000000"))
+
+    def test_partial_phone_uses_search_text_only(self):
+        where = str(MpesaTransaction.objects.filter(search_filter("345 678")).query).split(" WHERE ")[1]
+        self.assertNotIn("phone_normalized", where)
+        self.assertEqual(self.ranks("345 678"), {self.with_phone.pk: 0.0})
+
+
+class TransactionListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        treasurer = get_user_model().objects.create_user(email="t@example.com", password="x", role="treasurer")
+        self.client.force_authenticate(treasurer)
+        self.url = reverse("mpesa_transaction_list")
+
+    def create(self, reference, **fields):
+        tx = make_pending(reference)
+        if fields:
+            MpesaTransaction.objects.filter(pk=tx.pk).update(**fields)
+        return tx
+
+    def test_cursor_pages_are_stable_across_ties(self):
+        tied = timezone.now()
+        txs = [self.create(f"L-{i}", created_at=tied, transaction_date=tied) for i in range(5)]
+
+        response = self.client.get(self.url, {"page_size": 2})
+        ids = [row["id"] for row in response.data["results"]]
+        # A new row lands on page one and must not push later pages back
+        self.create("L-late", created_at=tied, transaction_date=tied)
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            ids += [row["id"] for row in response.data["results"]]
+
+        self.assertEqual(ids, sorted((tx.pk for tx in txs), reverse=True))
+
+    def test_counts_are_opt_in(self):
+        for i in range(3):
+            self.create(f"C-{i}")
+        self.assertIsNone(self.client.get(self.url).data["count"])
+        self.assertEqual(self.client.get(self.url, {"count": "exact", "page_size": 1}).data["count"], 3)
+        self.assertEqual(self.client.get(self.url, {"count": "approx"}).data["count"], 3)  # COUNT(*) off Postgres
+
+    def test_page_param_keeps_page_number_responses(self):
+        self.create("P-1")
+        data = self.client.get(self.url, {"page": 1}).data
+        self.assertEqual((data["count"], len(data["results"])), (1, 1))
+
+
+class TransactionFilterTests(TestCase):
+    def setUp(self):
+        start = day_start("2025-01-31")
+        self.first = self.tx("F-1", SUCCESS, start)
+        self.last = self.tx("F-2", SUCCESS, start + timedelta(hours=23, minutes=59))
+        self.next_day = self.tx("F-3", FAILED, start + timedelta(days=1))
+        self.undated = self.tx("F-4", PENDING, None)
+
+    def tx(self, reference, status, when):
+        tx = make_pending(reference)
+        MpesaTransaction.objects.filter(pk=tx.pk).update(status=status, transaction_date=when, **purpose_fields(["Tithe"]))
+        return tx
+
+    def ids(self, **params):
+        return set(filter_transactions(MpesaTransaction.objects.all(), params).values_list("id", flat=True))
+
+    def test_status_is_case_insensitive(self):
+        self.assertEqual(self.ids(status="success"), {self.first.pk, self.last.pk})
+        self.assertEqual(self.ids(status="all"), {self.first.pk, self.last.pk, self.next_day.pk, self.undated.pk})
+
+    def test_date_range_covers_whole_days(self):
+        self.assertEqual(self.ids(start_date="2025-01-31", end_date="2025-01-31"), {self.first.pk, self.last.pk})
+        self.assertEqual(self.ids(start_date="2025-02-01"), {self.next_day.pk})
+        self.assertEqual(self.ids(end_date="2025-01-30"), set())
+
+    def test_invalid_dates_are_ignored(self):
+        self.assertEqual(len(self.ids(start_date="2025-02-30", end_date="someday")), 4)
+
+    def test_filters_combine(self):
+        self.last.name = "Grace Wanjiku"
+        self.last.save(update_fields=["name"])
+        self.assertEqual(self.ids(status="SUCCESS", purpose="tithe", search="grace", end_date="2025-01-31"), {self.last.pk})
+        self.assertEqual(self.ids(status="SUCCESS", purpose="offering"), set())
+
+
+class ExportTests(TestCase):
+    def test_csv_cells_that_look_like_formulas_are_quoted(self):
+        rows = [["=HYPERLINK(\"http://evil\")", "+254700", "-1", "@SUM(A1)", "\tx", "Grace", Decimal("-5.00"), ""]]
+        line = "".join(stream_csv(rows))
+        self.assertEqual(
+            next(csv.reader(io.StringIO(line))),
+            ["'=HYPERLINK(\"http://evil\")", "'+254700", "'-1", "'@SUM(A1)", "'\tx", "Grace", "-5.00", ""],
+        )
+
+
+class ExportEndpointTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        treasurer = get_user_model().objects.create_user(email="t@example.com", password="x", role="treasurer")
+        self.client.force_authenticate(treasurer)
+        self.url = reverse("mpesa_transaction_export")
+
+        self.settled_at = datetime(2025, 1, 31, 23, 30, tzinfo=dt_timezone.utc)
+        self.paid = make_pending("X-1")
+        MpesaPurpose.objects.create(transaction=self.paid, purpose="Other", amount=Decimal("30"), other_purpose_details="=Roof")
+        MpesaPurpose.objects.create(transaction=self.paid, purpose="Other", amount=Decimal("20"), other_purpose_details="Choir")
+        MpesaTransaction.objects.filter(pk=self.paid.pk).update(status=SUCCESS, transaction_date=self.settled_at)
+        make_pending("X-2")
+
+    def rows(self, response):
+        self.assertEqual(response.status_code, 200)
+        return list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+
+    def test_csv_applies_filters_and_keeps_every_other_detail(self):
+        rows = self.rows(self.client.get(self.url, {"status": "success"}))
+        self.assertEqual([row["Reference"] for row in rows], ["X-1"])
+        self.assertEqual(rows[0]["Other Details"], "'=Roof; Choir")
+        self.assertEqual(Decimal(rows[0]["Other"]), Decimal("50"))
+        self.assertEqual(rows[0]["Transaction Date"], str(timezone.localtime(self.settled_at)))
+
+        self.assertEqual(len(self.rows(self.client.get(self.url))), 2)
+
+    def test_treasurers_only(self):
+        elder = get_user_model().objects.create_user(email="e@example.com", password="x", role="elder")
+        self.client.force_authenticate(elder)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_unknown_type_or_missing_openpyxl_is_a_400(self):
+        self.assertEqual(self.client.get(self.url, {"type": "pdf"}).status_code, 400)
+        with mock.patch.dict(sys.modules, {"openpyxl": None}):
+            self.assertEqual(self.client.get(self.url, {"type": "xlsx"}).status_code, 400)
+
+    @unittest.skipUnless(importlib.util.find_spec("openpyxl"), "openpyxl not installed")
+    def test_xlsx_has_local_times(self):
+        from openpyxl import load_workbook
+
+        response = self.client.get(self.url, {"type": "xlsx", "status": "success"})
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(b"".join(response.streaming_content))).active
+        header, row = [[cell.value for cell in r] for r in sheet.iter_rows()]
+        values = dict(zip(header, row))
+        self.assertEqual(values["Transaction Date"], timezone.localtime(self.settled_at).replace(tzinfo=None))
+        self.assertEqual(values["Other Details"], "'=Roof; Choir")
+
+
+class GivingSummaryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        treasurer = get_user_model().objects.create_user(email="t@example.com", password="x", role="treasurer")
+        self.client.force_authenticate(treasurer)
+        self.url = reverse("giving-summary")
+
+    def test_bad_dates_are_a_400(self):
+        for params in ({"start_date": "yesterday"}, {"end_date": "2025-02-30"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+        self.assertEqual(self.client.get(self.url, {"start_date": "2025-01-01"}).status_code, 200)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        for i in range(3):
+            apply_result(Q(pk=make_pending(f"GS-{i}").pk), SUCCESS, f"R{i}")
+        kept = sorted(GivingRollup.objects.exclude(count=0).values_list("period", "bucket", "purpose", "status", "amount", "count"))
+
+        rebuild_rollups()
+        self.assertEqual(sorted(GivingRollup.objects.values_list("period", "bucket", "purpose", "status", "amount", "count")), kept)
+
+
+class GivingStatementTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.year = timezone.localdate().year
+
+    def gift(self, phone, name, purpose, amount):
+        tx = MpesaTransaction.objects.create(name=name, phone_number=phone, status=SUCCESS, total_amount=amount)
+        MpesaPurpose.objects.create(transaction=tx, purpose=purpose, amount=Decimal(amount))
+        return tx
+
+    def generate(self, **kwargs):
+        return generate_statements(self.year, batch_size=2, workers=2, **kwargs)
+
+    def test_rendered_in_worker_processes(self):
+        self.gift("0711000001", "Grace Wanjiku", "Tithe", "1000")
+        self.gift("0711000001", "Grace Wanjiku", "Offering", "250")
+        self.gift("0711000002", "Peter Otieno", "Tithe", "500")
+        self.gift("0711000003", "Mary Achieng", "Tithe", "300")
+        MpesaTransaction.objects.create(name="Failed", phone_number="0711000004", status=FAILED, total_amount=1)
+
+        self.assertEqual(self.generate(), {"donors": 3, "rendered": 3, "skipped": 0})
+        statement = GivingStatement.objects.get(year=self.year, phone_normalized="254711000001")
+        self.assertEqual((statement.donor_name, statement.total_amount), ("Grace Wanjiku", Decimal("1250")))
+        with statement.file.open() as f:
+            html = f.read().decode()
+        self.assertIn("Grace Wanjiku", html)
+        self.assertIn("Offering", html)
+
+    def test_unchanged_donors_are_skipped(self):
+        self.gift("0711000001", "Grace Wanjiku", "Tithe", "1000")
+        self.gift("0711000002", "Peter Otieno", "Tithe", "500")
+        self.generate()
+
+        self.gift("0711000002", "Peter Otieno", "Offering", "50")
+        self.assertEqual(self.generate(), {"donors": 2, "rendered": 1, "skipped": 1})
+        self.assertEqual(
+            GivingStatement.objects.get(phone_normalized="254711000002").total_amount, Decimal("550")
+        )
+        self.assertEqual(self.generate(force=True), {"donors": 2, "rendered": 2, "skipped": 0})
+        self.assertEqual(GivingStatement.objects.count(), 2)
+
+
+class BankImportTests(TestCase):
+    HEADER = "Receipt,Reference,Amount,Phone,Date\n"
+
+    def settled(self, reference, receipt):
+        tx = make_pending(reference)
+        apply_result(Q(pk=tx.pk), SUCCESS, receipt)
+        return tx
+
+    def load(self, *lines):
+        return import_statement(io.StringIO(self.HEADER + "".join(f"{line}\n" for line in lines)), "statement.csv")
+
+    def test_matches_by_receipt_reference_and_fallback(self):
+        self.settled("BI-1", "RCPTA")
+        self.settled("BI-2", "RCPTB")
+        fallback = make_pending("BI-3")
+        when = timezone.localtime(fallback.created_at).strftime("%Y-%m-%d %H:%M:%S")
+
+        summary = self.load("RCPTA,,100,,", ",BI-2,100,,", f",,100,0712345678,{when}")
+        self.assertEqual(summary["matched"], {"receipt": 1, "reference": 1, "amount_phone_time": 1})
+        self.assertEqual(summary["settled"], 1)
+        self.assertEqual(MpesaTransaction.objects.get(pk=fallback.pk).status, SUCCESS)
+
+    def test_later_import_does_not_match_a_claimed_transaction(self):
+        tx = self.settled("BI-4", "RCPTC")
+        self.assertEqual(self.load("RCPTC,,100,,")["matched_total"], 1)
+
+        # The next statement overlaps and repeats the line
+        summary = self.load("RCPTC,,100,,", ",BI-4,100,,")
+        self.assertEqual(summary["matched_total"], 0)
+        self.assertEqual(summary["discrepancies"], {"duplicate": 2})
+        self.assertEqual(tx.bank_lines.count(), 1)
+
+    def test_fallback_lines_competing_for_one_transaction_are_ambiguous(self):
+        tx = make_pending("BI-5")
+        when = timezone.localtime(tx.created_at).strftime("%Y-%m-%d %H:%M:%S")
+        summary = self.load(f",,100,0712345678,{when}", f",,100,0712345678,{when}")
+        self.assertEqual(summary["matched"]["amount_phone_time"], 1)
+        self.assertEqual(summary["discrepancies"], {"ambiguous": 1})
+
+    def test_database_refuses_a_second_line_for_a_transaction(self):
+        tx = self.settled("BI-6", "RCPTD")
+        statement = BankStatementImport.objects.create(file_name="a.csv")
+        BankStatementLine.objects.create(statement=statement, line_number=2, matched_transaction=tx)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BankStatementLine.objects.create(statement=statement, line_number=3, matched_transaction=tx)
+
+
+class PurposeTagTests(TestCase):
+    def test_written_with_the_transaction(self):
+        serializer = MpesaTransactionSerializer(data=PAYLOAD)
+        serializer.is_valid()
+        tx = serializer.save(checkout_request_id="MULTI-tag0001")
+        self.assertEqual(tx.purpose_tag, "#MULTI")
+        self.assertEqual(tx.purpose_mask, purpose_mask(["Tithe", "Offering", "Other"]))
+
+    def test_purpose_filter_needs_no_join(self):
+        for i, codes in enumerate([["Tithe"], ["Tithe", "Offering"], ["Local Church"]]):
+            MpesaTransaction.objects.create(name="D", phone_number="07", checkout_request_id=f"P-{i}", **purpose_fields(codes))
+
+        queryset = filter_transactions(MpesaTransaction.objects.all(), {"purpose": "tithe"})
+        self.assertNotIn("payments_mpesapurpose", str(queryset.query))
+        self.assertNotIn(" IN (", str(queryset.query))
+        self.assertEqual(sorted(queryset.values_list("checkout_request_id", flat=True)), ["P-0", "P-1"])
+        self.assertEqual(filter_transactions(MpesaTransaction.objects.all(), {"purpose": "Unknown"}).count(), 0)
+
+    def test_status_check_computes_a_missing_tag(self):
+        tx = make_pending("P-old")  # created before purpose tags were written
+        self.assertEqual(tx.purpose_tag, "")
+        response = APIClient().get(reverse("status-check"), {"checkout_request_id": "P-old"})
+        self.assertEqual(response.data["tag"], "#TITHE")
+
+
+class LedgerTests(TestCase):
+    def make_success(self, reference, lines):
+        tx = MpesaTransaction.objects.create(
+            name="Ledger Donor", phone_number="0712345678", checkout_request_id=reference,
+            total_amount=sum(Decimal(amount) for _, _, amount in lines),
+        )
+        MpesaPurpose.objects.bulk_create([
+            MpesaPurpose(transaction=tx, purpose=purpose, other_purpose_details=details, amount=amount)
+            for purpose, details, amount in lines
+        ])
+        apply_result(Q(pk=tx.pk), SUCCESS, f"R{reference}")
+        return tx
+
+    def test_success_posts_balanced_journal(self):
+        tx = self.make_success("L-1", [("Tithe", None, "1000"), ("DEVGR", "Youth", "250")])
+
+        balances = dict(LedgerAccount.objects.values_list("code", "balance"))
+        self.assertEqual(balances, {"MPESA": Decimal("1250"), "Tithe": Decimal("1000"), "DEVGR:Youth": Decimal("250")})
+        entries = tx.ledger_entries.aggregate(d=Sum("debit"), c=Sum("credit"))
+        self.assertEqual(entries["d"], entries["c"])
+        self.assertEqual(verify_ledger(), [])
+
+    def test_posting_is_once_per_transaction(self):
+        tx = self.make_success("L-2", [("Offering", None, "300")])
+        self.assertEqual(post_transactions([tx.pk]), 0)
+        apply_result(Q(pk=tx.pk), SUCCESS)
+        self.assertEqual(LedgerAccount.objects.get(code="Offering").balance, Decimal("300"))
+
+    def test_balance_as_of_and_entries_are_immutable(self):
+        tx = self.make_success("L-3", [("Tithe", None, "100")])
+        entry = tx.ledger_entries.get(account__code="Tithe")
+        tithe = entry.account
+
+        self.assertEqual(balance_as_of(tithe, entry.posted_at - timedelta(seconds=1)), Decimal("0"))
+        self.assertEqual(balance_as_of(tithe, entry.posted_at), Decimal("100"))
+        with self.assertRaises(ValueError):
+            entry.save()
+
+    def test_backlog_is_posted_when_it_settled(self):
+        settled = timezone.now() - timedelta(days=10)
+        with mock.patch("payments.transitions.post_transactions"):
+            old = self.make_success("L-5", [("Tithe", None, "100")])  # settled before the ledger
+        MpesaTransaction.objects.filter(pk=old.pk).update(transaction_date=settled)
+        live = self.make_success("L-6", [("Tithe", None, "50")])
+
+        call_command("post_ledger_backlog", stdout=io.StringIO())
+
+        entry = old.ledger_entries.get(account__code="Tithe")
+        self.assertEqual(entry.posted_at, settled)
+        tithe = entry.account
+        self.assertEqual(balance_as_of(tithe, settled), Decimal("100"))
+        self.assertEqual(balance_as_of(tithe, timezone.now()), Decimal("150"))
+        self.assertEqual(live.ledger_entries.get(account=tithe).balance_after, Decimal("150"))
+        self.assertEqual(verify_ledger(), [])
+
+    def test_clearing_is_updated_in_place_at_the_end(self):
+        self.make_success("L-7", [("Tithe", None, "100")])
+        with mock.patch("payments.transitions.post_transactions"):
+            batch = [self.make_success(f"L-8{i}", [("Offering", None, "40")]) for i in range(2)]
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(post_transactions([tx.pk for tx in batch]), 2)
+        clearing_updates = [sql for sql in statements(ctx.captured_queries, "UPDATE", "payments_ledgeraccount") if "MPESA" in sql]
+        self.assertEqual(len(clearing_updates), 1)
+        self.assertIn('"balance" +', clearing_updates[0])
+
+        clearing = LedgerAccount.objects.get(code="MPESA")
+        self.assertEqual((clearing.balance, clearing.entry_count), (Decimal("180"), 3))
+        self.assertEqual(
+            list(clearing.entries.order_by("id").values_list("balance_after", flat=True)),
+            [Decimal("100"), Decimal("140"), Decimal("180")],
+        )
+        self.assertEqual(verify_ledger(), [])
+
+    def test_verifier_flags_drift(self):
+        self.make_success("L-4", [("Tithe", None, "100")])
+        LedgerAccount.objects.filter(code="Tithe").update(balance=Decimal("90"))
+        self.assertTrue(any("Tithe: stored balance 90" in p for p in verify_ledger()))
@@ -0,0 +1,204 @@
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Fallback lifetime when the token response has no `expires_in`
+DEFAULT_TOKEN_LIFETIME = 3600
+
+
+# ------------------------------------------------------
+# Token Stores
+# ------------------------------------------------------
+class InProcessTokenStore:
+    """
+    Keeps the token in this process only.
+    Each gunicorn worker refreshes on its own.
+    """
+
+    def __init__(self):
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def read(self):
+        if not self._token:
+            return None
+        return self._token, self._expires_at
+
+    def write(self, token, expires_at):
+        self._token = token
+        self._expires_at = expires_at
+
+    def clear(self):
+        self._token = None
+        self._expires_at = 0
+
+    @contextmanager
+    def refresh_lock(self, is_fresh=None):
+        with self._lock:
+            yield
+
+
+class CacheTokenStore:
+    """
+    Keeps the token in the Django cache (CACHES, shared by every worker)
+    so that all workers share one token.
+    """
+    key = "coopbank:token"
+    lock_key = "coopbank:token:lock"
+    lock_timeout = 30
+
+    def read(self):
+        value = cache.get(self.key)
+        if not value:
+            return None
+        return value["token"], value["expires_at"]
+
+    def write(self, token, expires_at):
+        ttl = max(int(expires_at - time.time()), 1)
+        cache.set(self.key, {"token": token, "expires_at": expires_at}, ttl)
+
+    def clear(self):
+        cache.delete(self.key)
+
+    @contextmanager
+    def refresh_lock(self, is_fresh=None):
+        # cache.add is atomic, so only one worker gets the lock.
+        # The others wait for it, or for a fresh token to show up: the
+        # old near-expiry token is still stored while the refresh runs.
+        deadline = time.time() + self.lock_timeout
+        acquired = cache.add(self.lock_key, 1, self.lock_timeout)
+        while not acquired and time.time() < deadline:
+            if is_fresh and is_fresh():
+                break
+            time.sleep(0.1)
+            acquired = cache.add(self.lock_key, 1, self.lock_timeout)
+        try:
+            yield
+        finally:
+            if acquired:
+                cache.delete(self.lock_key)
+
+
+class DatabaseTokenStore:
+    """
+    Keeps the token in a CoopAccessToken row.
+    The refresh lock is a SELECT ... FOR UPDATE on that row.
+    """
+    name = "default"
+
+    def _model(self):
+        from .models import CoopAccessToken
+        return CoopAccessToken
+
+    def read(self):
+        row = self._model().objects.filter(name=self.name).first()
+        if not row or not row.access_token or not row.expires_at:
+            return None
+        return row.access_token, row.expires_at.timestamp()
+
+    def write(self, token, expires_at):
+        self._model().objects.update_or_create(
+            name=self.name,
+            defaults={
+                "access_token": token,
+                "expires_at": datetime.datetime.fromtimestamp(expires_at, tz=datetime.timezone.utc),
+            },
+        )
+
+    def clear(self):
+        self._model().objects.filter(name=self.name).update(access_token="", expires_at=None)
+
+    @contextmanager
+    def refresh_lock(self, is_fresh=None):
+        model = self._model()
+        model.objects.get_or_create(name=self.name)
+        with transaction.atomic():
+            model.objects.select_for_update().get(name=self.name)
+            yield
+
+
+TOKEN_STORES = {
+    "memory": InProcessTokenStore,
+    "cache": CacheTokenStore,
+    "db": DatabaseTokenStore,
+}
+
+
+# ------------------------------------------------------
+# Token Cache
+# ------------------------------------------------------
+class TokenCache:
+    """
+    Returns a cached OAuth token and refreshes it `refresh_margin`
+    seconds before it expires. Only one refresh runs at a time:
+    threads queue on a local lock, workers on the store's lock.
+
+    `fetch` must return (access_token, expires_in_seconds).
+    """
+
+    def __init__(self, store, fetch, refresh_margin=60):
+        self.store = store
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self._local_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _fresh(self):
+        value = self.store.read()
+        if value and value[1] - self.refresh_margin > time.time():
+            return value[0]
+        return None
+
+    def get_token(self):
+        token = self._fresh()
+        if token:
+            self._count("hits")
+            return token
+
+        self._count("misses")
+        with self._local_lock:
+            token = self._fresh()
+            if token:
+                return token
+
+            with self.store.refresh_lock(is_fresh=lambda: self._fresh() is not None):
+                # Another worker may have refreshed while we waited
+                token = self._fresh()
+                if token:
+                    return token
+
+                try:
+                    token, expires_in = self.fetch()
+                except Exception:
+                    self._count("errors")
+                    raise
+
+                self._count("refreshes")
+                self.store.write(token, time.time() + (expires_in or DEFAULT_TOKEN_LIFETIME))
+                return token
+
+    def invalidate(self):
+        """Drop the stored token, e.g. after the bank rejects it with a 401."""
+        self.store.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+def build_token_cache(fetch):
+    store_name = getattr(settings, "COOPBANK_TOKEN_STORE", "cache")
+    store = TOKEN_STORES.get(store_name, CacheTokenStore)()
+    margin = getattr(settings, "COOPBANK_TOKEN_REFRESH_MARGIN", 60)
+    return TokenCache(store, fetch, refresh_margin=margin)
@@ -0,0 +1,189 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from .models import MpesaTransaction, MpesaTransactionStatusLog
+from .ledger import post_transactions
+from .rollups import record_status_changes
+from .live import status_hub
+
+
+PENDING = "PENDING"
+PROCESSING = "PROCESSING"
+SUCCESS = "SUCCESS"
+FAILED = "FAILED"
+
+# Allowed moves; SUCCESS/FAILED are final
+TRANSITIONS = {
+    PENDING: {PROCESSING, SUCCESS, FAILED},
+    PROCESSING: {SUCCESS, FAILED},
+    SUCCESS: set(),
+    FAILED: set(),
+}
+
+# A transaction in one of these can still move
+OPEN_STATUSES = [PENDING, PROCESSING]
+TERMINAL_STATUSES = [SUCCESS, FAILED]
+
+# Conditional UPDATEs lost to a concurrent writer before giving up
+MAX_ATTEMPTS = 3
+
+
+def can_transition(old, new):
+    return new in TRANSITIONS.get(old, ())
+
+
+def sources_for(status):
+    """Statuses a transaction may move to `status` from."""
+    return [old for old, targets in TRANSITIONS.items() if status in targets]
+
+
+# ------------------------------------------------------
+# Reading Co-op Bank results
+# ------------------------------------------------------
+def status_from_enquiry_code(code):
+    """Map a status enquiry MessageCode to our status."""
+    code = str(code)
+    if code == "0":
+        return SUCCESS
+    if code == "S_001":
+        return PROCESSING
+    return FAILED
+
+
+def status_from_callback_code(code):
+    """Callbacks only arrive once the donor has acted, so they are always final."""
+    return SUCCESS if str(code) == "0" else FAILED
+
+
+def parse_result_metadata(data):
+    """
+    Pull the M-Pesa receipt and transaction date out of a callback or
+    status enquiry body. Returns (receipt, transaction_date).
+    """
+    items = (data.get("TransactionMetadata") or {}).get("Items", []) or []
+    meta = {i["Name"]: i["Value"] for i in items if "Name" in i}
+
+    narration = meta.get("Narration")
+    receipt = narration.split("~")[1] if narration and "~" in narration else None
+
+    raw_date = data.get("MessageDateTime")
+    transaction_date = parse_datetime(raw_date) if isinstance(raw_date, str) else None
+
+    return receipt, transaction_date
+
+
+def reference_lookup(message_reference):
+    """Our own reference or the bank's - both columns are indexed."""
+    return Q(coop_message_reference=message_reference) | Q(checkout_request_id=message_reference)
+
+
+# ------------------------------------------------------
+# Applying results
+# ------------------------------------------------------
+def result_fields(status, receipt=None, transaction_date=None):
+    """Columns written alongside the status (only the ones that change)."""
+    fields = {}
+    if status == SUCCESS:
+        if receipt:
+            fields["mpesa_receipt_number"] = receipt
+        if transaction_date:
+            fields["transaction_date"] = transaction_date
+    return fields
+
+
+def transition(tx_id, status, fields=None, current=None):
+    """
+    Move one transaction to `status` with a conditional
+    UPDATE ... WHERE status IN (allowed sources) AND version = <read version>,
+    writing only the status, version and `fields`.
+    If another writer got there first, re-read and try again while the
+    move is still allowed. `current` is an already-read (status, version).
+    Returns (old_status, new_version), or None if nothing was moved.
+    """
+    allowed = sources_for(status)
+    for _ in range(MAX_ATTEMPTS):
+        if current is None:
+            current = MpesaTransaction.objects.filter(pk=tx_id).values_list("status", "version").first()
+        if current is None or not can_transition(current[0], status):
+            return None
+
+        old, version = current
+        updated = MpesaTransaction.objects.filter(pk=tx_id, status__in=allowed, version=version).update(
+            status=status, version=version + 1, **(fields or {})
+        )
+        if updated:
+            return old, version + 1
+        current = None
+    return None
+
+
+def record_moves(moves, source=""):
+    """
+    Follow-up for applied transitions, in the caller's transaction:
+    history rows, rollup totals, ledger postings for new SUCCESSes and
+    the live-status wake-up.
+    `moves` is a list of (transaction_id, old_status, new_status, new_version).
+    """
+    if not moves:
+        return
+    MpesaTransactionStatusLog.objects.bulk_create([
+        MpesaTransactionStatusLog(
+            transaction_id=tx_id, from_status=old, to_status=new, version=version, source=source
+        )
+        for tx_id, old, new, version in moves
+    ])
+    record_status_changes([(tx_id, old, new) for tx_id, old, new, _ in moves])
+    post_transactions([tx_id for tx_id, _, new, _ in moves if new == SUCCESS])
+    transaction.on_commit(status_hub.wake)
+
+
+def apply_result(lookup, status, receipt=None, transaction_date=None, source=""):
+    """
+    Move transactions matching `lookup` to `status` where the transition
+    table allows it, so a late or repeated result can never overwrite a
+    final SUCCESS/FAILED (or PROCESSING overwrite SUCCESS).
+    Returns the number of rows changed.
+    """
+    fields = result_fields(status, receipt, transaction_date)
+
+    with transaction.atomic():
+        rows = (
+            MpesaTransaction.objects
+            .filter(lookup, status__in=sources_for(status))
+            .values_list("id", "status", "version")
+        )
+        moves = []
+        for tx_id, old, version in rows:
+            moved = transition(tx_id, status, fields, current=(old, version))
+            if moved:
+                moves.append((tx_id, moved[0], status, moved[1]))
+        record_moves(moves, source)
+
+    return len(moves)
+
+
+def apply_results(results, source=""):
+    """
+    Bulk version of apply_result for reconciliation.
+    `results` is a list of (transaction_id, status, receipt, transaction_date).
+    Current statuses/versions are read with one query; each row is then
+    moved with its own conditional UPDATE, all in one DB transaction.
+    Returns the number of transactions changed.
+    """
+    by_id = {r[0]: r for r in results}
+    moves = []
+
+    with transaction.atomic():
+        current = (
+            MpesaTransaction.objects
+            .filter(pk__in=list(by_id), status__in=OPEN_STATUSES)
+            .values_list("id", "status", "version")
+        )
+        for tx_id, old, version in current:
+            _, status, receipt, transaction_date = by_id[tx_id]
+            moved = transition(tx_id, status, result_fields(status, receipt, transaction_date), current=(old, version))
+            if moved:
+                moves.append((tx_id, moved[0], status, moved[1]))
+        record_moves(moves, source)
+
+    return len(moves)
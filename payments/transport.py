@@ -0,0 +1,149 @@
+import time
+import random
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from .breaker import Bulkhead, CircuitBreaker
+
+
+# Responses worth retrying on an idempotent call
+RETRY_STATUSES = {429, 502, 503, 504}
+
+DEFAULT_TIMEOUT = (3.05, 15)
+
+
+# ------------------------------------------------------
+# Pooled Co-op Bank HTTP client
+# ------------------------------------------------------
+class CoopBankClient:
+    """
+    One keep-alive session for every Co-op Bank call.
+
+    - Connections are pooled and reused (no new TCP+TLS per call).
+    - Every endpoint has its own (connect, read) timeout.
+    - Idempotent calls (token, status enquiries) are retried a bounded
+      number of times with jittered exponential backoff.
+      STK pushes are never retried here: a retry could prompt twice.
+    - An optional circuit breaker fails calls fast while the bank is down,
+      and an optional bulkhead caps the threads waiting on the bank.
+    """
+
+    def __init__(self, timeouts=None, pool_size=10, retries=2, backoff=0.5, max_backoff=4,
+                 breaker=None, bulkhead=None):
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def timeout_for(self, endpoint):
+        return tuple(self.timeouts.get(endpoint, DEFAULT_TIMEOUT))
+
+    def sleep_before_retry(self, attempt):
+        # "Full jitter": spread retries out so workers don't retry in lockstep
+        ceiling = min(self.max_backoff, self.backoff * (2 ** attempt))
+        time.sleep(random.uniform(0, ceiling))
+
+    def post(self, endpoint, url, idempotent=False, **kwargs):
+        """
+        POST to `url` using the timeout configured for `endpoint`.
+        Returns the final `requests.Response`.
+        Raises breaker.BankUnavailable without calling the bank when the
+        circuit is open or the bulkhead is full.
+        """
+        if self.bulkhead is None:
+            return self.guarded_post(endpoint, url, idempotent, **kwargs)
+        with self.bulkhead:
+            return self.guarded_post(endpoint, url, idempotent, **kwargs)
+
+    def guarded_post(self, endpoint, url, idempotent, **kwargs):
+        if self.breaker is None:
+            return self.send(endpoint, url, idempotent, **kwargs)
+
+        probe = self.breaker.before_call()
+        try:
+            response = self.send(endpoint, url, idempotent, **kwargs)
+        except requests.RequestException:
+            self.breaker.record_failure(probe)
+            raise
+
+        # 4xx is our request's fault, not the bank's health
+        if response.status_code >= 500:
+            self.breaker.record_failure(probe)
+        else:
+            self.breaker.record_success(probe)
+        return response
+
+    def send(self, endpoint, url, idempotent, **kwargs):
+        kwargs.setdefault("timeout", self.timeout_for(endpoint))
+        attempts = 1 + (self.retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                response = self.session.post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                self.sleep_before_retry(attempt)
+                continue
+
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                response.close()
+                self.sleep_before_retry(attempt)
+                continue
+
+            return response
+
+
+class AsyncCoopBankClient:
+    """
+    Awaitable wrapper around the pooled client for ASGI views.
+    Calls run in a worker thread so the event loop is never blocked,
+    and they share the same connection pool as the sync client.
+    """
+
+    def __init__(self, sync_client):
+        self.sync_client = sync_client
+
+    async def post(self, endpoint, url, idempotent=False, **kwargs):
+        return await sync_to_async(self.sync_client.post, thread_sensitive=False)(
+            endpoint, url, idempotent=idempotent, **kwargs
+        )
+
+
+def build_client():
+    return CoopBankClient(
+        timeouts=getattr(settings, "COOPBANK_TIMEOUTS", {}),
+        pool_size=getattr(settings, "COOPBANK_POOL_SIZE", 10),
+        retries=getattr(settings, "COOPBANK_MAX_RETRIES", 2),
+        breaker=CircuitBreaker(
+            "coopbank",
+            failure_threshold=getattr(settings, "COOPBANK_BREAKER_FAILURES", 5),
+            reset_timeout=getattr(settings, "COOPBANK_BREAKER_RESET", 30),
+        ),
+        bulkhead=Bulkhead(
+            size=getattr(settings, "COOPBANK_BULKHEAD_SIZE", 4),
+            wait=getattr(settings, "COOPBANK_BULKHEAD_WAIT", 0.5),
+        ),
+    )
+
+
+def reserve_bank_slots(count):
+    """
+    Grow this process's bulkhead to at least `count` slots. Used by worker
+    commands whose own thread pool already bounds their bank calls.
+    """
+    if client.bulkhead is not None and client.bulkhead.size < count:
+        client.bulkhead = Bulkhead(size=count, wait=client.bulkhead.wait)
+
+
+client = build_client()
+async_client = AsyncCoopBankClient(client)
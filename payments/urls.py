@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import InitiatePaymentAPIView, MpesaCallbackView, MpesaTransactionsAPIView, TransactionStatusAPIView, CoopTransactionStatusAPIView
+from .views import InitiatePaymentAPIView, MpesaCallbackView, MpesaTransactionsAPIView, TransactionStatusAPIView, CoopTransactionStatusAPIView, CoopMetricsAPIView, TransactionSearchAPIView, GivingSummaryAPIView, FundBalancesAPIView, TransactionExportAPIView, transaction_status_stream
 
 urlpatterns = [
     # API endpoint to start the payment process
@@ -10,8 +10,23 @@ urlpatterns = [
 
     # Endpint to view all transactions that have been made
     path('transactions/', MpesaTransactionsAPIView.as_view(), name='mpesa_transaction_list'),
+    path('transactions/search/', TransactionSearchAPIView.as_view(), name='mpesa_transaction_search'),
+    path('transactions/export/', TransactionExportAPIView.as_view(), name='mpesa_transaction_export'),
+
+    # Treasurer dashboard totals (per purpose, per day/week/month)
+    path('giving/summary/', GivingSummaryAPIView.as_view(), name='giving-summary'),
+
+    # Ledger balances per fund (optionally as of a date)
+    path('funds/', FundBalancesAPIView.as_view(), name='fund-balances'),
+
     path('status-check/', TransactionStatusAPIView.as_view(), name='status-check'),
 
+    # Live status push (SSE / long-poll) - replaces client polling under ASGI
+    path('status-stream/', transaction_status_stream, name='status-stream'),
+
     # Check / poll transaction status from Co-op Bank
     path('check-status/', CoopTransactionStatusAPIView.as_view(), name='coop-transaction-status'),
+
+    # Token / status cache counters for monitoring
+    path('metrics/', CoopMetricsAPIView.as_view(), name='coop-metrics'),
 ]
\ No newline at end of file
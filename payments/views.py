@@ -1,22 +1,43 @@
 # mpesa/views.py
-from datetime import datetime
+from datetime import datetime, timedelta
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
-from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.db import transaction as db_transaction
 from django.db.models import Q
-from .coopbank import stk_push_request, generate_token
-import requests
 from django.conf import settings
-from .models import MpesaTransaction, MpesaPurpose
+from .coopbank import stk_push_request, token_cache
+from .breaker import BankUnavailable
+from .transport import client as bank_client
+from .dispatch import enqueue_stk_push
+from .idempotency import HEADER as IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, claim, complete, key_for_request, release, request_hash
+from .callbacks import record_callback, process_callback
+from .status_cache import status_cache
+from .transitions import apply_result, parse_result_metadata, status_from_enquiry_code
+import requests
+from .models import MpesaTransaction, GivingRollup
 from .serializers import MpesaTransactionSerializer
 from .permissions import IsTreasurer
+from .filters import day_start, filter_transactions, parse_day
+from .ledger import balances, balances_as_of
+from .search import normalize_phone, search_transactions
+from .export import export_rows, stream_csv, write_xlsx
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from .live import TERMINAL, current_status, status_hub, wait_for_final_status
+import json
+from .pagination import TransactionCursorPagination
+from .purposes import purpose_tag
+from rest_framework.pagination import PageNumberPagination
 
 import uuid
+import logging
+
 
+logger = logging.getLogger(__name__)
 
 BASE62 = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
@@ -42,6 +63,40 @@ def short_uuid7():
     return int_to_base62(num, length=7)
 
 
+def build_stk_details(purposes):
+    """
+    Co-op OtherDetails, total and narration tag for a list of purposes.
+    Returns (other_details, total_amount, tag).
+    """
+    other_details = []
+    total_amount = 0
+
+    for p in purposes:
+        purpose_name = p["purpose"]
+        amount = int(p["amount"])
+        total_amount += amount
+
+        # Custom field support
+        if purpose_name == "Other" and p.get("other_purpose_details"):
+            key = p["other_purpose_details"]
+        else:
+            key = purpose_name
+
+        other_details.append({"Name": key, "Value": str(amount)})
+
+    # Tag for narration
+    if len(purposes) == 1:
+        p0 = purposes[0]
+        if p0["purpose"] == "DEVGR" and p0.get("other_purpose_details"):
+            tag = f"DEVGR{p0['other_purpose_details']}"
+        else:
+            tag = p0["purpose"].replace(" ", "")
+    else:
+        tag = "MULTI"
+
+    return other_details, total_amount, tag
+
+
 
 
 
@@ -57,49 +112,72 @@ class InitiatePaymentAPIView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=400)
 
-        validated = serializer.validated_data
-        phone = validated["phone_number"]
-        purposes = validated["purposes"]
-
-        # Normalize phone
-        if phone.startswith("0"):
-            phone = "254" + phone[1:]
-        elif phone.startswith("+"):
-            phone = phone[1:]
-
-        # ----- Build Co-op OtherDetails -----
-        other_details = []
-        total_amount = 0
-
-        for p in purposes:
-            purpose_name = p["purpose"]
-            amount = int(p["amount"])
-            total_amount += amount
-
-            # Custom field support
-            if purpose_name == "Other" and p.get("other_purpose_details"):
-                key = p["other_purpose_details"]
-            else:
-                key = purpose_name
+        fingerprint = request_hash(serializer.validated_data)
+        key = key_for_request(request, fingerprint)
+        if key is None:
+            return Response({"error": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"}, status=400)
 
-            other_details.append({"Name": key, "Value": str(amount)})
+        # A retried / double-tapped request replays the first response
+        record, created = claim(key, fingerprint)
+        if not created:
+            return self.replay(record, fingerprint)
 
-        # Tag for narration
-        if len(purposes) == 1:
-            p0 = purposes[0]
-            if p0["purpose"] == "DEVGR" and p0.get("other_purpose_details"):
-                tag=f"DEVGR{p0['other_purpose_details']}"
-            else:
-                tag = p0["purpose"].replace(" ", "")
+        try:
+            response, transaction = self.initiate(serializer)
+        except Exception:
+            release(record)
+            raise
+
+        if response.status_code >= 500:
+            # The push did not go out; let the donor try again
+            release(record)
         else:
-            tag = "MULTI"
+            complete(record, response, transaction)
+        return response
+
+    def replay(self, record, fingerprint):
+        if record.request_hash != fingerprint:
+            return Response({"error": f"{IDEMPOTENCY_HEADER} was already used for a different payment"}, status=422)
+        if record.response_status is None:
+            return Response({"error": "This payment is still being processed"}, status=409, headers={"Retry-After": "2"})
+
+        response = Response(record.response_body, status=record.response_status)
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    def initiate(self, serializer):
+        """Save the transaction and send (or queue) the STK push. Returns (response, transaction)."""
+        validated = serializer.validated_data
+        phone = normalize_phone(validated["phone_number"])
+        other_details, total_amount, tag = build_stk_details(validated["purposes"])
 
         reference = f"{tag}-{short_uuid7()}"
 
-        # ----- Save to DB -----
+        # ----- Queue for the dispatcher (async mode) -----
+        if settings.COOPBANK_ASYNC_DISPATCH:
+            with db_transaction.atomic():
+                transaction = serializer.save(
+                    checkout_request_id=reference,
+                    status="PENDING"
+                )
+                enqueue_stk_push(
+                    transaction,
+                    phone=phone,
+                    amount=int(total_amount),
+                    reference=reference,
+                    other_details=other_details,
+                    description=tag
+                )
+
+            return Response({
+                "message": "STK Push queued. Wait for the PIN prompt.",
+                "checkout_request_id": reference,
+                "amount": total_amount,
+            }, status=202), transaction
+
+        # ----- Save to DB (one transaction: parent + purposes) -----
         transaction = serializer.save(
             checkout_request_id=reference,
-            total_amount=total_amount,
             status="PENDING"
         )
 
@@ -113,20 +191,25 @@ class InitiatePaymentAPIView(APIView):
                 description=tag
             )
 
-            transaction.coop_message_reference = response.get("MessageReference")
-            transaction.save()
+            MpesaTransaction.objects.filter(pk=transaction.pk).update(
+                coop_message_reference=response.get("MessageReference")
+            )
+
+        except BankUnavailable as e:
+            # Refused locally (circuit open / too many calls in flight)
+            apply_result(Q(pk=transaction.pk), "FAILED", source="initiate")
+            return Response({"error": str(e)}, status=503, headers={"Retry-After": "30"}), transaction
 
         except Exception as e:
-            transaction.status = "FAILED"
-            transaction.save()
-            return Response({"error": str(e)}, status=500)
+            apply_result(Q(pk=transaction.pk), "FAILED", source="initiate")
+            return Response({"error": str(e)}, status=500), transaction
 
         return Response({
             "message": "STK Push sent. Enter PIN.",
             "checkout_request_id": reference,
             "amount": total_amount,
             "co_op_response": response,
-        }, status=201)
+        }, status=201), transaction
 
 
 
@@ -142,25 +225,22 @@ class MpesaCallbackView(APIView):
         data = request.data
 
         message_ref = data.get("MessageReference")
-        message_code = str(data.get("MessageCode"))
 
         if not message_ref:
             return Response({"error": "Missing MessageReference"}, status=400)
 
-        try:
-            transaction = MpesaTransaction.objects.get(
-                coop_message_reference=message_ref
-            )
-        except MpesaTransaction.DoesNotExist:
-            return Response({"error": "Transaction not found"}, status=404)
+        # Store the raw callback and acknowledge straight away.
+        # `process_mpesa_callbacks` applies it to the transaction.
+        callback = record_callback(data)
 
-        if transaction.status in ["SUCCESS", "FAILED"]:
-            return Response({"status": "Already processed"}, status=200)
+        if settings.COOPBANK_CALLBACK_INLINE:
+            try:
+                process_callback(callback)
+            except Exception:
+                # Already stored: process_mpesa_callbacks will apply it
+                logger.exception("Inline processing of callback %s failed", callback.pk)
 
-        transaction.status = "SUCCESS" if message_code == "0" else "FAILED"
-        transaction.save()
-
-        return Response({"status": "Callback processed"}, status=200)
+        return Response({"status": "Callback received"}, status=200)
 
 
     
@@ -177,57 +257,36 @@ class CoopTransactionStatusAPIView(APIView):
         if not message_ref:
             return Response({"error": "MessageReference required"}, status=400)
 
-        token = generate_token()
-        if not token:
-            return Response({"error": "Token error"}, status=500)
-
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-
-        resp = requests.post(
-            settings.COOPBANK_STATUS_URL,
-            json={"MessageReference": message_ref},
-            headers=headers
-        )
+        # Already final locally - no need to ask the bank again
+        local_status = status_cache.local_final_status(message_ref)
+        if local_status:
+            return Response({
+                "checkout_request_id": message_ref,
+                "coop_message_code": None,
+                "coop_message_description": None,
+                "coop_message_details": None,
+                "status": local_status,
+                "raw": None
+            })
+
+        # Cached / coalesced enquiry
+        try:
+            data = status_cache.enquire(message_ref)
+        except BankUnavailable as e:
+            return Response({"error": str(e)}, status=503, headers={"Retry-After": "30"})
+        except requests.RequestException as e:
+            return Response({"error": str(e)}, status=502)
 
-        data = resp.json()
         code = str(data.get("MessageCode"))
         desc = data.get("MessageDescription")
         details = data.get("MessageDetails")
 
         # Interpret state
-        if code == "0":
-            status_result = "SUCCESS"
-        elif code == "S_001":
-            status_result = "PROCESSING"
-        elif code in ["1032", "2001"]:
-            status_result = "FAILED"
-        else:
-            status_result = "FAILED"
-
-        # Update DB
-        try:
-            tx = MpesaTransaction.objects.get(checkout_request_id=message_ref)
+        status_result = status_from_enquiry_code(code)
 
-            items = data.get("TransactionMetadata", {}).get("Items", [])
-            meta = {i["Name"]: i["Value"] for i in items if "Name" in i}
-
-            narration = meta.get("Narration")
-            receipt = narration.split("~")[1] if narration and "~" in narration else None
-
-            tx.status = status_result
-
-            if status_result == "SUCCESS":
-                if receipt:
-                    tx.mpesa_receipt_number = receipt
-                tx.transaction_date = data.get("MessageDateTime")
-
-            tx.save()
-
-        except MpesaTransaction.DoesNotExist:
-            pass
+        # Update DB (only while the transaction is still open)
+        receipt, transaction_date = parse_result_metadata(data)
+        apply_result(Q(checkout_request_id=message_ref), status_result, receipt, transaction_date, source="status_check")
 
         return Response({
             "checkout_request_id": message_ref,
@@ -249,42 +308,154 @@ class MpesaTransactionsAPIView(ListAPIView):
     permission_classes = [IsTreasurer]
 
     def get_queryset(self):
-        queryset = MpesaTransaction.objects.all().order_by("-id")
+        queryset = MpesaTransaction.objects.prefetch_related("purposes").order_by("-id")
+        return filter_transactions(queryset, self.request.query_params)
+
+    @property
+    def paginator(self):
+        """
+        Keyset (cursor) pagination by default.
+        ?page=N keeps the old page-number responses working.
+        """
+        if not hasattr(self, "_paginator"):
+            if "page" in self.request.query_params:
+                self._paginator = PageNumberPagination()
+            else:
+                self._paginator = TransactionCursorPagination()
+        return self._paginator
 
-        status_q = self.request.query_params.get("status")
-        purpose = self.request.query_params.get("purpose")
-        search = self.request.query_params.get("search")
-        start_date = self.request.query_params.get("start_date")
-        end_date = self.request.query_params.get("end_date")
 
-        # Filter by status
-        if status_q and status_q != "all":
-            queryset = queryset.filter(status__iexact=status_q)
 
-        # Filter by specific purpose inside children
+# ----------------- Export Transactions -------------------
+class TransactionExportAPIView(APIView):
+    """
+    Stream the filtered ledger as CSV (default) or XLSX.
+    GET ?type=csv|xlsx plus the same filters as the transaction list
+    (status, purpose, search, start_date, end_date).
+    """
+    permission_classes = [IsTreasurer]
+
+    def get(self, request):
+        export_type = request.query_params.get("type", "csv")
+        queryset = filter_transactions(MpesaTransaction.objects.all(), request.query_params)
+        filename = f"transactions-{datetime.now():%Y%m%d}"
+
+        if export_type == "xlsx":
+            try:
+                output = write_xlsx(export_rows(queryset))
+            except ImportError:
+                return Response({"error": "XLSX export needs openpyxl installed"}, status=400)
+            return FileResponse(
+                output,
+                as_attachment=True,
+                filename=f"{filename}.xlsx",
+                content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+
+        if export_type != "csv":
+            return Response({"error": "type must be csv or xlsx"}, status=400)
+
+        response = StreamingHttpResponse(stream_csv(export_rows(queryset)), content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+        return response
+
+
+
+# ----------------- Search Transactions -------------------
+class TransactionSearchAPIView(APIView):
+    """
+    Ranked transaction search for treasurers.
+    GET ?q=<name / phone / email / receipt>&limit=<max 200>
+    """
+    permission_classes = [IsTreasurer]
+
+    def get(self, request):
+        term = request.query_params.get("q", "").strip()
+        if not term:
+            return Response({"error": "q is required"}, status=400)
+
+        try:
+            limit = min(int(request.query_params.get("limit", 50)), 200)
+        except ValueError:
+            limit = 50
+
+        queryset = search_transactions(
+            MpesaTransaction.objects.prefetch_related("purposes"), term, limit
+        )
+        results = []
+        for tx in queryset:
+            data = MpesaTransactionSerializer(tx).data
+            data["rank"] = round(tx.rank, 3)
+            results.append(data)
+
+        return Response({"query": term, "results": results})
+
+
+
+# ----------------- Giving Dashboard -------------------
+class GivingSummaryAPIView(APIView):
+    """
+    Giving totals for dashboard charts, read from GivingRollup.
+    GET ?period=day|week|month&start_date=&end_date=&status=SUCCESS&purpose=
+    """
+    permission_classes = [IsTreasurer]
+
+    def get(self, request):
+        period = request.query_params.get("period", GivingRollup.MONTH)
+        if period not in dict(GivingRollup.PERIOD_CHOICES):
+            return Response({"error": "period must be day, week or month"}, status=400)
+
+        status_q = request.query_params.get("status", "SUCCESS")
+        purpose = request.query_params.get("purpose")
+        start_date = parse_day(request.query_params.get("start_date"))
+        end_date = parse_day(request.query_params.get("end_date"))
+        for name, value in (("start_date", start_date), ("end_date", end_date)):
+            if request.query_params.get(name) and value is None:
+                return Response({"error": f"{name} must be YYYY-MM-DD"}, status=400)
+
+        rollups = GivingRollup.objects.filter(period=period).exclude(count=0)
+        if status_q != "all":
+            rollups = rollups.filter(status=status_q.upper())
         if purpose and purpose != "all":
-            queryset = queryset.filter(purposes__purpose__iexact=purpose)
-
-        # Search
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search)
-                | Q(phone_number__icontains=search)
-                | Q(email__icontains=search)
-                | Q(mpesa_receipt_number__icontains=search)
-            ).distinct()
-
-        # Date filters
+            rollups = rollups.filter(purpose=purpose)
         if start_date:
-            queryset = queryset.filter(transaction_date__date__gte=start_date)
-
+            rollups = rollups.filter(bucket__gte=start_date)
         if end_date:
-            queryset = queryset.filter(transaction_date__date__lte=end_date)
+            rollups = rollups.filter(bucket__lte=end_date)
 
-        return queryset
+        results = list(
+            rollups.order_by("bucket", "purpose", "status")
+            .values("bucket", "purpose", "status", "amount", "count")
+        )
+
+        totals = {}
+        for row in results:
+            totals[row["purpose"]] = totals.get(row["purpose"], 0) + row["amount"]
+
+        return Response({"period": period, "results": results, "totals": totals})
 
 
 
+# ----------------- Fund Balances (ledger) -------------------
+class FundBalancesAPIView(APIView):
+    """
+    Ledger balance per fund (and the M-Pesa clearing account).
+    GET ?as_of=YYYY-MM-DD for balances at the end of that day.
+    """
+    permission_classes = [IsTreasurer]
+
+    def get(self, request):
+        as_of = request.query_params.get("as_of")
+        if not as_of:
+            return Response({"as_of": None, "results": balances()})
+
+        start = day_start(as_of)
+        if start is None:
+            return Response({"error": "as_of must be YYYY-MM-DD"}, status=400)
+        moment = start + timedelta(days=1) - timedelta(microseconds=1)
+        return Response({"as_of": as_of, "results": balances_as_of(moment)})
+
+
 # ----------------- Check Transaction Status -------------------
 class TransactionStatusAPIView(APIView):
     permission_classes = [AllowAny]
@@ -309,13 +480,128 @@ class TransactionStatusAPIView(APIView):
             for p in transaction.purposes.all()
         ]
 
-        tag = "#MULTI" if len(purposes) > 1 else f"#{purposes[0]['purpose'].upper()}"
-
         return Response({
             "status": transaction.status,
             "mpesa_receipt_number": transaction.mpesa_receipt_number,
             "transaction_date": transaction.transaction_date,
             "total_amount": transaction.total_amount,
             "purposes": purposes,
-            "tag": tag
-        })
\ No newline at end of file
+            # Rows from before the tag column was backfilled have it empty
+            "tag": transaction.purpose_tag or purpose_tag(p["purpose"] for p in purposes)
+        })
+
+
+
+# ----------------- Co-op Integration Metrics -------------------
+class CoopMetricsAPIView(APIView):
+    """Token / status cache counters, circuit breaker state and bulkhead usage (per worker)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "token_cache": token_cache.stats(),
+            "status_cache": status_cache.stats(),
+            "circuit_breaker": bank_client.breaker.stats(),
+            "bulkhead": bank_client.bulkhead.stats(),
+        })
+
+
+
+# ----------------- Live Transaction Status (SSE) -------------------
+def sse_status(payload):
+    return f"event: status\ndata: {json.dumps(payload)}\n\n"
+
+
+async def transaction_status_stream(request):
+    """
+    Push the final status of a payment instead of having the donor poll.
+
+    GET ?checkout_request_id=<ref>
+      Server-Sent Events: an initial `status` event, keep-alive comments,
+      then a final `status` event once the payment is SUCCESS/FAILED.
+    GET ?checkout_request_id=<ref>&mode=poll
+      Long-poll fallback: answers as soon as the status is final, or with
+      the current status after LIVE_STATUS_LONG_POLL_TIMEOUT seconds.
+
+    Under ASGI waiting donors cost coroutines, not workers. Under WSGI each
+    wait holds a worker thread, so both modes are cut short after
+    LIVE_STATUS_WSGI_WAIT seconds: the long-poll answers with the current
+    status and the event stream closes (EventSource reconnects by itself).
+    """
+    checkout_request_id = request.GET.get("checkout_request_id")
+    if not checkout_request_id:
+        return JsonResponse({"error": "checkout_request_id is required"}, status=400)
+
+    current = await sync_to_async(current_status)(checkout_request_id)
+    if current is None:
+        return JsonResponse({"status": "not_found"}, status=404)
+
+    # Only ASGI requests carry a scope
+    if getattr(request, "scope", None) is None:
+        return wsgi_status_response(request, checkout_request_id, current)
+
+    # Both modes wait inside the response body, which is iterated after the
+    # (partly sync) middleware stack has returned - so no thread is held.
+    if request.GET.get("mode") == "poll":
+        async def long_poll():
+            result = current
+            if result["status"] not in TERMINAL:
+                final = await status_hub.wait(checkout_request_id, settings.LIVE_STATUS_LONG_POLL_TIMEOUT)
+                result = final or result
+            yield json.dumps(result)
+
+        return StreamingHttpResponse(long_poll(), content_type="application/json")
+
+    async def events():
+        yield sse_status(current)
+        if current["status"] in TERMINAL:
+            return
+
+        waited = 0
+        while waited < settings.LIVE_STATUS_STREAM_TIMEOUT:
+            final = await status_hub.wait(checkout_request_id, settings.LIVE_STATUS_KEEPALIVE)
+            if final:
+                yield sse_status(final)
+                return
+            waited += settings.LIVE_STATUS_KEEPALIVE
+            yield ": keep-alive\n\n"
+
+        yield "event: timeout\ndata: {}\n\n"
+
+    return sse_response(events())
+
+
+def wsgi_status_response(request, checkout_request_id, current):
+    """
+    The WSGI side of transaction_status_stream: a sync generator WSGI can
+    send chunk by chunk, holding the worker for LIVE_STATUS_WSGI_WAIT at most.
+    """
+    wait = settings.LIVE_STATUS_WSGI_WAIT
+
+    if request.GET.get("mode") == "poll":
+        def long_poll():
+            result = current
+            if result["status"] not in TERMINAL:
+                result = wait_for_final_status(checkout_request_id, wait) or result
+            yield json.dumps(result)
+
+        return StreamingHttpResponse(long_poll(), content_type="application/json")
+
+    def events():
+        # How long the browser waits before reconnecting once we close
+        yield f"retry: {int(settings.LIVE_STATUS_POLL_INTERVAL * 1000)}\n\n"
+        yield sse_status(current)
+        if current["status"] in TERMINAL:
+            return
+        latest = wait_for_final_status(checkout_request_id, wait)
+        if latest and latest["status"] in TERMINAL:
+            yield sse_status(latest)
+
+    return sse_response(events())
+
+
+def sse_response(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
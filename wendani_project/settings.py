@@ -3,6 +3,7 @@ from pathlib import Path
 from dotenv import load_dotenv
 from datetime import timedelta
 from decouple import config
+from corsheaders.defaults import default_headers
 
 # ---------------------------------------------------------
 # BASE DIRECTORY & ENVIRONMENT
@@ -88,6 +89,7 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:8080",
 ]
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 # ---------------------------------------------------------
 # URLS & TEMPLATES
@@ -133,6 +135,28 @@ DATABASES = {
 #     }
 # }
 
+# ---------------------------------------------------------
+# CACHE
+# ---------------------------------------------------------
+# Shared by every worker: the bank token, circuit breaker and status
+# enquiry leases live here. Database table by default (run
+# `manage.py createcachetable` once); set REDIS_URL to use Redis instead.
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "django_cache",
+        }
+    }
+
 # ---------------------------------------------------------
 # STATIC FILES (served via Nginx)
 # ---------------------------------------------------------
@@ -182,6 +206,58 @@ COOPBANK_STATUS_URL = os.getenv("COOPBANK_STATUS_URL")
 
 COOPBANK_CALLBACK_URL = os.getenv("COOPBANK_CALLBACK_URL")
 
+# OAuth token cache: "memory" (per worker), "cache" (Django cache) or "db"
+COOPBANK_TOKEN_STORE = os.getenv("COOPBANK_TOKEN_STORE", "cache")
+# Refresh the token this many seconds before it expires
+COOPBANK_TOKEN_REFRESH_MARGIN = int(os.getenv("COOPBANK_TOKEN_REFRESH_MARGIN", "60"))
+
+# Pooled HTTP client: (connect, read) timeouts in seconds per endpoint
+COOPBANK_TIMEOUTS = {
+    "token": (3.05, 10),
+    "stk_push": (3.05, 20),
+    "stk_status": (3.05, 10),
+}
+COOPBANK_POOL_SIZE = int(os.getenv("COOPBANK_POOL_SIZE", "10"))
+# Retries for idempotent calls only (token, status enquiry), never STK push
+COOPBANK_MAX_RETRIES = int(os.getenv("COOPBANK_MAX_RETRIES", "2"))
+
+# Circuit breaker: open after N consecutive failures, probe again after
+# RESET seconds. State lives in the shared cache (CACHES), so it is shared
+# by every worker
+COOPBANK_BREAKER_FAILURES = int(os.getenv("COOPBANK_BREAKER_FAILURES", "5"))
+COOPBANK_BREAKER_RESET = int(os.getenv("COOPBANK_BREAKER_RESET", "30"))
+# Bulkhead: bank calls in flight per worker process (not shared: N workers
+# allow N x SIZE calls in total), and how long (seconds) a caller waits for
+# a slot before failing fast
+COOPBANK_BULKHEAD_SIZE = int(os.getenv("COOPBANK_BULKHEAD_SIZE", "4"))
+COOPBANK_BULKHEAD_WAIT = float(os.getenv("COOPBANK_BULKHEAD_WAIT", "0.5"))
+
+# Queue STK pushes for `manage.py run_stk_dispatcher` and answer 202 at once
+COOPBANK_ASYNC_DISPATCH = os.getenv("COOPBANK_ASYNC_DISPATCH", "False").lower() == "true"
+
+# Callbacks are stored and acknowledged, then applied by
+# `manage.py process_mpesa_callbacks`. Set true to also apply them in the request.
+COOPBANK_CALLBACK_INLINE = os.getenv("COOPBANK_CALLBACK_INLINE", "False").lower() == "true"
+# A callback that fails this many times is marked "error" and left for a person
+COOPBANK_CALLBACK_MAX_ATTEMPTS = int(os.getenv("COOPBANK_CALLBACK_MAX_ATTEMPTS", "5"))
+
+# Status enquiry cache (seconds): while the push is open / once the bank says it is final
+COOPBANK_STATUS_CACHE_TTL = int(os.getenv("COOPBANK_STATUS_CACHE_TTL", "5"))
+COOPBANK_STATUS_FINAL_TTL = int(os.getenv("COOPBANK_STATUS_FINAL_TTL", "3600"))
+
+# Live status stream (seconds)
+LIVE_STATUS_POLL_INTERVAL = float(os.getenv("LIVE_STATUS_POLL_INTERVAL", "1.0"))
+LIVE_STATUS_KEEPALIVE = 15
+LIVE_STATUS_STREAM_TIMEOUT = 300
+LIVE_STATUS_LONG_POLL_TIMEOUT = 25
+# Under WSGI every wait holds a worker thread, so it is cut short at this
+LIVE_STATUS_WSGI_WAIT = int(os.getenv("LIVE_STATUS_WSGI_WAIT", "10"))
+
+# Payment initiation idempotency (seconds): how long an Idempotency-Key is
+# honoured, and the window in which identical requests without one are merged
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_WINDOW = int(os.getenv("IDEMPOTENCY_WINDOW", "120"))
+
 
 # ---------------------------------------------------------
 # EMAIL CONFIGURATION SETTINGS
@@ -198,6 +274,35 @@ DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
 # 2. Notification Recipient
 NOTIFICATION_EMAIL = os.getenv("EMAIL_HOST_USER")
 
+# Email outbox (`manage.py send_outbox_emails`): attempts before an email is
+# dead-lettered, and the retry backoff in seconds (doubles each attempt, capped)
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+EMAIL_OUTBOX_RETRY_BASE = int(os.getenv("EMAIL_OUTBOX_RETRY_BASE", "60"))
+EMAIL_OUTBOX_RETRY_MAX = int(os.getenv("EMAIL_OUTBOX_RETRY_MAX", "3600"))
+
+# Submission notifications per form type (model name): "immediate" sends one
+# email per submission, "digest" one email per interval per recipient role
+# (`manage.py send_submission_digests`). The "office" role is
+# NOTIFICATION_EMAIL; other roles are listed in NOTIFICATION_ROLES.
+NOTIFICATION_ROLES = {
+    "pastoral": [e.strip() for e in os.getenv("PASTORAL_NOTIFICATION_EMAILS", "").split(",") if e.strip()],
+}
+NOTIFICATION_DIGEST_FORMS = [f.strip() for f in os.getenv("NOTIFICATION_DIGEST_FORMS", "").split(",") if f.strip()]
+NOTIFICATION_DIGEST_INTERVAL = int(os.getenv("NOTIFICATION_DIGEST_INTERVAL", "60"))  # minutes
+NOTIFICATION_DIGEST_MAX_ITEMS = 100  # submissions written out in full per type
+NOTIFICATION_DIGEST_SETTLE = 60  # seconds a submission waits before a digest picks it up
+SUBMISSION_NOTIFICATIONS = {
+    form: {"mode": "digest" if form in NOTIFICATION_DIGEST_FORMS else "immediate", "roles": roles}
+    for form, roles in {
+        "prayerrequestform": ["office", "pastoral"],
+        "baptismrequestform": ["office", "pastoral"],
+        "dedicationform": ["office", "pastoral"],
+        "membershiptransferform": ["office"],
+        "benevolenceform": ["office"],
+        "contactform": ["office"],
+    }.items()
+}
+
 
 FRONTEND_BASE_URL = 'https://kahawawendanisda.org/admin/dashboard'
 